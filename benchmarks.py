@@ -0,0 +1,267 @@
+# -----------------------------------------------------------------------------
+# Benchmarks: Tree Walking and Content Extraction
+# -----------------------------------------------------------------------------
+"""
+Benchmarks of the extractor on generated project trees.
+
+    python benchmarks.py walk --files 100000
+    python benchmarks.py walk --root path/to/project
+    python benchmarks.py extract --files 300 --workers 4
+
+`walk` times the original os.listdir walker (recursive, isdir/getsize per entry)
+against the os.scandir walker, on structure-only scans and on scans that also
+read every file's size, and checks that both render the same structure. The
+tree is generated in a temporary directory unless --root is given; timings are
+taken with a warm page cache, so they measure syscall and Python overhead.
+
+`extract` times build_context(extract_content=True) on a folder of xlsx, docx
+and ipynb files, parsed in-process and in the process pool, with the caches
+and the persistent index off so that every run parses every file.
+"""
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import List, Dict, Optional, Any, Tuple, Callable
+
+from utils import ProjectContextExtractor, ExtractionCache, DOCX_AVAILABLE, openpyxl
+
+
+# -----------------------------------------------------------------------------
+# Generated Trees
+# -----------------------------------------------------------------------------
+# Extensions of generated files; the last one is not in the extractor's allowlist
+WALK_EXTENSIONS: Tuple[str, ...] = ('.py', '.md', '.txt', '.json', '.bin')
+
+
+def generate_tree(root: str, files: int, files_per_dir: int = 25, fanout: int = 16) -> int:
+    """
+    Writes `files` small files under root, files_per_dir per directory, in a tree
+    with `fanout` subdirectories per level. Returns the number of directories.
+    """
+    directories: int = max(1, -(-files // files_per_dir))
+    depth: int = 1
+    while fanout ** depth < directories:
+        depth += 1
+    written: int = 0
+    for d in range(directories):
+        parts: List[str] = []
+        k = d
+        for _ in range(depth):
+            parts.append(f"d{k % fanout:02d}")
+            k //= fanout
+        directory = os.path.join(root, *reversed(parts))
+        os.makedirs(directory, exist_ok=True)
+        for i in range(min(files_per_dir, files - written)):
+            with open(os.path.join(directory, f"file_{i:03d}{WALK_EXTENSIONS[i % len(WALK_EXTENSIONS)]}"), "w") as f:
+                f.write("x = 1\n")
+        written += files_per_dir
+    return directories
+
+
+def generate_documents(root: str, files: int) -> Dict[str, int]:
+    """
+    Writes `files` heavy documents under root, a third each of xlsx (200 rows of
+    10 cells), docx (80 paragraphs) and ipynb (40 cells). Formats whose library is
+    missing are skipped. Returns the count written per extension.
+    """
+    kinds: List[str] = [".ipynb"]
+    if openpyxl:
+        kinds.append(".xlsx")
+    if DOCX_AVAILABLE:
+        kinds.append(".docx")
+    counts: Dict[str, int] = {kind: 0 for kind in kinds}
+    for i in range(files):
+        kind: str = kinds[i % len(kinds)]
+        path: str = os.path.join(root, f"batch_{i // 50:02d}", f"doc_{i:04d}{kind}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if kind == ".xlsx":
+            workbook = openpyxl.Workbook(write_only=True)
+            sheet = workbook.create_sheet("data")
+            for row in range(200):
+                sheet.append([f"r{row}c{col} value {row * col}" for col in range(10)])
+            workbook.save(path)
+        elif kind == ".docx":
+            from docx import Document
+            document = Document()
+            for paragraph in range(80):
+                document.add_paragraph(f"Paragraph {paragraph} of document {i}: " + "lorem ipsum dolor sit amet " * 4)
+            document.save(path)
+        else:
+            cells = [
+                {"cell_type": "code" if c % 2 else "markdown", "metadata": {}, "source": [f"# cell {c}\n", f"value = {c} * {i}\n"] * 5}
+                for c in range(40)
+            ]
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}, f)
+        counts[kind] += 1
+    return counts
+
+
+def _timed(fn: Callable[[], Any], repeat: int) -> Tuple[List[float], Any]:
+    """Runs fn `repeat` times; returns the durations and the last result."""
+    durations: List[float] = []
+    result: Any = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - started)
+    return durations, result
+
+
+def _summary(durations: List[float], items: int) -> Dict[str, Any]:
+    ordered = sorted(durations)
+    best: float = ordered[0]
+    return {
+        'best_s': round(best, 3),
+        'median_s': round(ordered[len(ordered) // 2], 3),
+        'files_per_s': round(items / best) if best else 0,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Walk Benchmark
+# -----------------------------------------------------------------------------
+def legacy_walk(extractor: ProjectContextExtractor, folder_path: str, with_sizes: bool, indent_level: int = 0) -> Tuple[List[str], int]:
+    """
+    The walker get_folder_structure_and_content used before the scandir rewrite:
+    sorted os.listdir, os.path.isdir per entry, os.path.getsize per file when
+    contents are extracted. Returns the structure lines and the total size.
+    """
+    structure_output: List[str] = []
+    total_size: int = 0
+    try:
+        items: List[str] = sorted(os.listdir(folder_path))
+    except Exception as ex:
+        return [f"{'    ' * indent_level}[Cannot open: {ex}]"], 0
+
+    for item in items:
+        if item in extractor.exclusions:
+            continue
+        item_path: str = os.path.join(folder_path, item)
+        if os.path.isdir(item_path):
+            structure_output.append(f"{'    ' * indent_level}{item}/")
+            sub_structure, sub_size = legacy_walk(extractor, item_path, with_sizes, indent_level + 1)
+            structure_output.extend(sub_structure)
+            total_size += sub_size
+        else:
+            if os.path.splitext(item_path)[1].lower() not in extractor.extensions:
+                continue
+            structure_output.append(f"{'    ' * indent_level}{item}")
+            if with_sizes:
+                total_size += os.path.getsize(item_path)
+    return structure_output, total_size
+
+
+def scandir_walk(extractor: ProjectContextExtractor, folder_path: str, with_sizes: bool) -> Tuple[List[str], int]:
+    """The current walker (scan_tree + render_tree); sizes come from the DirEntry stat cache."""
+    extractor.get_matcher(folder_path, reset=True)
+    structure_output, _, files = extractor.render_tree(folder_path, extractor.scan_tree(folder_path))
+    total_size: int = sum(entry.stat().st_size for _, _, entry in files) if with_sizes else 0
+    return structure_output, total_size
+
+
+def run_walk(args: argparse.Namespace) -> Dict[str, Any]:
+    root: str = args.root or tempfile.mkdtemp(prefix="dmc-walk-")
+    generated: bool = not args.root
+    try:
+        if generated:
+            started = time.perf_counter()
+            directories = generate_tree(root, args.files)
+            print(f"Generated {args.files} files in {directories} directories ({time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+        extractor = ProjectContextExtractor()
+        extractor.exclusions = extractor.DEFAULT_EXCLUSIONS.union(extractor.exclusions)
+        # The legacy walker knows nothing of ignore files
+        extractor.respect_ignore_files = False
+
+        report: Dict[str, Any] = {'root': root if not generated else "(generated)"}
+        for label, with_sizes in (("structure", False), ("structure_and_sizes", True)):
+            legacy_times, legacy = _timed(lambda: legacy_walk(extractor, root, with_sizes), args.repeat)
+            scandir_times, current = _timed(lambda: scandir_walk(extractor, root, with_sizes), args.repeat)
+            if legacy != current:
+                raise RuntimeError(f"The walkers disagree on {label}")
+            listed: int = sum(1 for line in current[0] if not line.endswith("/"))
+            report['listed_files'] = listed
+            report[label] = {
+                'listdir': _summary(legacy_times, listed),
+                'scandir': _summary(scandir_times, listed),
+                'speedup': round(min(legacy_times) / min(scandir_times), 2),
+            }
+        return report
+    finally:
+        if generated and not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+# -----------------------------------------------------------------------------
+# Extraction Benchmark
+# -----------------------------------------------------------------------------
+def _extract_once(root: str, workers: int) -> str:
+    """One full build_context with fresh, disabled caches (pool start-up included)."""
+    extractor = ProjectContextExtractor()
+    extractor.index_enabled = False
+    extractor.cache = ExtractionCache(max_bytes=0)
+    extractor.process_workers = workers
+    try:
+        return extractor.build_context(root, extract_content=True)
+    finally:
+        extractor.shutdown()
+
+
+def run_extract(args: argparse.Namespace) -> Dict[str, Any]:
+    root: str = args.root or tempfile.mkdtemp(prefix="dmc-extract-")
+    generated: bool = not args.root
+    try:
+        report: Dict[str, Any] = {'root': root if not generated else "(generated)", 'cpus': os.cpu_count()}
+        if generated:
+            started = time.perf_counter()
+            report['documents'] = generate_documents(root, args.files)
+            print(f"Generated {args.files} documents ({time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+        serial_times, serial = _timed(lambda: _extract_once(root, 1), args.repeat)
+        pool_times, pooled = _timed(lambda: _extract_once(root, args.workers), args.repeat)
+        if serial != pooled:
+            raise RuntimeError("In-process and process-pool extraction disagree")
+        documents: int = sum(1 for line in serial.splitlines() if line.lstrip().startswith("File: "))
+        report['extracted_files'] = documents
+        report['in_process'] = _summary(serial_times, documents)
+        report[f'process_pool_{args.workers}'] = _summary(pool_times, documents)
+        report['speedup'] = round(min(serial_times) / min(pool_times), 2)
+        return report
+    finally:
+        if generated and not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+# -----------------------------------------------------------------------------
+# Command Line
+# -----------------------------------------------------------------------------
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the DMC extractor.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    walk = commands.add_parser("walk", help="Compare the listdir and scandir tree walkers")
+    walk.add_argument("--files", type=int, default=100000, help="Files in the generated tree")
+    walk.add_argument("--root", help="Walk an existing folder instead of a generated tree")
+    walk.add_argument("--repeat", type=int, default=3)
+    walk.add_argument("--keep", action="store_true", help="Keep the generated tree")
+
+    extract = commands.add_parser("extract", help="Compare in-process and process-pool extraction of heavy formats")
+    extract.add_argument("--files", type=int, default=300, help="Documents in the generated folder")
+    extract.add_argument("--root", help="Extract an existing folder instead of generated documents")
+    extract.add_argument("--workers", type=int, default=4, help="Process pool size")
+    extract.add_argument("--repeat", type=int, default=3)
+    extract.add_argument("--keep", action="store_true", help="Keep the generated folder")
+
+    args = parser.parse_args(argv)
+    report = run_walk(args) if args.command == "walk" else run_extract(args)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
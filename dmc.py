@@ -0,0 +1,486 @@
+# -----------------------------------------------------------------------------
+# Headless Smart-Context Pipeline & Command Line Interface
+# -----------------------------------------------------------------------------
+"""
+GUI-free version of the Brain + Worker pipeline used by the Project Chat tab.
+
+    python -m dmc ask --root path/to/project --question "Where is the API client?"
+    python -m dmc batch --root path/to/project --input questions.jsonl --output answers.jsonl
+
+Batch input is JSONL: one {"id": ..., "question": ...} object (or a bare JSON
+string) per line. Questions run concurrently against one shared extractor, so
+file contents are extracted once and reused across questions.
+"""
+import sys
+import os
+import json
+import re
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Any, Tuple, Callable
+
+from utils import (
+    ProjectContextExtractor,
+    NUMPY_AVAILABLE,
+    BrainSelectionCache,
+    ApiError,
+    ContextLengthError,
+    chat_completion,
+    count_tokens,
+    model_token_budget,
+)
+
+BRAIN_MODEL: str = "gpt-5-mini"
+WORKER_MODEL: str = "gpt-5.1"
+
+# File selection strategies: the Brain model, or one of the extractor's local indexes
+SELECTORS: Tuple[str, ...] = ("brain", "keyword", "semantic")
+
+# Files taken from the BM25 ranking: offered to the Brain, or used directly by the keyword selector
+SHORTLIST_SIZE: int = 15
+LOCAL_FILTER_LIMIT: int = 20
+LOCAL_FILTER_AGGRESSIVE_LIMIT: int = 5
+# Code chunks taken from the embedding index by the semantic selector
+SEMANTIC_CHUNK_LIMIT: int = 40
+SEMANTIC_AGGRESSIVE_CHUNK_LIMIT: int = 12
+# Tokens of project structure per Brain prompt; larger trees are compacted further
+BRAIN_STRUCTURE_BUDGET: int = 20000
+
+
+# -----------------------------------------------------------------------------
+# Prompts
+# -----------------------------------------------------------------------------
+def build_system_prompt(specific_context: str) -> str:
+    """System prompt of the Worker, wrapping the project context."""
+    return f"""You are an expert coding assistant.
+Project context:
+#####
+{specific_context}
+#####
+If the context above is just a structure, it means the project is too large. Do your best with just filenames.
+"""
+
+
+def build_brain_prompt(structure: str, question: str, aggressive: bool = False, shortlist: Optional[List[str]] = None) -> str:
+    """
+    Prompt asking the Brain for the files relevant to a question. A shortlist
+    (files ranked by a local content search) is offered as a hint when given.
+    """
+    if aggressive:
+        instruction = "Select ONLY the top 5 absolute most critical files needed to answer. Be extremely strict."
+    else:
+        instruction = "Select all files that might be relevant to the user request."
+
+    hint: str = ""
+    if shortlist:
+        hint = "\nFiles whose contents best match the request (keyword search, best first):\n" + "\n".join(shortlist) + "\n"
+
+    return f"""
+You are the Context Optimizer. 
+Project Structure:
+{structure}
+{hint}
+User Request: "{question}"
+
+Task: {instruction}
+Return a JSON list of file paths (strings) relative to root. Example: ["src/main.py", "utils.py"]
+Do not write markdown, just the JSON array.
+"""
+
+
+def brain_structure(extractor: ProjectContextExtractor, root_path: str) -> str:
+    """
+    The project structure shown to the Brain: compact_structure within
+    BRAIN_STRUCTURE_BUDGET, or half the Brain's token budget when that is smaller.
+    """
+    budget: int = min(BRAIN_STRUCTURE_BUDGET, model_token_budget(BRAIN_MODEL) // 2)
+    return extractor.compact_structure(root_path, budget)
+
+
+def parse_file_list(response: str) -> List[str]:
+    """Extracts the Brain's JSON file list. Raises ValueError if there is none."""
+    clean_resp = response.strip()
+    if "```" in clean_resp:
+        match = re.search(r'\[.*\]', clean_resp, re.DOTALL)
+        if match:
+            clean_resp = match.group(0)
+
+    relevant_files = json.loads(clean_resp)
+    if not isinstance(relevant_files, list):
+        raise ValueError("Not a list")
+    return relevant_files
+
+
+def local_selection(extractor: ProjectContextExtractor, root_path: str, question: str, selector: str, aggressive: bool = False) -> List[str]:
+    """
+    Context targets picked without a model call: the files ranked best by keyword
+    search, or, for the semantic selector, the closest code chunks ("path:start-end").
+    """
+    if selector == "semantic":
+        limit = SEMANTIC_AGGRESSIVE_CHUNK_LIMIT if aggressive else SEMANTIC_CHUNK_LIMIT
+        return [target for target, _ in extractor.semantic_search(root_path, question, limit)]
+    limit = LOCAL_FILTER_AGGRESSIVE_LIMIT if aggressive else LOCAL_FILTER_LIMIT
+    return [rel for rel, _ in extractor.rank_files(root_path, question, limit)]
+
+
+# -----------------------------------------------------------------------------
+# Pipeline
+# -----------------------------------------------------------------------------
+class PipelineResult:
+    """Outcome of one question: the answer or error, plus how it was obtained."""
+
+    def __init__(self, question: str) -> None:
+        self.question: str = question
+        self.answer: Optional[str] = None
+        self.error: Optional[str] = None
+        self.selected_files: List[str] = []
+        self.selected_by: str = ""  # "symbols", "cache", "brain", "keyword" or "semantic"
+        self.dependencies: List[str] = []  # Files added because the selected files import them
+        self.attempts: int = 0
+        self.mode: str = ""  # "smart", "aggressive" or "structure"
+        self.context_tokens: int = 0
+        self.latency_s: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'question': self.question,
+            'answer': self.answer,
+            'error': self.error,
+            'selected_files': self.selected_files,
+            'selected_by': self.selected_by,
+            'dependencies': self.dependencies,
+            'attempts': self.attempts,
+            'mode': self.mode,
+            'context_tokens': self.context_tokens,
+            'latency_s': round(self.latency_s, 3),
+        }
+
+
+class SmartContextPipeline:
+    """
+    Runs the Brain + Worker flow of the Project Chat tab without widgets.
+
+    Attempt 1 lets the Brain select files, attempt 2 selects aggressively, and
+    attempt 3 sends the structure only; the next attempt only runs after a
+    ContextLengthError (transient errors are retried by the request layer).
+    With the "keyword" or "semantic" selector, local_selection replaces the Brain,
+    and with symbols, questions naming project symbols get their definitions and callers.
+    With dependencies, attempt 1 also sends the files the selected files import.
+    ask() is thread-safe, so one pipeline can serve many questions concurrently.
+    """
+
+    MAX_ATTEMPTS: int = 3
+
+    def __init__(
+        self,
+        root_path: str,
+        extractor: Optional[ProjectContextExtractor] = None,
+        selection_cache: Optional[BrainSelectionCache] = None,
+        smart_filtering: bool = True,
+        selector: str = "brain",
+        symbols: bool = True,
+        dependencies: bool = True,
+    ) -> None:
+        self.root_path: str = os.path.abspath(root_path)
+        self.extractor: ProjectContextExtractor = extractor or ProjectContextExtractor()
+        self.selection_cache: Optional[BrainSelectionCache] = selection_cache
+        self.smart_filtering: bool = smart_filtering
+        self.selector: str = selector
+        self.symbols: bool = symbols
+        self.dependencies: bool = dependencies
+        self.structure: str = ""
+        self._lock = threading.Lock()
+
+    def load(self) -> str:
+        """Scans the project structure (required before ask)."""
+        with self._lock:
+            self.structure = self.extractor.build_context(self.root_path, extract_content=False)
+            # Open the persistent index up front so concurrent questions share it
+            self.extractor.get_index(self.root_path)
+            if self.smart_filtering:
+                self.extractor.sync_indexes(
+                    self.root_path, embeddings=self.selector == "semantic",
+                    symbols=self.symbols, imports=self.dependencies
+                )
+            if self.smart_filtering and self.selector == "brain":
+                brain_structure(self.extractor, self.root_path)
+        return self.structure
+
+    def worker_context_budget(self, history: List[Dict[str, str]]) -> int:
+        """Tokens left for the project context once the prompt frame and chat history are counted."""
+        used = count_tokens(build_system_prompt(""))
+        used += sum(count_tokens(m["content"]) for m in history)
+        return max(0, model_token_budget(WORKER_MODEL) - used)
+
+    # --- Pipeline Steps (shared with the GUI, which runs them off its thread) ---
+    def local_targets(self, question: str, aggressive: bool) -> Tuple[Optional[List[str]], str]:
+        """
+        The part of file selection that needs no Brain call. Returns (targets,
+        selected_by): a question naming project symbols gets their definitions and
+        callers; a local selector picks files (see local_selection); the Brain's
+        earlier selection is reused from the selection cache. Returns (None, "brain")
+        when the Brain has to be asked (see brain_request).
+        """
+        if self.symbols:
+            targets = self.extractor.symbol_targets(self.root_path, question, max_callers=0 if aggressive else 5)
+            if targets:
+                return targets, "symbols"
+        if self.selector != "brain":
+            return local_selection(self.extractor, self.root_path, question, self.selector, aggressive), self.selector
+        if self.selection_cache is not None:
+            cached = self.selection_cache.get(self._selection_key(question, aggressive))
+            if cached is not None:
+                return cached, "cache"
+        return None, "brain"
+
+    def brain_request(self, question: str, aggressive: bool) -> List[Dict[str, str]]:
+        """The Brain's file selection request, offering the local BM25 shortlist."""
+        structure: str = brain_structure(self.extractor, self.root_path)
+        shortlist = [rel for rel, _ in self.extractor.rank_files(self.root_path, question, SHORTLIST_SIZE)]
+        return [{"role": "user", "content": build_brain_prompt(structure, question, aggressive, shortlist)}]
+
+    def remember_selection(self, question: str, aggressive: bool, files: List[str]) -> None:
+        """Stores the Brain's selection for identical later questions on the same structure."""
+        if self.selection_cache is not None:
+            self.selection_cache.put(self._selection_key(question, aggressive), files)
+
+    def _selection_key(self, question: str, aggressive: bool) -> str:
+        structure: str = brain_structure(self.extractor, self.root_path)
+        return BrainSelectionCache.make_key(structure, question, aggressive, BRAIN_MODEL)
+
+    def targeted_context(self, files: List[str], history: List[Dict[str, str]], aggressive: bool) -> Tuple[str, List[str]]:
+        """
+        The Worker context for selected targets, packed into what history leaves of the
+        Worker's budget. Unless aggressive, files the selection imports are appended
+        (with dependencies on). Returns (context, dependencies added).
+        """
+        dependencies: List[str] = []
+        if self.dependencies and not aggressive:
+            expanded = self.extractor.expand_with_dependencies(self.root_path, files)
+            dependencies = expanded[len(files):]
+            files = expanded
+        context: str = self.extractor.build_targeted_context(
+            self.root_path, files, token_budget=self.worker_context_budget(history)
+        )
+        return context, dependencies
+
+    def select_files(self, question: str, aggressive: bool) -> Tuple[List[str], str]:
+        """Picks the context targets of a question. Returns (targets, selected_by)."""
+        targets, selected_by = self.local_targets(question, aggressive)
+        if targets is not None:
+            return targets, selected_by
+        response: str = chat_completion(self.brain_request(question, aggressive), BRAIN_MODEL)
+        files = [str(f) for f in parse_file_list(response)]
+        self.remember_selection(question, aggressive, files)
+        return files, "brain"
+
+    def ask(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        on_chunk: Optional[Callable[[str], None]] = None,
+    ) -> PipelineResult:
+        """Answers one question. history holds earlier turns, without this question."""
+        if not self.structure:
+            self.load()
+        started = time.perf_counter()
+        result = PipelineResult(question)
+        turns: List[Dict[str, str]] = list(history or []) + [{"role": "user", "content": question}]
+
+        attempt: int = 1 if self.smart_filtering else 3
+        while attempt <= self.MAX_ATTEMPTS:
+            result.attempts += 1
+            context: str = self.structure
+            result.mode = "structure"
+            if attempt < 3:
+                aggressive = attempt == 2
+                try:
+                    files, result.selected_by = self.select_files(question, aggressive)
+                    result.selected_files = files
+                    context, result.dependencies = self.targeted_context(files, turns, aggressive)
+                    result.mode = "aggressive" if aggressive else "smart"
+                except ContextLengthError:
+                    # The structure alone is too large for the Brain
+                    attempt = 3
+                except ValueError:
+                    # Unparsable selection: structure only, as in the GUI
+                    pass
+                except ApiError as e:
+                    result.error = str(e)
+                    break
+
+            messages = [{"role": "system", "content": build_system_prompt(context)}] + turns
+            result.context_tokens = count_tokens(context)
+            try:
+                result.answer = chat_completion(messages, WORKER_MODEL, stream=on_chunk is not None, on_chunk=on_chunk)
+                break
+            except ContextLengthError:
+                attempt = max(attempt, 1) + 1
+            except ApiError as e:
+                result.error = str(e)
+                break
+        else:
+            result.error = "Project is too voluminous. Even structure-only failed or max retries reached."
+
+        result.latency_s = time.perf_counter() - started
+        return result
+
+    def ask_many(
+        self,
+        questions: List[str],
+        concurrency: int = 4,
+        on_result: Optional[Callable[[int, PipelineResult], None]] = None,
+    ) -> List[PipelineResult]:
+        """Answers questions concurrently, returning results in input order."""
+        if not self.structure:
+            self.load()
+        results: List[Optional[PipelineResult]] = [None] * len(questions)
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="dmc-batch") as pool:
+            futures = [pool.submit(self.ask, q) for q in questions]
+            for i, future in enumerate(futures):
+                results[i] = future.result()
+                if on_result is not None:
+                    on_result(i, results[i])
+        return results
+
+    def close(self) -> None:
+        self.extractor.shutdown()
+        if self.selection_cache is not None:
+            self.selection_cache.close()
+
+
+# -----------------------------------------------------------------------------
+# Command Line
+# -----------------------------------------------------------------------------
+def _read_questions(path: str) -> List[Tuple[Any, str]]:
+    """Reads (id, question) pairs from a JSONL file ("-" for stdin)."""
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    items: List[Tuple[Any, str]] = []
+    try:
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                items.append((number, entry))
+            else:
+                items.append((entry.get('id', number), entry['question']))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return items
+
+
+def _make_pipeline(args: argparse.Namespace) -> SmartContextPipeline:
+    extractor = ProjectContextExtractor()
+    if args.exclude:
+        extractor.set_exclusions(args.exclude)
+    selection_cache: Optional[BrainSelectionCache] = None
+    if not args.no_cache:
+        try:
+            selection_cache = BrainSelectionCache(extractor.cache_dir)
+        except Exception:
+            selection_cache = None
+    return SmartContextPipeline(
+        args.root, extractor, selection_cache, smart_filtering=not args.no_brain, selector=args.selector,
+        symbols=not args.no_symbols, dependencies=not args.no_dependencies
+    )
+
+
+def cmd_ask(args: argparse.Namespace) -> int:
+    pipeline = _make_pipeline(args)
+    try:
+        pipeline.load()
+        on_chunk = None
+        if args.stream and not args.json:
+            def on_chunk(text: str) -> None:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+        result = pipeline.ask(args.question, on_chunk=on_chunk)
+    finally:
+        pipeline.close()
+
+    if args.json:
+        print(json.dumps(result.to_dict(), ensure_ascii=False, indent=2))
+    elif result.error:
+        print(f"Error: {result.error}", file=sys.stderr)
+    elif args.stream:
+        print()
+    else:
+        print(result.answer)
+    return 1 if result.error else 0
+
+
+def cmd_batch(args: argparse.Namespace) -> int:
+    items = _read_questions(args.input)
+    out = sys.stdout if args.output in (None, "-") else open(args.output, "w", encoding="utf-8")
+    pipeline = _make_pipeline(args)
+    failures: int = 0
+    started = time.perf_counter()
+
+    def write(index: int, result: PipelineResult) -> None:
+        nonlocal failures
+        failures += 1 if result.error else 0
+        record = {'id': items[index][0]}
+        record.update(result.to_dict())
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    try:
+        pipeline.load()
+        pipeline.ask_many([q for _, q in items], concurrency=args.concurrency, on_result=write)
+    finally:
+        pipeline.close()
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(items)} questions, {failures} failed, {elapsed:.1f}s "
+        f"({len(items) / elapsed if elapsed else 0:.2f} questions/s) | {pipeline.extractor.cache.describe()}",
+        file=sys.stderr
+    )
+    return 1 if failures else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="dmc", description="Headless DMC smart-context pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(sub: argparse.ArgumentParser) -> None:
+        sub.add_argument("--root", required=True, help="Project folder")
+        sub.add_argument("--exclude", action="append", default=[], help="Extra exclusion (name or glob); repeatable")
+        sub.add_argument("--no-brain", action="store_true", help="Skip file selection and send the structure only")
+        sub.add_argument(
+            "--selector", choices=SELECTORS, default="brain",
+            help="How files are selected: the Brain model, local keyword search, or local semantic chunk search"
+        )
+        sub.add_argument("--no-cache", action="store_true", help="Do not reuse cached Brain selections")
+        sub.add_argument("--no-symbols", action="store_true", help="Do not answer questions naming a symbol from its definitions and callers")
+        sub.add_argument("--no-dependencies", action="store_true", help="Do not add the files imported by the selected files")
+
+    ask = commands.add_parser("ask", help="Answer one question")
+    add_common(ask)
+    ask.add_argument("--question", required=True)
+    ask.add_argument("--stream", action="store_true", help="Print the answer as it is generated")
+    ask.add_argument("--json", action="store_true", help="Print the full result as JSON")
+    ask.set_defaults(handler=cmd_ask)
+
+    batch = commands.add_parser("batch", help="Answer a JSONL file of questions concurrently")
+    add_common(batch)
+    batch.add_argument("--input", required=True, help='JSONL of {"id", "question"} objects or strings ("-" for stdin)')
+    batch.add_argument("--output", help="JSONL results (default: stdout)")
+    batch.add_argument("--concurrency", type=int, default=4)
+    batch.set_defaults(handler=cmd_batch)
+
+    args = parser.parse_args(argv)
+    if args.selector == "semantic" and not NUMPY_AVAILABLE:
+        parser.error("--selector semantic requires numpy")
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
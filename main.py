@@ -3,21 +3,41 @@
 # -----------------------------------------------------------------------------
 import sys
 import os
-import json
 import re
+import sqlite3
+import multiprocessing
 from pathlib import Path
-from typing import List, Dict, Optional, Any, Union
+from typing import List, Dict, Optional, Any, Union, Tuple
 
 from PyQt6 import QtWidgets, QtGui, QtCore
 
 # --- Custom Utilities Import ---
 # Ensure utils.py is present in the same directory
 from utils import (
-    GptWorker,
-    CodeExecutionWorker,
+    get_request_engine,
+    ApiError,
+    ContextLengthError,
     ProjectContextExtractor,
+    BrainSelectionCache,
     markdown_to_html,
-    MARKDOWN_AVAILABLE
+    warm_token_counter,
+    selection_coverage,
+    MARKDOWN_AVAILABLE,
+    NUMPY_AVAILABLE
+)
+from qt_workers import (
+    GptWorker,
+    BackgroundTask,
+    shutdown_background_tasks,
+    CodeExecutionWorker,
+    ProjectWatcher
+)
+from dmc import (
+    SmartContextPipeline,
+    build_system_prompt,
+    parse_file_list,
+    BRAIN_MODEL,
+    WORKER_MODEL
 )
 
 # -----------------------------------------------------------------------------
@@ -33,28 +53,59 @@ class HolaIbotApp(QtWidgets.QWidget):
 
     def __init__(self) -> None:
         super().__init__()
+        # Load the tokenizer before the first count needs it
+        warm_token_counter()
         
         # --- State Management: Tab 1 (Project Chat) ---
         self.extractor: ProjectContextExtractor = ProjectContextExtractor()
         self.chat_history: List[Dict[str, str]] = []
         self.loaded_context: str = ""  # Stores the directory structure text
         self.loaded_path: Optional[str] = None
-        self.gpt_worker: Optional[GptWorker] = None
+        self.chat_worker: Optional[GptWorker] = None  # Brain/Worker call of the chat tab
+
+        # Keeps loaded_context in sync with the file system between reloads
+        self.watcher: ProjectWatcher = ProjectWatcher(self)
+        self.watcher.directoriesChanged.connect(self.on_project_changed)
         
         # Configuration Defaults
         self.context_font_size: int = 7
         self.conversation_font_size: int = 8
         self.markdown_enabled: bool = False 
         self.pre_analysis_enabled: bool = True 
+        self.streaming_enabled: bool = True
+        self.speculative_enabled: bool = False
+        self.selection_mode: str = "brain"  # "brain", "keyword" or "semantic" (see dmc.SELECTORS)
+        self.symbols_enabled: bool = True
+        self.dependencies_enabled: bool = True
         
         # --- Retry & Smart Filtering Logic State ---
         self.current_query_attempt: int = 0
         self.current_user_prompt: str = ""
         self.is_smart_filtering: bool = False
+        self.stream_anchor: Optional[int] = None  # Start of the streamed answer in responseEdit
+        self.pipeline: Optional[SmartContextPipeline] = None  # Selection and context steps, shared with dmc
+        self.chat_task: Optional[BackgroundTask] = None  # Selection or context build in progress
+        self.index_task: Optional[BackgroundTask] = None  # Content index sync in progress
+        self.queued_index_sync: Optional[Tuple[str, Optional[List[str]]]] = None  # (root, changed dirs or None for all)
+
+        # --- Speculative Worker State (Worker runs on a local file guess while the Brain selects) ---
+        self.spec_worker: Optional[GptWorker] = None
+        self.spec_task: Optional[BackgroundTask] = None  # Builds the speculative context
+        self.spec_state: Optional[str] = None  # None, "pending" (awaiting the Brain) or "accepted"
+        self.spec_files: List[str] = []
+        self.spec_chunks: List[str] = []  # Streamed text held back until the speculation is accepted
+        self.spec_outcome: Optional[Tuple[str, Any]] = None  # ("finished", text) or ("failed", error)
+
+        # Past Brain selections, reused for repeated questions on an unchanged tree
+        try:
+            self.selection_cache: Optional[BrainSelectionCache] = BrainSelectionCache(self.extractor.cache_dir)
+        except (sqlite3.Error, OSError):
+            self.selection_cache = None
         
         # --- State Management: Tab 2 (Code Sandbox) ---
         self.sandbox_history: List[Dict[str, str]] = []
         self.current_sandbox_code: str = ""
+        self.sandbox_worker: Optional[GptWorker] = None
         self.exec_worker: Optional[CodeExecutionWorker] = None 
 
         # --- Window Configuration ---
@@ -204,7 +255,10 @@ class HolaIbotApp(QtWidgets.QWidget):
         self.contextEdit.setReadOnly(True)
         context_copy_btn = QtWidgets.QPushButton("Copy Context")
         context_copy_btn.clicked.connect(self.copy_context)
+        self.cacheStatusLabel = QtWidgets.QLabel(self.extractor.cache.describe())
+        self.cacheStatusLabel.setStyleSheet("color:#888; font-weight:normal; font-size:8pt;")
         ctx_layout.addWidget(self.contextEdit)
+        ctx_layout.addWidget(self.cacheStatusLabel)
         ctx_layout.addWidget(context_copy_btn)
         group_ctx.setLayout(ctx_layout)
         left_panel.addWidget(group_ctx, stretch=2)
@@ -230,6 +284,42 @@ class HolaIbotApp(QtWidgets.QWidget):
         self.pre_analysis_checkbox.stateChanged.connect(self.toggle_pre_analysis)
         inner_layout.addWidget(self.pre_analysis_checkbox)
 
+        self.streaming_checkbox = QtWidgets.QCheckBox("Stream Worker responses as they are generated")
+        self.streaming_checkbox.setChecked(self.streaming_enabled)
+        self.streaming_checkbox.stateChanged.connect(self.toggle_streaming)
+        inner_layout.addWidget(self.streaming_checkbox)
+
+        self.speculative_checkbox = QtWidgets.QCheckBox("Speculative mode (start the Worker on a local file guess while the Brain selects)")
+        self.speculative_checkbox.setChecked(self.speculative_enabled)
+        self.speculative_checkbox.stateChanged.connect(self.toggle_speculative)
+        inner_layout.addWidget(self.speculative_checkbox)
+
+        self.symbols_checkbox = QtWidgets.QCheckBox("Definition-level context when the question names a function or class")
+        self.symbols_checkbox.setChecked(self.symbols_enabled)
+        self.symbols_checkbox.stateChanged.connect(self.toggle_symbols)
+        inner_layout.addWidget(self.symbols_checkbox)
+
+        self.dependencies_checkbox = QtWidgets.QCheckBox("Add the files imported by the selected files (import graph, no model call)")
+        self.dependencies_checkbox.setChecked(self.dependencies_enabled)
+        self.dependencies_checkbox.stateChanged.connect(self.toggle_dependencies)
+        inner_layout.addWidget(self.dependencies_checkbox)
+
+        # File Selection
+        selection_box = QtWidgets.QGroupBox("File Selection")
+        selection_layout = QtWidgets.QHBoxLayout()
+        self.selection_brain = QtWidgets.QRadioButton("Brain (gpt-5-mini)")
+        self.selection_keyword = QtWidgets.QRadioButton("Local keyword search")
+        self.selection_semantic = QtWidgets.QRadioButton("Local semantic search (code chunks)")
+        self.selection_brain.setChecked(True)
+        if not NUMPY_AVAILABLE:
+            self.selection_semantic.setEnabled(False)
+            self.selection_semantic.setToolTip("Requires numpy")
+        for button, mode in ((self.selection_brain, "brain"), (self.selection_keyword, "keyword"), (self.selection_semantic, "semantic")):
+            button.toggled.connect(lambda checked, mode=mode: checked and self.set_selection_mode(mode))
+            selection_layout.addWidget(button)
+        selection_box.setLayout(selection_layout)
+        inner_layout.addWidget(selection_box)
+
         # Mode Selection
         mode_box = QtWidgets.QGroupBox("Mode")
         mode_layout = QtWidgets.QHBoxLayout()
@@ -257,6 +347,10 @@ class HolaIbotApp(QtWidgets.QWidget):
         self.askButton = QtWidgets.QPushButton("Ask")
         self.askButton.clicked.connect(self.ask_gpt)
         prompt_hbox.addWidget(self.askButton, stretch=1)
+        self.stopButton = QtWidgets.QPushButton("Stop")
+        self.stopButton.setEnabled(False)
+        self.stopButton.clicked.connect(self.stop_chat)
+        prompt_hbox.addWidget(self.stopButton, stretch=1)
         inner_layout.addLayout(prompt_hbox)
 
         # Action Buttons
@@ -321,11 +415,15 @@ class HolaIbotApp(QtWidgets.QWidget):
         self.sandboxAskButton.clicked.connect(self.ask_sandbox_gpt)
         self.sandboxExecuteButton = QtWidgets.QPushButton("Execute Sandbox Code")
         self.sandboxExecuteButton.clicked.connect(self.execute_current_sandbox_code)
+        self.sandboxStopButton = QtWidgets.QPushButton("Stop")
+        self.sandboxStopButton.setEnabled(False)
+        self.sandboxStopButton.clicked.connect(self.stop_sandbox)
         self.sandboxClearButton = QtWidgets.QPushButton("Clear Sandbox")
         self.sandboxClearButton.clicked.connect(self.clear_sandbox)
         
         button_layout.addWidget(self.sandboxAskButton)
         button_layout.addWidget(self.sandboxExecuteButton)
+        button_layout.addWidget(self.sandboxStopButton)
         button_layout.addWidget(self.sandboxClearButton)
         layout.addLayout(button_layout)
         
@@ -357,6 +455,28 @@ class HolaIbotApp(QtWidgets.QWidget):
     def toggle_pre_analysis(self, state: int) -> None:
         self.pre_analysis_enabled = bool(state)
 
+    def toggle_streaming(self, state: int) -> None:
+        self.streaming_enabled = bool(state)
+
+    def toggle_speculative(self, state: int) -> None:
+        self.speculative_enabled = bool(state)
+
+    def toggle_symbols(self, state: int) -> None:
+        self.symbols_enabled = bool(state)
+        if self.symbols_enabled and self.loaded_path:
+            self.sync_indexes()
+
+    def toggle_dependencies(self, state: int) -> None:
+        self.dependencies_enabled = bool(state)
+        if self.dependencies_enabled and self.loaded_path:
+            self.sync_indexes()
+
+    def set_selection_mode(self, mode: str) -> None:
+        self.selection_mode = mode
+        if self.loaded_path:
+            # Builds the index the new mode looks up
+            self.sync_indexes()
+
     def holaibot_ascii(self) -> str:
         return (
             "██████╗ ███████╗██████╗ ██╗   ██╗ ██████╗    ███╗   ███╗ ██████╗\n"
@@ -374,10 +494,40 @@ class HolaIbotApp(QtWidgets.QWidget):
         self.excludeButton.setEnabled(enabled)
         self.askButton.setEnabled(enabled)
 
-    def _display_agent_message(self, prefix: str, message: str, color: str = "#F2B134") -> None:
+    def set_chat_busy(self, busy: bool) -> None:
+        """Swaps Ask for Stop while a chat query is in progress."""
+        self.askButton.setEnabled(not busy)
+        self.stopButton.setEnabled(busy)
+
+    def set_sandbox_busy(self, busy: bool) -> None:
+        self.sandboxAskButton.setEnabled(not busy)
+        self.sandboxExecuteButton.setEnabled(not busy)
+        self.sandboxStopButton.setEnabled(busy)
+
+    def update_cache_status(self) -> None:
+        status = self.extractor.cache.describe()
+        if self.index_task is not None:
+            status += " | Building content index..."
+        self.cacheStatusLabel.setText(status)
+
+    def closeEvent(self, event: QtGui.QCloseEvent) -> None:
+        """Releases extractor resources (watchers, worker processes, index files) on exit."""
+        self.watcher.stop()
+        get_request_engine().shutdown()
+        shutdown_background_tasks()
+        if self.exec_worker is not None:
+            self.exec_worker.cancel()
+            self.exec_worker.wait(2000)
+        self.extractor.shutdown()
+        if self.selection_cache is not None:
+            self.selection_cache.close()
+        super().closeEvent(event)
+
+    def _display_agent_message(self, prefix: str, message: str, color: str = "#F2B134", refresh: bool = True) -> None:
         msg = f'<b style="color:{color};">[{prefix}]</b> <i>{message}</i>'
         self.responseEdit.append(msg)
-        QtCore.QCoreApplication.processEvents()
+        if refresh:
+            QtCore.QCoreApplication.processEvents()
 
     # -------------------------------------------------------------------------
     # Project Context Logic (Files, Exclusions, Structure)
@@ -390,9 +540,10 @@ class HolaIbotApp(QtWidgets.QWidget):
 
     def reload_context(self) -> None:
         """
-        Loads the project structure. 
-        Note: We intentionally only load structure initially to save resources.
-        Content is loaded dynamically during the query phase if smart mode is active.
+        Loads the project structure and starts building the content indexes in the
+        background (see sync_indexes). The persistent index keeps unchanged files, so
+        only a first load or edited files are read; a query sent before the build
+        finishes waits for it. File contents still go to the Worker per query.
         """
         if not self.loaded_path:
             QtWidgets.QMessageBox.warning(self, "No Folder", "Please select a folder first")
@@ -402,19 +553,23 @@ class HolaIbotApp(QtWidgets.QWidget):
         self.set_buttons_enabled(False)
 
         self.contextEdit.setPlainText("Extracting project structure...")
-        self._display_agent_message("System", "Extracting structure (Lazy Loading)...")
+        self._display_agent_message("System", "Extracting structure...")
         
         try:
             # Always extract just structure first. 
             structure_only_text = self.extractor.build_context(self.loaded_path, extract_content=False)
             
             self.loaded_context = structure_only_text  # Store structure
+            self.pipeline = SmartContextPipeline(self.loaded_path, self.extractor, self.selection_cache)
             
             self.contextEdit.setPlainText(f"Structure Ready:\n\n{structure_only_text}")
-            self._display_agent_message("System", "Project Structure Loaded. Content will be fetched on demand.", color="#8ede64")
+            self.watcher.watch(self.extractor.get_watch_directories(self.loaded_path))
+            self.sync_indexes()
+            self._display_agent_message("System", "Project Structure Loaded. The content index is being built in the background.", color="#8ede64")
             
             self.promptEdit.clear()
             self.chat_history = []
+            self.update_cache_status()
             self.set_buttons_enabled(True)
             
         except Exception as e:
@@ -422,6 +577,55 @@ class HolaIbotApp(QtWidgets.QWidget):
             self._display_agent_message("Error", f"Structure extraction error : {e}", color="#FF6347")
             self.set_buttons_enabled(True)
 
+    def on_project_changed(self, changed_dirs: List[str]) -> None:
+        """Patches the loaded structure for directories the watcher reported, keeping the chat intact."""
+        if not self.loaded_path:
+            return
+        if self.extractor.refresh_directories(self.loaded_path, changed_dirs):
+            self.loaded_context = self.extractor.render_structure_text(self.loaded_path)
+            self.contextEdit.setPlainText(f"Structure Ready:\n\n{self.loaded_context}")
+        self.watcher.watch(self.extractor.get_watch_directories(self.loaded_path))
+        self.sync_indexes(changed_dirs)
+        self.update_cache_status()
+
+    def sync_indexes(self, changed_dirs: Optional[List[str]] = None) -> None:
+        """
+        Updates the extractor's content indexes of the loaded project (with the
+        embedding index in semantic mode, the symbol index and import graph when
+        symbols and dependencies are on) in a background task, so that queries only
+        look them up. Changes reported while a sync runs
+        are merged and synced after it.
+        """
+        request: Tuple[str, Optional[List[str]]] = (self.loaded_path, changed_dirs)
+        if self.index_task is None:
+            self._start_index_sync(*request)
+            return
+        queued = self.queued_index_sync
+        if queued is not None and queued[0] == self.loaded_path:
+            dirs = None if queued[1] is None or changed_dirs is None else sorted(set(queued[1]) | set(changed_dirs))
+            request = (self.loaded_path, dirs)
+        self.queued_index_sync = request
+
+    def _start_index_sync(self, root: str, changed_dirs: Optional[List[str]]) -> None:
+        self.index_task = BackgroundTask(
+            self.extractor.sync_indexes, root, changed_dirs,
+            embeddings=self.selection_mode == "semantic", symbols=self.symbols_enabled,
+            imports=self.dependencies_enabled
+        )
+        self.index_task.finished.connect(self.on_indexes_synced)
+        self.index_task.failed.connect(self.on_indexes_synced)
+        self.index_task.start()
+        self.update_cache_status()
+
+    def on_indexes_synced(self, _result: Any) -> None:
+        # A failed sync leaves the indexes as they were; the next one retries the files
+        self.index_task = None
+        if self.queued_index_sync is not None:
+            request, self.queued_index_sync = self.queued_index_sync, None
+            self._start_index_sync(*request)
+        else:
+            self.update_cache_status()
+
     def set_extensions(self) -> None:
         cur = ",".join(sorted(x.lstrip('.') for x in self.extractor.extensions))
         txt, ok = QtWidgets.QInputDialog.getText(self, "Set Extensions", "Extensions (comma separated):", QtWidgets.QLineEdit.EchoMode.Normal, text=cur)
@@ -433,7 +637,7 @@ class HolaIbotApp(QtWidgets.QWidget):
     def set_exclusions(self) -> None:
         current_exclusions = self.extractor.DEFAULT_EXCLUSIONS.union(self.extractor.exclusions)
         cur = ",".join(sorted(current_exclusions))
-        txt, ok = QtWidgets.QInputDialog.getText(self, "Set Exclusions", "Exclusions (comma separated):", QtWidgets.QLineEdit.EchoMode.Normal, text=cur)
+        txt, ok = QtWidgets.QInputDialog.getText(self, "Set Exclusions", "Exclusions (comma separated names or globs, e.g. dist/, *.min.js):", QtWidgets.QLineEdit.EchoMode.Normal, text=cur)
         if ok:
             xs = [x.strip() for x in txt.split(',') if x.strip()]
             self.extractor.set_exclusions(xs)
@@ -444,13 +648,7 @@ class HolaIbotApp(QtWidgets.QWidget):
         QtWidgets.QMessageBox.information(self, "Copied", "Context copied to clipboard.")
 
     def build_system_prompt(self, specific_context: str) -> str:
-        return f"""You are an expert coding assistant.
-Project context:
-#####
-{specific_context}
-#####
-If the context above is just a structure, it means the project is too large. Do your best with just filenames.
-"""
+        return build_system_prompt(specific_context)
 
     def display_user_prompt(self, prompt: str) -> None:
         if self.markdown_enabled:
@@ -494,6 +692,7 @@ If the context above is just a structure, it means the project is too large. Do
             # 1. Force full content reading
             # This reads all code except what is defined in 'Exclusions'
             full_ctx = self.extractor.build_context(self.loaded_path, extract_content=True)
+            self.update_cache_status()
             
             # 2. Get the actual System Prompt
             system_instruction = self.build_system_prompt(full_ctx)
@@ -511,7 +710,8 @@ If the context above is just a structure, it means the project is too large. Do
             self.display_gpt_output(final_prompt_block)
             return
 
-        self.askButton.setEnabled(False)
+        self.set_chat_busy(True)
+        self.configure_pipeline()
         
         # Initialize Retry Logic Sequence
         self.current_query_attempt = 1
@@ -521,17 +721,21 @@ If the context above is just a structure, it means the project is too large. Do
         """
         Determines the retrieval strategy based on the current attempt count.
         Handles fallback from Smart Filter -> Aggressive Filter -> Structure Only.
+        Selection and context building are the dmc.SmartContextPipeline steps, run in
+        background tasks; only the Brain and Worker calls are driven from here.
         """
-        
         # ATTEMPT 1: Standard Smart Filter
         if self.current_query_attempt == 1:
-            self._display_agent_message(f"Brain", "Analyzing query to select relevant files...")
-            self.run_mini_filter(aggressive=False)
+            if self.selection_mode == "keyword":
+                self._display_agent_message("Local Filter", "Ranking files by keyword search...")
+            elif self.selection_mode == "semantic":
+                self._display_agent_message("Local Filter", "Searching code chunks...")
+            self.start_selection(aggressive=False)
             
-        # ATTEMPT 2: Aggressive Filter (Triggered after a 429)
+        # ATTEMPT 2: Aggressive Filter (Triggered by a context-length error)
         elif self.current_query_attempt == 2:
             self._display_agent_message(f"Brain (Attempt {self.current_query_attempt})", "Previous context too large. Switching to aggressive filtering...", color="#FFA500")
-            self.run_mini_filter(aggressive=True)
+            self.start_selection(aggressive=True)
             
         # ATTEMPT 3: Structure Only (Last Resort)
         elif self.current_query_attempt == 3:
@@ -542,105 +746,370 @@ If the context above is just a structure, it means the project is too large. Do
         # FAILED
         else:
             self._display_agent_message("System", "Error: Project is too voluminous. Even structure-only failed or max retries reached.", color="#FF0000")
-            self.askButton.setEnabled(True)
+            self.set_chat_busy(False)
 
-    def run_mini_filter(self, aggressive: bool = False) -> None:
-        """
-        Uses a smaller, faster model (the 'Brain') to identify relevant files.
-        """
+    def configure_pipeline(self) -> None:
+        """Applies the chat tab's options to the pipeline before a query."""
+        self.pipeline.selector = self.selection_mode
+        self.pipeline.symbols = self.symbols_enabled
+        self.pipeline.dependencies = self.dependencies_enabled
+
+    def start_selection(self, aggressive: bool) -> None:
+        """Runs the local part of file selection (symbols, local selectors, selection cache) in the background."""
         self.is_smart_filtering = True
-        
-        if aggressive:
-            instruction = "Select ONLY the top 5 absolute most critical files needed to answer. Be extremely strict."
+        self.chat_task = BackgroundTask(self._selection_step, self.pipeline, self.current_user_prompt, aggressive)
+        self.chat_task.finished.connect(self.on_selection_ready)
+        self.chat_task.failed.connect(self.on_chat_task_failed)
+        self.chat_task.start()
+
+    @staticmethod
+    def _selection_step(pipeline: SmartContextPipeline, question: str, aggressive: bool) -> Tuple[Optional[List[str]], str, List[Dict[str, str]]]:
+        """Background step of start_selection: (targets, selected_by, []), or (None, "brain", Brain request)."""
+        targets, selected_by = pipeline.local_targets(question, aggressive)
+        if targets is not None:
+            return targets, selected_by, []
+        return None, selected_by, pipeline.brain_request(question, aggressive)
+
+    def on_selection_ready(self, result: Tuple[Optional[List[str]], str, List[Dict[str, str]]]) -> None:
+        self.chat_task = None
+        targets, selected_by, brain_messages = result
+        if targets is None:
+            self.run_mini_filter(brain_messages)
+            return
+        self.is_smart_filtering = False
+        if selected_by == "symbols":
+            self.apply_file_selection(targets, source="Symbol Index")
+        elif selected_by == "cache":
+            self._display_agent_message("Brain", "Reusing the file selection from an identical earlier question.", color="#87CEEB")
+            self.apply_file_selection(targets)
+        elif not targets:
+            self._display_agent_message("Local Filter", "No file matches the question. Using structure only.", color="#FFA500")
+            self.send_to_worker(context_content=self.loaded_context)
         else:
-            instruction = "Select all files that might be relevant to the user request."
+            self.apply_file_selection(targets, source="Local Filter")
 
-        brain_prompt = f"""
-You are the Context Optimizer. 
-Project Structure:
-{self.loaded_context}
+    def on_chat_task_failed(self, error: Exception) -> None:
+        self.chat_task = None
+        self.is_smart_filtering = False
+        self.discard_speculation()
+        self._display_agent_message("System", f"Error building context: {error}", color="#FF0000")
+        self.set_chat_busy(False)
 
-User Request: "{self.current_user_prompt}"
+    def run_mini_filter(self, brain_messages: List[Dict[str, str]]) -> None:
+        """
+        Uses a smaller, faster model (the 'Brain') to identify relevant files.
+        On attempt 1, a speculative Worker may run on a local guess meanwhile.
+        """
+        if self.current_query_attempt == 1:
+            self._display_agent_message("Brain", "Analyzing query to select relevant files...")
+        self.chat_worker = GptWorker(brain_messages, model_name=BRAIN_MODEL)
+        self.chat_worker.finished.connect(self.on_filter_response)
+        self.chat_worker.failed.connect(self.on_filter_failed)
+        self.chat_worker.start()
+        # Brain call in flight: overlap it with a speculative Worker
+        if self.speculative_enabled and self.current_query_attempt == 1:
+            self.start_speculation()
+
+    def on_filter_failed(self, error: ApiError) -> None:
+        """The Brain call failed after its retries: fall back to structure only, or give up."""
+        self.chat_worker = None
+        if self.speculation_usable():
+            self._display_agent_message("Brain (Error)", f"{error}. Keeping the speculative answer.", color="#FFA500")
+            self.accept_speculation()
+            return
+        self.discard_speculation()
+        if isinstance(error, ContextLengthError):
+            self._display_agent_message("Brain (Error)", "Structure too large for file selection. Using structure only fallback.", color="#FFA500")
+            self.current_query_attempt = 3
+            self.execute_smart_query_step()
+            return
+        self._report_chat_failure(error)
 
-Task: {instruction}
-Return a JSON list of file paths (strings) relative to root. Example: ["src/main.py", "utils.py"]
-Do not write markdown, just the JSON array.
-"""
-        messages = [{"role": "user", "content": brain_prompt}]
-        self.gpt_worker = GptWorker(messages, model_name="gpt-5-mini")
-        self.gpt_worker.finished.connect(self.on_filter_response)
-        self.gpt_worker.start()
+    def _report_chat_failure(self, error: ApiError) -> None:
+        """Shows a non-recoverable error and drops the unanswered prompt from the history."""
+        self._display_agent_message("System", str(error), color="#FF0000")
+        if self.chat_history and self.chat_history[-1]["role"] == "user":
+            self.chat_history.pop()
+        self.set_chat_busy(False)
 
     def on_filter_response(self, response: str) -> None:
         """Processes the file list returned by the 'Brain' model."""
-        self.gpt_worker = None 
+        self.chat_worker = None 
         
         # Parse JSON
         relevant_files: List[str] = []
         try:
-            # Cleanup code blocks if present
-            clean_resp = response.strip()
-            if "```" in clean_resp:
-                match = re.search(r'\[.*\]', clean_resp, re.DOTALL)
-                if match:
-                    clean_resp = match.group(0)
-            
-            relevant_files = json.loads(clean_resp)
-            if not isinstance(relevant_files, list): raise ValueError("Not a list")
+            relevant_files = parse_file_list(response)
         except Exception as e:
+            if self.speculation_usable():
+                self._display_agent_message("Brain (Error)", f"Failed to parse file list: {e}. Keeping the speculative answer.")
+                self.accept_speculation()
+                return
+            self.discard_speculation()
             self._display_agent_message("Brain (Error)", f"Failed to parse file list: {e}. Using structure only fallback.")
             # If parsing fails, jump to Attempt 3 logic immediately
             self.send_to_worker(context_content=self.loaded_context)
             return
 
-        # Build Custom Context
-        self._display_agent_message("Brain", f"Selected {len(relevant_files)} files: {', '.join(relevant_files[:3])}...", color="#87CEEB")
-        
-        try:
-            custom_context = self.extractor.build_targeted_context(self.loaded_path, relevant_files)
-            self.send_to_worker(context_content=custom_context)
-        except Exception as e:
-            self._display_agent_message("System", f"Error building context: {e}", color="#FF0000")
-            self.askButton.setEnabled(True)
+        relevant_files = [str(f) for f in relevant_files]
+        self.pipeline.remember_selection(self.current_user_prompt, self.current_query_attempt == 2, relevant_files)
+        self.apply_file_selection(relevant_files)
+
+    def apply_file_selection(self, relevant_files: List[str], source: str = "Brain") -> None:
+        """Builds the Worker context from the selected files in the background, then sends the query."""
+        unit = "code excerpts" if relevant_files and re.match(r".+:\d+-\d+$", str(relevant_files[0])) else "files"
+        self._display_agent_message(source, f"Selected {len(relevant_files)} {unit}: {', '.join(relevant_files[:3])}...", color="#87CEEB")
+
+        if self.spec_state == "pending" and self.settle_speculation(relevant_files):
+            return
+
+        # Attempt 1 only adds imported files: the aggressive attempt is meant to shrink the context
+        self.chat_task = BackgroundTask(
+            self.pipeline.targeted_context, relevant_files, list(self.chat_history), self.current_query_attempt != 1
+        )
+        self.chat_task.finished.connect(self.on_context_ready)
+        self.chat_task.failed.connect(self.on_chat_task_failed)
+        self.chat_task.start()
+
+    def on_context_ready(self, result: Tuple[str, List[str]]) -> None:
+        self.chat_task = None
+        custom_context, dependencies = result
+        if dependencies:
+            self._display_agent_message("Import Graph", f"Added {len(dependencies)} imported files: {', '.join(dependencies[:3])}...", color="#87CEEB")
+        self.update_cache_status()
+        self.send_to_worker(context_content=custom_context)
+
+    def build_worker_messages(self, context_content: str) -> List[Dict[str, str]]:
+        system_prompt = self.build_system_prompt(context_content)
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(self.chat_history)
+        return messages
+
+    # -------------------------------------------------------------------------
+    # Speculative Execution
+    # -------------------------------------------------------------------------
+    # Share of the Brain's files the speculative context must contain for its answer to be kept
+    SPECULATION_MIN_COVERAGE: float = 0.75
+
+    def start_speculation(self) -> None:
+        """
+        Sends the Worker request with a locally guessed context, while the Brain call
+        is in flight. The guess and its context are built in the background; nothing is
+        sent when no file matches. The Worker's output is held back until the Brain's
+        selection shows whether the guess was good enough (see settle_speculation).
+        """
+        self.discard_speculation()
+        self.spec_state = "pending"
+        self.spec_task = BackgroundTask(
+            self._speculative_context, self.extractor, self.loaded_path,
+            self.current_user_prompt, self.pipeline.worker_context_budget(self.chat_history)
+        )
+        self.spec_task.finished.connect(self.on_spec_context)
+        self.spec_task.failed.connect(self.on_spec_context_failed)
+        self.spec_task.start()
+
+    @staticmethod
+    def _speculative_context(extractor: ProjectContextExtractor, root: str, question: str, budget: int) -> Tuple[List[str], str]:
+        """Background step of start_speculation: the locally guessed files and their context."""
+        files = extractor.local_select_files(root, question)
+        if not files:
+            return [], ""
+        return files, extractor.build_targeted_context(root, files, token_budget=budget)
+
+    def on_spec_context(self, result: Tuple[List[str], str]) -> None:
+        self.spec_task = None
+        files, context = result
+        if self.spec_state != "pending" or not files:
+            self.discard_speculation()
+            return
+
+        self._display_agent_message(
+            "Worker (GPT-5.1)",
+            f"Speculating with {len(files)} locally matched files while the Brain selects...",
+            color="#8ede64"
+        )
+        self.spec_files = files
+        self.spec_worker = GptWorker(self.build_worker_messages(context), model_name=WORKER_MODEL, stream=self.streaming_enabled)
+        self.spec_worker.chunk.connect(self.on_spec_chunk)
+        self.spec_worker.finished.connect(self.on_spec_response)
+        self.spec_worker.failed.connect(self.on_spec_failed)
+        self.spec_worker.start()
+
+    def on_spec_context_failed(self, error: Exception) -> None:
+        self.spec_task = None
+        self.discard_speculation()
+
+    def speculation_usable(self) -> bool:
+        """True if a pending speculative answer exists and has not failed."""
+        return (
+            self.spec_state == "pending" and self.spec_worker is not None
+            and not (self.spec_outcome and self.spec_outcome[0] == "failed")
+        )
+
+    def settle_speculation(self, selected_files: List[str]) -> bool:
+        """
+        Compares the Brain's selection with the speculative context. Returns True if the
+        speculative answer is kept, False if it was cancelled and the Worker must be re-run.
+        """
+        if self.spec_worker is None:
+            # The Brain answered before the speculative context was built
+            self.discard_speculation()
+            return False
+        resolved = self.extractor.resolve_target_files(self.loaded_path, selected_files)
+        coverage = selection_coverage(self.spec_files, resolved)
+        if self.speculation_usable() and coverage >= self.SPECULATION_MIN_COVERAGE:
+            self._display_agent_message("Worker (GPT-5.1)", f"Speculative context covers {coverage:.0%} of the Brain's files; keeping it.", color="#87CEEB")
+            self.accept_speculation()
+            return True
+        self._display_agent_message("Worker (GPT-5.1)", f"Speculative context covers {coverage:.0%} of the Brain's files; re-issuing.", color="#FFA500")
+        self.discard_speculation()
+        return False
+
+    def accept_speculation(self) -> None:
+        """Promotes the speculative Worker to the chat's answer, replaying anything it already produced."""
+        self.chat_worker, self.spec_worker = self.spec_worker, None
+        self.spec_state = "accepted"
+        self.is_smart_filtering = False
+        self.stream_anchor = None
+        chunks, self.spec_chunks = self.spec_chunks, []
+        for text in chunks:
+            self.on_gpt_chunk(text)
+        outcome, self.spec_outcome = self.spec_outcome, None
+        if outcome is not None:
+            self.spec_state = None
+            if outcome[0] == "finished":
+                self.on_gpt_response(outcome[1])
+            else:
+                self.on_gpt_failed(outcome[1])
+
+    def discard_speculation(self) -> None:
+        if self.spec_task is not None:
+            self.spec_task.cancel()
+            self.spec_task = None
+        if self.spec_worker is not None:
+            self.spec_worker.cancel()
+            self.spec_worker = None
+        self.spec_state = None
+        self.spec_files = []
+        self.spec_chunks = []
+        self.spec_outcome = None
+
+    def on_spec_chunk(self, text: str) -> None:
+        if self.spec_state == "accepted":
+            self.on_gpt_chunk(text)
+        elif self.spec_state == "pending":
+            self.spec_chunks.append(text)
+
+    def on_spec_response(self, response: str) -> None:
+        if self.spec_state == "accepted":
+            self.spec_state = None
+            self.on_gpt_response(response)
+        elif self.spec_state == "pending":
+            self.spec_outcome = ("finished", response)
+
+    def on_spec_failed(self, error: ApiError) -> None:
+        if self.spec_state == "accepted":
+            self.spec_state = None
+            self.on_gpt_failed(error)
+        elif self.spec_state == "pending":
+            self.spec_outcome = ("failed", error)
 
     def send_to_worker(self, context_content: str) -> None:
         """Final step: Sends the constructed context and user prompt to the main LLM."""
         self.is_smart_filtering = False 
         
-        system_prompt = self.build_system_prompt(context_content)
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(self.chat_history)
+        messages = self.build_worker_messages(context_content)
 
         self._display_agent_message("Worker (GPT-5.1)", "Transmitting request...", color="#8ede64")
         
-        self.gpt_worker = GptWorker(messages, model_name="gpt-5.1") 
-        self.gpt_worker.finished.connect(self.on_gpt_response)
-        self.gpt_worker.start()
+        self.stream_anchor = None
+        self.chat_worker = GptWorker(messages, model_name=WORKER_MODEL, stream=self.streaming_enabled) 
+        self.chat_worker.chunk.connect(self.on_gpt_chunk)
+        self.chat_worker.finished.connect(self.on_gpt_response)
+        self.chat_worker.failed.connect(self.on_gpt_failed)
+        self.chat_worker.start()
+
+    def _display_worker_header(self) -> None:
+        if self.markdown_enabled and MARKDOWN_AVAILABLE:
+             self.responseEdit.append("<b style='color:#87CEEB'>Worker (GPT-5.1):</b>")
+        else:
+             self.responseEdit.append("\n--- Worker (GPT-5.1) says: ---\n")
+
+    def on_gpt_chunk(self, text: str) -> None:
+        """Appends a streamed piece of the Worker's answer as plain text."""
+        if self.stream_anchor is None:
+            # No processEvents() here: it would deliver the next chunks before the header
+            self._display_agent_message("Worker (GPT-5.1)", "Streaming response...", color="#87CEEB", refresh=False)
+            self._display_worker_header()
+            self.responseEdit.append("")
+            self.stream_anchor = self.responseEdit.document().characterCount() - 1
+
+        cursor = self.responseEdit.textCursor()
+        cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+        cursor.insertText(text)
+        self.responseEdit.setTextCursor(cursor)
+
+    def on_gpt_failed(self, error: ApiError) -> None:
+        """
+        Handles a failed Worker call. Transient errors were already retried by the
+        request layer, so only a context-length error shrinks the context and retries.
+        """
+        self.chat_worker = None
+        if self.stream_anchor is not None:
+            self.stream_anchor = None
+            self.responseEdit.append("")
 
-    def on_gpt_response(self, response: str) -> None:
-        """Handles the final API response or triggers retry on 429 errors."""
-        self.gpt_worker = None
-        
         # --- RETRY LOGIC CHECK ---
-        if "API Error (429)" in response:
-            self._display_agent_message("System", "Rate Limit (429) exceeded.", color="#FF6347")
+        if isinstance(error, ContextLengthError):
+            self._display_agent_message("System", f"Context too large: {error.message}", color="#FF6347")
             # Increment attempt counter and recurse
             self.current_query_attempt += 1
             self.execute_smart_query_step()
             return
+
+        self._report_chat_failure(error)
+
+    def on_gpt_response(self, response: str) -> None:
+        """Handles the final API response."""
+        self.chat_worker = None
             
         # --- SUCCESS ---
-        self.askButton.setEnabled(True)
-        self._display_agent_message("Worker (GPT-5.1)", "Response received.", color="#87CEEB")
+        self.set_chat_busy(False)
         self.chat_history.append({"role": "assistant", "content": response})
-        
-        if self.markdown_enabled and MARKDOWN_AVAILABLE:
-             self.responseEdit.append("<b style='color:#87CEEB'>Worker (GPT-5.1):</b>")
-        else:
-             self.responseEdit.append("\n--- Worker (GPT-5.1) says: ---\n")
-        
+
+        if self.stream_anchor is not None:
+            # Already on screen; with Markdown on, swap the raw stream for the rendered answer
+            anchor, self.stream_anchor = self.stream_anchor, None
+            if self.markdown_enabled and MARKDOWN_AVAILABLE:
+                cursor = self.responseEdit.textCursor()
+                cursor.setPosition(anchor - 1)
+                cursor.movePosition(QtGui.QTextCursor.MoveOperation.End, QtGui.QTextCursor.MoveMode.KeepAnchor)
+                cursor.removeSelectedText()
+                self.display_gpt_output(response)
+            return
+
+        self._display_agent_message("Worker (GPT-5.1)", "Response received.", color="#87CEEB")
+        self._display_worker_header()
         self.display_gpt_output(response)
 
+    def stop_chat(self) -> None:
+        """Aborts the Brain/Worker call in flight; its connection is closed and nothing more is sent."""
+        if self.chat_worker is not None:
+            self.chat_worker.cancel()
+            self.chat_worker = None
+        if self.chat_task is not None:
+            self.chat_task.cancel()
+            self.chat_task = None
+        self.discard_speculation()
+        self.is_smart_filtering = False
+        if self.stream_anchor is not None:
+            self.stream_anchor = None
+            self.responseEdit.append("")
+        if self.chat_history and self.chat_history[-1]["role"] == "user":
+            self.chat_history.pop()
+        self._display_agent_message("System", "Request stopped.", color="#FF6347")
+        self.set_chat_busy(False)
+
     def copy_response(self) -> None:
         QtGui.QGuiApplication.clipboard().setText(self.responseEdit.toPlainText())
         QtWidgets.QMessageBox.information(self, "Copied", "Chat response copied.")
@@ -669,6 +1138,19 @@ Do not write markdown, just the JSON array.
         self.current_sandbox_code = ""
         self.sandboxResponseEdit.append("<i>Sandbox cleared. Ready for a new task.</i>")
 
+    def stop_sandbox(self) -> None:
+        """Aborts code generation in flight, or kills the running sandbox script and its children."""
+        if self.sandbox_worker is not None:
+            self.sandbox_worker.cancel()
+            self.sandbox_worker = None
+            if self.sandbox_history and self.sandbox_history[-1]["role"] == "user":
+                self.sandbox_history.pop()
+            self.sandboxResponseEdit.append("<i>[System] Generation stopped.</i>\n")
+            self.set_sandbox_busy(False)
+        if self.exec_worker is not None:
+            # on_sandbox_execution_finished reports the outcome once the process is gone
+            self.exec_worker.cancel()
+
     def ask_sandbox_gpt(self) -> None:
         """Step 1: User asks for code (With Dynamic Context Injection)."""
         prompt = self.sandboxPromptEdit.text().strip()
@@ -711,18 +1193,25 @@ Do not write markdown, just the JSON array.
         self.sandbox_history.append({"role": "user", "content": prompt})
         
         self.sandboxResponseEdit.append("<i>[Agent] Generating code... (Calling GPT-5T with Context)</i>\n")
-        self.sandboxAskButton.setEnabled(False)
-        self.sandboxExecuteButton.setEnabled(False)
+        self.set_sandbox_busy(True)
         
-        self.gpt_worker = GptWorker(messages_for_api, model_name="gpt-5-mini")
-        self.gpt_worker.finished.connect(self.on_sandbox_gpt_response)
-        self.gpt_worker.start()
+        self.sandbox_worker = GptWorker(messages_for_api, model_name="gpt-5-mini")
+        self.sandbox_worker.finished.connect(self.on_sandbox_gpt_response)
+        self.sandbox_worker.failed.connect(self.on_sandbox_gpt_failed)
+        self.sandbox_worker.start()
+
+    def on_sandbox_gpt_failed(self, error: ApiError) -> None:
+        """Reports a failed sandbox call and drops the unanswered request from the history."""
+        self.sandbox_worker = None
+        self.set_sandbox_busy(False)
+        if self.sandbox_history and self.sandbox_history[-1]["role"] == "user":
+            self.sandbox_history.pop()
+        self.sandboxResponseEdit.append(f"<i style='color:#FF6347;'>[System] {error}</i>\n")
 
     def on_sandbox_gpt_response(self, response: str) -> None:
         """Step 2: AI returns the code."""
-        self.gpt_worker = None
-        self.sandboxAskButton.setEnabled(True)
-        self.sandboxExecuteButton.setEnabled(True)
+        self.sandbox_worker = None
+        self.set_sandbox_busy(False)
         
         self.sandbox_history.append({"role": "assistant", "content": response})
 
@@ -765,8 +1254,7 @@ Do not write markdown, just the JSON array.
         self.current_sandbox_code = code_to_run 
         
         self.sandboxResponseEdit.append(f"<i>[System] Executing code...</i>\n")
-        self.sandboxAskButton.setEnabled(False)
-        self.sandboxExecuteButton.setEnabled(False)
+        self.set_sandbox_busy(True)
         
         self.exec_worker = CodeExecutionWorker(self.current_sandbox_code)
         self.exec_worker.finished.connect(self.on_sandbox_execution_finished)
@@ -774,12 +1262,16 @@ Do not write markdown, just the JSON array.
 
     def on_sandbox_execution_finished(self, stdout: str, stderr: str) -> None:
         """Step 4: Execution finished, check for errors."""
+        cancelled = self.exec_worker is not None and self.exec_worker.cancelled
         self.exec_worker = None
-        self.sandboxAskButton.setEnabled(True)
-        self.sandboxExecuteButton.setEnabled(True)
+        self.set_sandbox_busy(False)
 
         if stdout:
             self.sandboxResponseEdit.append(f"<b>Output (stdout):</b>\n<pre>{stdout}</pre>\n")
+
+        if cancelled:
+            self.sandboxResponseEdit.append("<i>[System] Execution stopped; the process tree was killed.</i>\n")
+            return
         
         if stderr:
             self.sandboxResponseEdit.append(f"<b>Error (stderr):</b>\n<pre style='color:red;'>{stderr}</pre>\n")
@@ -816,12 +1308,12 @@ Provide an explanation of the fix, then the complete corrected Python code in a
 """
         self.sandbox_history.append({"role": "user", "content": debug_prompt})
         
-        self.sandboxAskButton.setEnabled(False)
-        self.sandboxExecuteButton.setEnabled(False)
+        self.set_sandbox_busy(True)
         
-        self.gpt_worker = GptWorker(self.sandbox_history, model_name="gpt-5-mini")
-        self.gpt_worker.finished.connect(self.on_sandbox_gpt_response) 
-        self.gpt_worker.start()
+        self.sandbox_worker = GptWorker(self.sandbox_history, model_name="gpt-5-mini")
+        self.sandbox_worker.finished.connect(self.on_sandbox_gpt_response) 
+        self.sandbox_worker.failed.connect(self.on_sandbox_gpt_failed)
+        self.sandbox_worker.start()
 
 
 # -----------------------------------------------------------------------------
@@ -829,6 +1321,9 @@ Provide an explanation of the fix, then the complete corrected Python code in a
 # -----------------------------------------------------------------------------
 def main() -> None:
     """Initializes and launches the PyQt application."""
+    # Required for the extractor's process pool in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
+
     if getattr(sys, 'frozen', False):
         script_dir = Path(sys.executable).parent
     elif '__file__' in locals():
@@ -0,0 +1,466 @@
+# -----------------------------------------------------------------------------
+# Local OpenAI Stand-in: Mock Server, Replay and Benchmark Harness
+# -----------------------------------------------------------------------------
+"""
+Local stand-in for the OpenAI `/v1/chat/completions` endpoint.
+
+Serves synthetic (or recorded) answers with configurable latency, streaming,
+per-minute rate limits and injected 429s, so the Brain/Worker pipeline can be
+exercised and benchmarked without network access or API spend.
+
+    python mock_server.py serve --port 8765 --latency 0.4 --tpm 30000
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python main.py
+
+Record a real session with DMC_RECORD_PATH=session.jsonl, then replay it:
+
+    python mock_server.py serve --replay session.jsonl --replay-timing
+    python mock_server.py bench --requests 200 --concurrency 4 --stream
+    python mock_server.py connections --requests 200
+"""
+import sys
+import os
+import json
+import re
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Optional, Any, Tuple
+
+import utils
+
+
+# -----------------------------------------------------------------------------
+# Server State
+# -----------------------------------------------------------------------------
+class _Bucket:
+    """Server-side per-minute allowance, refilled continuously like the real API's."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity: int = capacity
+        self.level: float = float(capacity)
+        self.updated: float = time.monotonic()
+
+    def take(self, amount: int) -> Tuple[bool, float]:
+        """Consumes amount if available. Returns (accepted, seconds until it would be)."""
+        now = time.monotonic()
+        self.level = min(float(self.capacity), self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+        if amount <= self.level:
+            self.level -= amount
+            return True, 0.0
+        return False, (amount - self.level) * 60.0 / self.capacity
+
+    def reset_seconds(self) -> float:
+        return (self.capacity - self.level) * 60.0 / self.capacity
+
+
+class MockState:
+    """Configuration, rate-limit buckets, replay data and counters shared by all handler threads."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.latency: float = args.latency
+        self.jitter: float = args.jitter
+        self.chunk_delay: float = args.chunk_delay
+        self.answer_words: int = args.answer_words
+        self.fail_rate: float = args.fail_rate
+        self.retry_after: float = args.retry_after
+        self.rpm: int = args.rpm
+        self.tpm: int = args.tpm
+        self.replay_timing: bool = args.replay_timing
+        self.random = random.Random(args.seed)
+
+        self.lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self.replay: Dict[str, List[Dict[str, Any]]] = {}
+        self._replay_cursor: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {'requests': 0, 'ok': 0, 'rate_limited': 0, 'injected_429': 0, 'replayed': 0}
+        if args.replay:
+            self.load_replay(args.replay)
+
+    def load_replay(self, path: str) -> None:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    self.replay.setdefault(entry['key'], []).append(entry)
+
+    def next_replay(self, key: str) -> Optional[Dict[str, Any]]:
+        """Recorded exchanges for a request are served in order, cycling."""
+        with self.lock:
+            entries = self.replay.get(key)
+            if not entries:
+                return None
+            cursor = self._replay_cursor.get(key, 0)
+            self._replay_cursor[key] = cursor + 1
+            self.counters['replayed'] += 1
+            return entries[cursor % len(entries)]
+
+    def admit(self, model: str, tokens: int) -> Tuple[bool, float, Dict[str, str]]:
+        """Applies the per-model RPM/TPM limits. Returns (accepted, retry_after, rate-limit headers)."""
+        with self.lock:
+            self.counters['requests'] += 1
+            headers: Dict[str, str] = {}
+            accepted, wait = True, 0.0
+            for kind, capacity, amount in (('requests', self.rpm, 1), ('tokens', self.tpm, tokens)):
+                if not capacity:
+                    continue
+                bucket = self._buckets.setdefault((model, kind), _Bucket(capacity))
+                ok, needed = bucket.take(amount) if accepted else (True, 0.0)
+                if not ok:
+                    accepted, wait = False, needed
+                headers[f'x-ratelimit-limit-{kind}'] = str(capacity)
+                headers[f'x-ratelimit-remaining-{kind}'] = str(max(0, int(bucket.level)))
+                headers[f'x-ratelimit-reset-{kind}'] = f"{bucket.reset_seconds():.3f}s"
+            if accepted and self.fail_rate and self.random.random() < self.fail_rate:
+                accepted, wait = False, self.retry_after
+                self.counters['injected_429'] += 1
+            elif not accepted:
+                self.counters['rate_limited'] += 1
+            else:
+                self.counters['ok'] += 1
+            return accepted, wait, headers
+
+    def delay(self) -> float:
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+
+# -----------------------------------------------------------------------------
+# Synthetic Answers
+# -----------------------------------------------------------------------------
+_FILE_NAME_RE = re.compile(r"[\w./-]+\.[A-Za-z]\w{0,5}\b")
+
+
+def synthetic_answer(messages: List[Dict[str, str]], words: int) -> str:
+    """
+    A Brain prompt gets a JSON list of file names taken from the structure it was
+    shown; anything else gets a short Markdown answer of about `words` words.
+    """
+    last: str = str(messages[-1].get('content', '')) if messages else ""
+    if "Return a JSON list of file paths" in last:
+        names: List[str] = []
+        for name in _FILE_NAME_RE.findall(last.split("User Request:")[0]):
+            if name not in names and not name.startswith("."):
+                names.append(name)
+        return json.dumps(names[:5])
+    body = " ".join(f"word{i % 50}" for i in range(max(1, words - 12)))
+    return f"Mock answer.\n\n{body}\n\n```python\nprint('mock')\n```"
+
+
+def _split_chunks(text: str, size: int = 16) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+# -----------------------------------------------------------------------------
+# HTTP Handler
+# -----------------------------------------------------------------------------
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Without this, small SSE writes wait on delayed ACKs (~40 ms each)
+    disable_nagle_algorithm = True
+    state: MockState
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        try:
+            payload: Dict[str, Any] = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        model: str = payload.get('model', 'gpt-4o')
+        messages: List[Dict[str, str]] = payload.get('messages', [])
+        stream: bool = bool(payload.get('stream'))
+        state = self.state
+
+        recorded = state.next_replay(utils.request_fingerprint(model, messages)) if state.replay else None
+        if recorded is not None:
+            self._serve_recorded(recorded, stream)
+            return
+
+        accepted, wait, headers = state.admit(model, utils.estimate_request_tokens(messages))
+        if not accepted:
+            headers['retry-after'] = f"{wait:.3f}"
+            self._send_json(429, {"error": {
+                "message": f"Rate limit reached for {model}. Please try again in {wait:.3f}s.",
+                "type": "requests", "code": "rate_limit_exceeded"}}, headers)
+            return
+
+        time.sleep(state.delay())
+        content: str = synthetic_answer(messages, state.answer_words)
+        if stream:
+            self._send_stream(model, _split_chunks(content), state.chunk_delay, headers)
+        else:
+            self._send_json(200, self._completion(model, content), headers)
+
+    def _serve_recorded(self, entry: Dict[str, Any], stream: bool) -> None:
+        headers: Dict[str, str] = dict(entry.get('headers', {}))
+        ttfb: float = entry.get('ttfb_s', 0.0) if self.state.replay_timing else 0.0
+        time.sleep(ttfb)
+        if entry.get('status', 200) != 200:
+            body = entry.get('error', '{}').encode("utf-8")
+            self._send_raw(entry['status'], body, "application/json", headers)
+            return
+        content: str = entry.get('content', '')
+        if stream:
+            chunks: List[str] = entry.get('chunks') or _split_chunks(content)
+            spread: float = max(0.0, entry.get('latency_s', 0.0) - ttfb) if self.state.replay_timing else 0.0
+            self._send_stream(entry.get('model', ''), chunks, spread / max(1, len(chunks)), headers)
+        else:
+            self._send_json(200, self._completion(entry.get('model', ''), content), headers)
+
+    @staticmethod
+    def _completion(model: str, content: str) -> Dict[str, Any]:
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        }
+
+    def _send_raw(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_raw(status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+
+    def _send_stream(self, model: str, chunks: List[str], chunk_delay: float, headers: Dict[str, str]) -> None:
+        """Writes chunks as server-sent events over chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for i, text in enumerate(chunks):
+                if i and chunk_delay:
+                    time.sleep(chunk_delay)
+                event = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled mid-stream
+            pass
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def start_server(args: argparse.Namespace) -> Tuple[ThreadingHTTPServer, MockState]:
+    """Starts the mock server on a daemon thread. Returns the server and its state."""
+    state = MockState(args)
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, state
+
+
+# -----------------------------------------------------------------------------
+# Benchmark
+# -----------------------------------------------------------------------------
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_bench(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Drives --requests chat calls through the RequestEngine at --concurrency and
+    reports throughput and latency. Brain (gpt-5-mini) and Worker (gpt-5.1) calls
+    alternate; prompts are deterministic for a given --seed.
+    """
+    server: Optional[ThreadingHTTPServer] = None
+    state: Optional[MockState] = None
+    api_base: str = args.api_base
+    if not api_base:
+        server, state = start_server(args)
+        api_base = f"http://{args.host}:{server.server_address[1]}/v1"
+    os.environ["OPENAI_API_BASE"] = api_base
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+    rng = random.Random(args.seed)
+    filler = " ".join(f"token{rng.randrange(1000)}" for _ in range(args.prompt_words))
+    engine = utils.RequestEngine(max_concurrency=args.concurrency)
+    latencies: List[float] = []
+    first_chunk: List[float] = []
+    failures: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    started = time.perf_counter()
+    handles: List[Any] = []
+    for i in range(args.requests):
+        model = "gpt-5-mini" if i % 2 == 0 else "gpt-5.1"
+        messages = [{"role": "user", "content": f"Question {i}: {filler}"}]
+        submitted = time.perf_counter()
+        ttft: List[float] = []
+
+        def on_chunk(_: str, ttft: List[float] = ttft, submitted: float = submitted) -> None:
+            if not ttft:
+                ttft.append(time.perf_counter() - submitted)
+                with lock:
+                    first_chunk.append(ttft[0])
+
+        def on_done(future: Any, submitted: float = submitted) -> None:
+            error = future.exception() if not future.cancelled() else None
+            with lock:
+                if error is None:
+                    latencies.append(time.perf_counter() - submitted)
+                else:
+                    failures[type(error).__name__] = failures.get(type(error).__name__, 0) + 1
+
+        handle = engine.submit(messages, model, stream=args.stream, on_chunk=on_chunk if args.stream else None)
+        handle.future.add_done_callback(on_done)
+        handles.append(handle)
+
+    for handle in handles:
+        try:
+            handle.future.result()
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - started
+    engine.shutdown()
+
+    report: Dict[str, Any] = {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'stream': args.stream,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_p50_s': round(_percentile(latencies, 0.5), 3),
+        'latency_p95_s': round(_percentile(latencies, 0.95), 3),
+        'latency_max_s': round(max(latencies, default=0.0), 3),
+        'failures': failures,
+        'client_rate_limit_waits': utils.rate_limiter.waits,
+        'connections': utils.get_connection_stats(),
+    }
+    if first_chunk:
+        report['ttft_p50_s'] = round(_percentile(first_chunk, 0.5), 3)
+    if state is not None:
+        report['server'] = dict(state.counters)
+    if server is not None:
+        server.shutdown()
+    return report
+
+
+def run_connection_bench(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Sends --requests sequential chat calls over the shared keep-alive session,
+    streamed and not, then again closing the pooled connections before each call,
+    and reports the connection stats the session measured for each run. A streamed
+    call only hands its connection back once it has read the whole body.
+    """
+    server: Optional[ThreadingHTTPServer] = None
+    api_base: str = args.api_base
+    if not api_base:
+        server, _ = start_server(args)
+        api_base = f"http://{args.host}:{server.server_address[1]}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+    messages = [{"role": "user", "content": "ping " * args.prompt_words}]
+    report: Dict[str, Any] = {'requests': args.requests}
+    runs = (("keep_alive", False, False), ("keep_alive_stream", False, True), ("fresh_connections", True, False))
+    for label, fresh, stream in runs:
+        utils.close_http_connections()
+        utils.reset_connection_stats()
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            if fresh:
+                utils.close_http_connections()
+            utils.chat_completion(messages, "gpt-5-mini", stream=stream, api_base=api_base)
+        elapsed = time.perf_counter() - started
+        stats = utils.get_connection_stats()
+        report[label] = {
+            'elapsed_s': round(elapsed, 3),
+            'connections_opened': stats['connections_opened'],
+            'connections_reused': stats['connections_reused'],
+            'mean_latency_ms': round(stats['mean_latency_s'] * 1000, 3),
+        }
+    report['speedup'] = round(report['fresh_connections']['elapsed_s'] / report['keep_alive']['elapsed_s'], 2)
+    if server is not None:
+        server.shutdown()
+    return report
+
+
+# -----------------------------------------------------------------------------
+# Command Line
+# -----------------------------------------------------------------------------
+def _add_server_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before the response headers")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter on --latency")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="Seconds between streamed chunks")
+    parser.add_argument("--answer-words", type=int, default=120, help="Size of synthetic Worker answers")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute per model (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens per minute per model (0 = unlimited)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Probability of an injected 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after of injected 429s")
+    parser.add_argument("--replay", help="JSONL file recorded with DMC_RECORD_PATH")
+    parser.add_argument("--replay-timing", action="store_true", help="Reproduce recorded latencies")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Run the mock server in the foreground")
+    _add_server_options(serve)
+
+    bench = commands.add_parser("bench", help="Benchmark the request layer against the mock (or --api-base)")
+    _add_server_options(bench)
+    bench.set_defaults(port=0)
+    bench.add_argument("--api-base", help="Benchmark an already running server instead")
+    bench.add_argument("--requests", type=int, default=100)
+    bench.add_argument("--concurrency", type=int, default=utils.RequestEngine.MAX_CONCURRENCY)
+    bench.add_argument("--prompt-words", type=int, default=200)
+    bench.add_argument("--stream", action="store_true")
+
+    connections = commands.add_parser("connections", help="Compare keep-alive and fresh-connection calls")
+    _add_server_options(connections)
+    connections.set_defaults(port=0, latency=0.0, chunk_delay=0.0)
+    connections.add_argument("--api-base", help="Benchmark an already running server instead")
+    connections.add_argument("--requests", type=int, default=200)
+    connections.add_argument("--prompt-words", type=int, default=200)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        server, state = start_server(args)
+        print(f"Mock OpenAI API on http://{args.host}:{server.server_address[1]}/v1 (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+            print(json.dumps(state.counters))
+        return 0
+
+    report = run_bench(args) if args.command == "bench" else run_connection_bench(args)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
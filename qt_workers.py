@@ -0,0 +1,359 @@
+# -----------------------------------------------------------------------------
+# Qt Front Ends: API Workers, Background Tasks, Code Execution, Project Watcher
+# -----------------------------------------------------------------------------
+"""
+The Qt objects of the GUI. They live apart from utils so that utils, and the
+headless dmc pipeline built on it, import without PyQt6.
+"""
+import sys
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import functools
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional, Set, Any, Callable
+
+# GUI Framework
+from PyQt6 import QtCore
+
+from utils import ApiError, RequestCancelled, RequestHandle, get_request_engine
+
+
+# -----------------------------------------------------------------------------
+# API Request Workers
+# -----------------------------------------------------------------------------
+class GptWorker(QtCore.QObject):
+    """
+    Qt front end for one LLM request running on the shared RequestEngine.
+    Keeps the GUI thread free during network I/O; signals are delivered on the
+    thread that owns the worker.
+
+    With stream=True, content deltas are emitted through `chunk` while the
+    response arrives; `finished` still carries the complete text. Errors are
+    emitted through `failed` as an ApiError instance. A cancelled request emits
+    neither.
+    """
+    finished = QtCore.pyqtSignal(str)
+    chunk = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(object)
+    
+    def __init__(self, messages: List[Dict[str, str]], model_name: Optional[str] = None, stream: bool = False, parent: Optional[QtCore.QObject] = None) -> None:
+        super().__init__(parent)
+        self.messages: List[Dict[str, str]] = messages
+        self.model_name: Optional[str] = model_name
+        self.stream: bool = stream
+        self.handle: Optional[RequestHandle] = None
+
+    def start(self) -> None:
+        self.handle = get_request_engine().submit(
+            self.messages,
+            self.model_name,
+            stream=self.stream,
+            on_chunk=self._on_chunk if self.stream else None
+        )
+        self.handle.future.add_done_callback(self._on_done)
+
+    def cancel(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+
+    def isRunning(self) -> bool:
+        return self.handle is not None and not self.handle.future.done()
+
+    def _on_chunk(self, text: str) -> None:
+        if not self.handle.cancelled:
+            self.chunk.emit(text)
+
+    def _on_done(self, future: "Future[str]") -> None:
+        if future.cancelled() or self.handle.cancelled:
+            return
+        error = future.exception()
+        if isinstance(error, RequestCancelled):
+            return
+        if isinstance(error, ApiError):
+            self.failed.emit(error)
+        elif error is not None:
+            self.failed.emit(ApiError(f"Request error: {error}"))
+        else:
+            self.finished.emit(future.result())
+
+
+# --- Background Tasks ---
+# Threads for blocking local work requested by the GUI (context builds, index syncs)
+BACKGROUND_THREADS: int = 2
+
+_background_executor: Optional[ThreadPoolExecutor] = None
+_background_lock = threading.Lock()
+
+
+def get_background_executor() -> ThreadPoolExecutor:
+    """Returns the process-wide pool that runs BackgroundTask calls."""
+    global _background_executor
+    with _background_lock:
+        if _background_executor is None:
+            _background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_THREADS, thread_name_prefix="dmc-background")
+    return _background_executor
+
+
+def shutdown_background_tasks() -> None:
+    """Drops queued background calls; running ones finish on their own."""
+    global _background_executor
+    with _background_lock:
+        executor, _background_executor = _background_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class BackgroundTask(QtCore.QObject):
+    """
+    Qt front end for one blocking local call (a context build, an index sync) running
+    on the shared background pool, so the GUI thread never waits on disk or parsing.
+    `finished` carries the return value and `failed` the exception, delivered on the
+    thread that owns the task; a cancelled task emits neither.
+    """
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object)
+
+    def __init__(self, fn: Callable[..., Any], *args: Any, parent: Optional[QtCore.QObject] = None, **kwargs: Any) -> None:
+        super().__init__(parent)
+        self._call: Callable[[], Any] = functools.partial(fn, *args, **kwargs)
+        self.future: Optional[Future] = None
+        self.cancelled: bool = False
+
+    def start(self) -> None:
+        self.future = get_background_executor().submit(self._call)
+        self.future.add_done_callback(self._on_done)
+
+    def cancel(self) -> None:
+        """Discards the result; a call already running completes in the background."""
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+    def isRunning(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    def _on_done(self, future: Future) -> None:
+        if self.cancelled or future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.failed.emit(error)
+        else:
+            self.finished.emit(future.result())
+
+
+# -----------------------------------------------------------------------------
+# Code Execution Logic
+# -----------------------------------------------------------------------------
+def kill_process_tree(process: subprocess.Popen) -> None:
+    """
+    Kills a process started by CodeExecutionWorker together with everything it spawned.
+    The process leads its own session/process group, so the whole group goes at once.
+    """
+    try:
+        if os.name == 'nt':
+            if process.poll() is not None:
+                return
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                capture_output=True,
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+            )
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+    if process.poll() is None:
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+
+class CodeExecutionWorker(QtCore.QThread):
+    """
+    Worker thread that executes Python code in a separate subprocess.
+    Captures standard output and standard error safely.
+
+    The script runs in its own process group; cancel() or the timeout kills the
+    whole tree, including any processes the script started.
+    """
+    finished = QtCore.pyqtSignal(str, str)
+
+    TIMEOUT_SECONDS: int = 15
+    # After a kill, how long to collect remaining output; a process that escaped the
+    # group can hold the pipes open indefinitely
+    DRAIN_SECONDS: float = 2.0
+    
+    def __init__(self, code_to_execute: str) -> None:
+        super().__init__()
+        self.code_to_execute: str = code_to_execute
+        self.cancelled: bool = False
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        """Stops the script and its child processes; finished is still emitted."""
+        with self._lock:
+            self.cancelled = True
+            process = self._process
+        if process is not None:
+            kill_process_tree(process)
+
+    def run(self) -> None:
+        stdout: str = ""
+        stderr: str = ""
+        filepath: str = ""
+        
+        try:
+            # Create a temporary file to hold the code execution context
+            with tempfile.NamedTemporaryFile(suffix=".py", delete=False, mode='w', encoding='utf-8') as f:
+                f.write(self.code_to_execute)
+                filepath = f.name
+
+            if os.name == 'nt':
+                group_kwargs: Dict[str, Any] = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+            else:
+                group_kwargs = {'start_new_session': True}
+            
+            # Execute the script via the current system python interpreter
+            process = subprocess.Popen(
+                [sys.executable, filepath],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding='utf-8',
+                **group_kwargs
+            )
+            with self._lock:
+                self._process = process
+                cancelled = self.cancelled
+            if cancelled:
+                kill_process_tree(process)
+
+            try:
+                stdout, stderr = process.communicate(timeout=self.TIMEOUT_SECONDS)
+            except subprocess.TimeoutExpired:
+                kill_process_tree(process)
+                try:
+                    stdout, _ = process.communicate(timeout=self.DRAIN_SECONDS)
+                except subprocess.TimeoutExpired as drain:
+                    # Keep what was read before giving up on the pipes
+                    partial = drain.stdout or ""
+                    stdout = partial.decode('utf-8', errors='replace') if isinstance(partial, bytes) else partial
+                    for pipe in (process.stdout, process.stderr):
+                        try:
+                            pipe.close()
+                        except OSError:
+                            pass
+                    process.wait()
+                stderr = f"Execution Error: Code execution exceeded the {self.TIMEOUT_SECONDS}-second timeout limit."
+
+            if self.cancelled:
+                stderr = "Execution cancelled."
+            
+        except Exception as e:
+            stderr = f"Subprocess error: {e}\n{traceback.format_exc()}"
+        finally:
+            with self._lock:
+                self._process = None
+            # Cleanup temporary file
+            if filepath and os.path.exists(filepath):
+                os.unlink(filepath)
+                
+        self.finished.emit(stdout, stderr)
+
+
+# -----------------------------------------------------------------------------
+# Project Watcher
+# -----------------------------------------------------------------------------
+class ProjectWatcher(QtCore.QObject):
+    """
+    Watches a project's directories and reports batches of changed ones.
+
+    Uses QFileSystemWatcher (inotify / ReadDirectoryChangesW / kqueue) where possible.
+    Directories it refuses, or all of them past MAX_NATIVE_DIRS (native watch handles are
+    a limited resource), are polled instead by comparing directory mtimes. Events are
+    debounced so a burst of changes (checkout, build) arrives as a single batch.
+    """
+    directoriesChanged = QtCore.pyqtSignal(list)
+
+    MAX_NATIVE_DIRS: int = 4096
+
+    def __init__(self, parent: Optional[QtCore.QObject] = None, debounce_ms: int = 500, poll_interval_ms: int = 3000) -> None:
+        super().__init__(parent)
+        self._native = QtCore.QFileSystemWatcher(self)
+        self._native.directoryChanged.connect(self._on_changed)
+        self._polled: Dict[str, int] = {}
+        self._pending: Set[str] = set()
+
+        self._debounce = QtCore.QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.setInterval(debounce_ms)
+        self._debounce.timeout.connect(self._flush)
+
+        self._poll_timer = QtCore.QTimer(self)
+        self._poll_timer.setInterval(poll_interval_ms)
+        self._poll_timer.timeout.connect(self._poll)
+
+    def watch(self, directories: List[str]) -> None:
+        """Replaces the watched set, keeping existing watches that are still wanted."""
+        wanted: Set[str] = set(directories)
+        current_native: Set[str] = set(self._native.directories())
+
+        stale: List[str] = list(current_native - wanted)
+        if stale:
+            self._native.removePaths(stale)
+        for path in [p for p in self._polled if p not in wanted]:
+            del self._polled[path]
+
+        to_add: List[str] = sorted(wanted - current_native - set(self._polled))
+        budget: int = max(0, self.MAX_NATIVE_DIRS - len(current_native) + len(stale))
+        failed: List[str] = to_add[budget:]
+        if to_add[:budget]:
+            failed += self._native.addPaths(to_add[:budget])
+
+        for path in failed:
+            self._polled[path] = self._dir_mtime(path)
+        if self._polled and not self._poll_timer.isActive():
+            self._poll_timer.start()
+        elif not self._polled:
+            self._poll_timer.stop()
+
+    def stop(self) -> None:
+        """Stops watching everything and drops pending events."""
+        directories = self._native.directories()
+        if directories:
+            self._native.removePaths(directories)
+        self._polled.clear()
+        self._pending.clear()
+        self._poll_timer.stop()
+        self._debounce.stop()
+
+    @staticmethod
+    def _dir_mtime(path: str) -> int:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return -1
+
+    def _poll(self) -> None:
+        for path, mtime in list(self._polled.items()):
+            current: int = self._dir_mtime(path)
+            if current != mtime:
+                self._polled[path] = current
+                self._on_changed(path)
+
+    def _on_changed(self, path: str) -> None:
+        self._pending.add(path)
+        self._debounce.start()
+
+    def _flush(self) -> None:
+        if self._pending:
+            changed = sorted(self._pending)
+            self._pending.clear()
+            self.directoriesChanged.emit(changed)
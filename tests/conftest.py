@@ -0,0 +1,38 @@
+import os
+from typing import Callable, Dict, Iterator
+
+import pytest
+
+from utils import ProjectContextExtractor
+
+
+@pytest.fixture
+def write_tree(tmp_path) -> Callable[[Dict[str, str]], str]:
+    """Returns a function writing {relative path: text} files under a fresh project root."""
+    root = tmp_path / "project"
+    root.mkdir()
+
+    def write(files: Dict[str, str]) -> str:
+        for rel_path, text in files.items():
+            path = root / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text, encoding="utf-8")
+        return str(root)
+
+    return write
+
+
+@pytest.fixture
+def extractor(tmp_path, monkeypatch) -> Iterator[ProjectContextExtractor]:
+    """An extractor whose persistent indexes live in the test's temporary directory."""
+    monkeypatch.setenv("DMC_CACHE_DIR", str(tmp_path / "cache"))
+    instance = ProjectContextExtractor()
+    instance.process_workers = 0
+    yield instance
+    instance.shutdown()
+
+
+def listed(extractor: ProjectContextExtractor, root: str) -> list:
+    """Posix relative paths of the files a fresh walk of root lists."""
+    extractor.get_folder_structure_and_content(root, extract_content=False)
+    return sorted(rel.replace(os.sep, "/") for rel in extractor._listed_files(root))
@@ -0,0 +1,133 @@
+import json
+import threading
+
+import pytest
+import requests
+
+from utils import (
+    ApiError, AuthenticationError, ContextLengthError, QuotaExceededError, RateLimitError,
+    RateLimiter, ServerError, _error_from_response, _parse_reset_seconds,
+)
+
+
+def make_response(status: int, message: str = "", code: str = "", headers: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"error": {"message": message, "code": code}}).encode()
+    response.headers.update(headers or {})
+    return response
+
+
+# --- Error Classification ---
+@pytest.mark.parametrize("status, message, code", [
+    (413, "Payload too large", ""),
+    (400, "This model's maximum context length is 128000 tokens.", ""),
+    (400, "Too long", "context_length_exceeded"),
+    (429, "Request too large for gpt-5.1 on tokens per min (TPM): Limit 30000, Requested 41000.", "rate_limit_exceeded"),
+])
+def test_oversized_prompts_are_context_length_errors(status, message, code):
+    error = _error_from_response(make_response(status, message, code))
+    assert type(error) is ContextLengthError
+    assert error.status_code == status
+    assert not error.retryable
+
+
+def test_plain_429_is_a_retryable_rate_limit():
+    error = _error_from_response(make_response(429, "Rate limit reached", "rate_limit_exceeded", {"retry-after": "2"}))
+    assert type(error) is RateLimitError
+    assert error.retryable
+    assert error.retry_after == 2.0
+
+
+def test_other_statuses():
+    assert type(_error_from_response(make_response(429, "Out of credit", "insufficient_quota"))) is QuotaExceededError
+    assert type(_error_from_response(make_response(401, "Bad key"))) is AuthenticationError
+    assert type(_error_from_response(make_response(503, "Overloaded"))) is ServerError
+    assert type(_error_from_response(make_response(400, "Invalid model"))) is ApiError
+
+
+def test_non_json_body_keeps_the_text():
+    response = requests.Response()
+    response.status_code = 502
+    response._content = b"<html>Bad gateway</html>"
+    error = _error_from_response(response)
+    assert type(error) is ServerError
+    assert error.message == "<html>Bad gateway</html>"
+
+
+# --- Rate Limiting ---
+def limit_headers(requests_left: int, tokens_left: int, **extra: str) -> dict:
+    headers = {
+        "x-ratelimit-limit-requests": "60",
+        "x-ratelimit-remaining-requests": str(requests_left),
+        "x-ratelimit-limit-tokens": "6000",
+        "x-ratelimit-remaining-tokens": str(tokens_left),
+    }
+    headers.update(extra)
+    return headers
+
+
+@pytest.mark.parametrize("value, seconds", [("20ms", 0.02), ("1s", 1.0), ("6m0s", 360.0), ("1h2m", 3720.0), ("1.5", 1.5)])
+def test_reset_durations(value, seconds):
+    assert _parse_reset_seconds(value) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_unparsable_reset_durations(value):
+    assert _parse_reset_seconds(value) is None
+
+
+def test_unknown_model_is_not_paced():
+    limiter = RateLimiter()
+    assert limiter.acquire("gpt-5.1", 100000) == 0.0
+    assert limiter.token_limit("gpt-5.1") is None
+
+
+def test_waits_follow_the_remaining_allowance():
+    limiter = RateLimiter()
+    limiter.acquire("gpt-5.1", 100)
+    limiter.observe("gpt-5.1", 200, limit_headers(59, 1000), tokens=100)
+    assert limiter.token_limit("gpt-5.1") == 6000
+
+    # 1000 tokens left: a 1000 token request goes now, the next one waits for 1000 tokens to refill
+    assert limiter.acquire("gpt-5.1", 1000) == 0.0
+    assert limiter.acquire("gpt-5.1", 1000) == pytest.approx(10.0, abs=0.1)
+    assert limiter.waits == 1
+
+
+def test_in_flight_requests_stay_deducted():
+    limiter = RateLimiter()
+    limiter.acquire("gpt-5.1", 0)
+    limiter.observe("gpt-5.1", 200, limit_headers(59, 3000))
+    limiter.acquire("gpt-5.1", 2000)  # not answered yet
+    limiter.acquire("gpt-5.1", 500)
+    # The server has not counted the two requests in flight yet
+    limiter.observe("gpt-5.1", 200, limit_headers(59, 3000), tokens=500)
+    assert limiter.acquire("gpt-5.1", 1000) == 0.0
+    assert limiter.acquire("gpt-5.1", 1000) > 0.0
+
+
+def test_429_blocks_the_model_until_retry_after():
+    limiter = RateLimiter()
+    limiter.acquire("gpt-5.1", 10)
+    limiter.observe("gpt-5.1", 429, limit_headers(10, 5000, **{"retry-after-ms": "1500"}), tokens=10)
+    assert limiter.acquire("gpt-5.1", 10) == pytest.approx(1.5, abs=0.1)
+    assert limiter.acquire("gpt-5-mini", 10) == 0.0
+
+
+def test_429_without_hint_waits_for_the_exhausted_window():
+    limiter = RateLimiter()
+    limiter.acquire("gpt-5.1", 10)
+    headers = limit_headers(10, 0, **{"x-ratelimit-reset-requests": "1s", "x-ratelimit-reset-tokens": "6s"})
+    limiter.observe("gpt-5.1", 429, headers, tokens=10)
+    # Only the tokens window is exhausted
+    assert limiter.acquire("gpt-5.1", 10) == pytest.approx(6.0, abs=0.1)
+
+
+def test_wait_is_cut_short_by_cancellation():
+    limiter = RateLimiter()
+    limiter.acquire("gpt-5.1", 10)
+    limiter.observe("gpt-5.1", 429, limit_headers(10, 5000, **{"retry-after": "30"}), tokens=10)
+    cancel = threading.Event()
+    cancel.set()
+    assert limiter.wait("gpt-5.1", 10, cancel) == pytest.approx(30.0, abs=0.1)
@@ -0,0 +1,116 @@
+from utils import count_tokens
+
+from tests.conftest import listed
+
+
+def python_file(functions: int, body_lines: int = 20) -> str:
+    lines = []
+    for i in range(functions):
+        lines.append(f"def function_{i}(value):")
+        lines.extend(f"    value = value + {j}  # step {j} of function {i}" for j in range(body_lines))
+        lines.append("    return value")
+    return "\n".join(lines)
+
+
+def extracted(*texts: str) -> list:
+    return [(text, {"tokens": count_tokens(text)}) for text in texts]
+
+
+# --- Token Budget Packing ---
+def test_files_that_fit_are_packed_whole(extractor):
+    small = python_file(1)
+    packed, omitted = extractor._pack_to_budget(["a.py", "b.py"], extracted(small, small), 10000)
+    assert [(path, content) for path, content, _ in packed] == [("a.py", small), ("b.py", small)]
+    assert omitted == []
+
+
+def test_first_file_over_budget_is_truncated_then_outlined(extractor):
+    first, large, tail = python_file(1), python_file(40), python_file(30)
+    budget = count_tokens(first) + 10 + 600
+    packed, omitted = extractor._pack_to_budget(["a.py", "b.py", "c.py", "d.py"], extracted(first, large, tail, tail), budget)
+
+    paths = [path for path, _, _ in packed]
+    assert paths[:2] == ["a.py", "b.py"]
+    truncated = packed[1][1]
+    assert truncated.startswith("def function_0(value):")
+    assert truncated.endswith("more lines]")
+    assert packed[1][2]["tokens"] <= 600
+    # What is left over only takes outlines of the tail, or lists it as omitted
+    for path, content, _ in packed[2:]:
+        assert content.startswith("    [Outline only]")
+    assert sorted(paths[2:] + omitted) == ["c.py", "d.py"]
+    assert sum(stats["tokens"] for _, _, stats in packed) <= budget
+
+
+def test_too_little_room_left_omits_instead_of_truncating(extractor):
+    prose = "\n".join(f"Line {i} of some notes without definitions." for i in range(400))
+    packed, omitted = extractor._pack_to_budget(["notes.md"], extracted(prose), extractor.MIN_TRUNCATED_TOKENS - 1)
+    assert packed == []
+    assert omitted == ["notes.md"]
+
+
+def test_truncation_cuts_at_line_boundaries(extractor):
+    content = python_file(5)
+    head = extractor._truncate_to_tokens(content, 100)
+    kept = head.split("\n")[:-1]
+    assert kept == content.split("\n")[:len(kept)]
+    assert head.endswith(f"[... truncated: {len(content.splitlines()) - len(kept)} more lines]")
+    assert count_tokens("\n".join(kept)) <= 100
+
+
+def test_targeted_context_respects_the_budget(extractor, write_tree):
+    root = write_tree({"a.py": python_file(1), "b.py": python_file(60), "c.txt": "plain notes\n" * 2000})
+    text = extractor.build_targeted_context(root, ["a.py", "b.py", "c.txt"], token_budget=2000)
+    assert "File: a.py" in text
+    assert "[... truncated:" in text
+    assert "OMITTED TO FIT THE TOKEN BUDGET (1 files): c.txt" in text
+    assert count_tokens(text) <= 2000
+
+
+# --- Compact Structure ---
+def compact_tree() -> dict:
+    files = {f"tests/test_module_{i}.py": "" for i in range(60)}
+    files.update({f"docs/page{i}.md": "" for i in range(6)})
+    files.update({"src/app/main.py": "", "src/app/views.py": "", "README.md": ""})
+    return files
+
+
+def test_compact_structure_without_budget_lists_every_file(extractor, write_tree):
+    root = write_tree(compact_tree())
+    text = extractor.compact_structure(root)
+    lines = text.split("\n")
+    assert "./: README.md" in lines
+    assert "src/app/: main.py, views.py" in lines
+    assert all(f"test_module_{i}.py" in text for i in range(60))
+
+
+def test_compact_structure_groups_files_to_fit_the_budget(extractor, write_tree):
+    root = write_tree(compact_tree())
+    text = extractor.compact_structure(root, 300)
+    lines = text.split("\n")
+    assert count_tokens(text) <= 300
+    assert "tests/: test_*.py (60 files)" in lines
+    # Groups stop at what the budget requires
+    assert "docs/: page0.md, page1.md, page2.md, page3.md, page4.md, page5.md" in lines
+    assert "src/app/: main.py, views.py" in lines
+
+
+def test_compact_structure_summarizes_directories_last(extractor, write_tree):
+    files = {f"pkg/sub{d}/file_{d}_{i}.py": "" for d in range(30) for i in range(8)}
+    files.update({f"pkg/sub{d}/notes{i}.md": "" for d in range(30) for i in range(3)})
+    root = write_tree(files)
+    text = extractor.compact_structure(root, 300)
+    assert count_tokens(text) <= 300
+    assert text.endswith("\npkg/ [330 files: 240 .py, 90 .md]")
+
+
+def test_grouped_patterns_resolve_against_their_directory(extractor, write_tree):
+    files = compact_tree()
+    files["other/test_module_0.py"] = ""
+    root = write_tree(files)
+    listed(extractor, root)
+    resolved = extractor.resolve_target_files(root, ["tests/test_*.py (60 files)"])
+    assert len(resolved) == extractor.TARGET_EXPANSION_LIMIT
+    assert all(path.replace("\\", "/").startswith("tests/") for path in resolved)
+    assert extractor.resolve_target_files(root, ["./*.md"]) == ["README.md"]
+    assert sorted(p.replace("\\", "/") for p in extractor.resolve_target_files(root, ["src/"])) == ["src/app/main.py", "src/app/views.py"]
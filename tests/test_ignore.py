@@ -0,0 +1,60 @@
+from tests.conftest import listed
+
+
+def test_negation_reincludes_a_file(extractor, write_tree):
+    root = write_tree({
+        ".gitignore": "*.log.txt\n!keep.log.txt\n",
+        "a.log.txt": "",
+        "keep.log.txt": "",
+        "main.py": "",
+    })
+    assert listed(extractor, root) == ["keep.log.txt", "main.py"]
+
+
+def test_directory_only_rule_keeps_files_of_that_name(extractor, write_tree):
+    root = write_tree({
+        ".gitignore": "gen.py/\n",
+        "gen.py/inner.py": "",
+        "pkg/gen.py": "",
+    })
+    assert listed(extractor, root) == ["pkg/gen.py"]
+
+
+def test_anchored_pattern_only_matches_at_its_base(extractor, write_tree):
+    root = write_tree({
+        ".gitignore": "/config.py\ndocs/*.md\n",
+        "config.py": "",
+        "pkg/config.py": "",
+        "docs/guide.md": "",
+        "pkg/docs/guide.md": "",
+    })
+    assert listed(extractor, root) == ["pkg/config.py", "pkg/docs/guide.md"]
+
+
+def test_nested_gitignore_overrides_its_parent(extractor, write_tree):
+    root = write_tree({
+        ".gitignore": "*.json\n",
+        "settings.json": "{}",
+        "web/.gitignore": "!package.json\ndist.py\n",
+        "web/package.json": "{}",
+        "web/other.json": "{}",
+        "web/dist.py": "",
+        "dist.py": "",
+    })
+    assert listed(extractor, root) == ["dist.py", "web/package.json"]
+
+
+def test_user_exclusions_win_over_negations(extractor, write_tree):
+    root = write_tree({
+        ".gitignore": "!secret.py\n",
+        "secret.py": "",
+        "main.py": "",
+    })
+    extractor.set_exclusions(["secret.py", "*.tmp"])
+    assert listed(extractor, root) == ["main.py"]
+
+
+def test_ignore_files_can_be_disabled(extractor, write_tree):
+    root = write_tree({".gitignore": "*.py\n", "main.py": ""})
+    extractor.respect_ignore_files = False
+    assert listed(extractor, root) == ["main.py"]
@@ -0,0 +1,174 @@
+import os
+
+from utils import ImportGraph, ProjectIndex, SymbolIndex, parse_python_symbols
+
+
+# --- Persistent Content Index ---
+def test_project_index_invalidates_on_size_or_mtime(tmp_path):
+    index = ProjectIndex(str(tmp_path / "project"), str(tmp_path / "cache"))
+    index.store("a.py", 10, 1000, "print(1)", {"tokens": 3})
+    index.flush()
+    assert index.lookup("a.py", 10, 1000) == ("print(1)", {"tokens": 3})
+    assert index.lookup("a.py", 11, 1000) is None
+    assert index.lookup("a.py", 10, 1001) is None
+    assert index.lookup("b.py", 10, 1000) is None
+    index.close()
+
+
+def test_project_index_persists_across_sessions(tmp_path):
+    root, cache = str(tmp_path / "project"), str(tmp_path / "cache")
+    index = ProjectIndex(root, cache)
+    index.store("a.py", 10, 1000, "print(1)", {"tokens": 3})
+    index.store_symbols("a.py", 10, 1000, {"definitions": [], "calls": [], "imports": []})
+    index.close()
+
+    reopened = ProjectIndex(root, cache)
+    assert reopened.lookup("a.py", 10, 1000) == ("print(1)", {"tokens": 3})
+    assert reopened.lookup_symbols("a.py", 10, 1000) == {"definitions": [], "calls": [], "imports": []}
+    assert reopened.lookup_symbols("a.py", 10, 999) is None
+    reopened.close()
+
+
+def test_unchanged_files_are_served_by_the_index(extractor, write_tree):
+    root = write_tree({"a.py": "VALUE = 1\n"})
+    path = os.path.join(root, "a.py")
+
+    def rewrite(text: str, mtime_ns: int) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def extract() -> str:
+        stat = os.stat(path)
+        content = extractor.extract_file_content_indexed(root, path, 0, stat.st_size, stat.st_mtime_ns)[0]
+        extractor.cache.clear()
+        return content
+
+    mtime_ns = os.stat(path).st_mtime_ns
+    assert "VALUE = 1" in extract()
+    # Same size and mtime: the stored content is trusted without reading the file
+    rewrite("VALUE = 2\n", mtime_ns)
+    assert "VALUE = 1" in extract()
+    rewrite("VALUE = 2\n", mtime_ns + 1_000_000)
+    assert "VALUE = 2" in extract()
+    rewrite("VALUE = 30\n", mtime_ns + 1_000_000)
+    assert "VALUE = 30" in extract()
+
+
+def test_sync_picks_up_changed_directories(extractor, write_tree):
+    root = write_tree({"pkg/cache.py": "def evict(): pass\n", "main.py": "print()\n"})
+    extractor.sync_indexes(root)
+    assert [rel for rel, _ in extractor.rank_files(root, "evict")] == [os.path.join("pkg", "cache.py")]
+
+    write_tree({
+        "pkg/lru.py": "def evict_oldest(): pass\n",
+        "pkg/cache.py": "def store_value(): pass\n",
+        "main.py": "import pkg.cache  # evict on exit\n",
+    })
+    extractor.refresh_directories(root, [os.path.join(root, "pkg")])
+    extractor.sync_indexes(root, [os.path.join(root, "pkg")])
+    ranked = [rel for rel, _ in extractor.rank_files(root, "evict")]
+    # Files outside the changed directories keep their indexed version
+    assert ranked == [os.path.join("pkg", "lru.py")]
+
+
+# --- Symbol Index ---
+SOURCE = '''
+class Store:
+    """Keeps values."""
+
+    def load(self, key):
+        return self.read(key)
+
+    def read(self, key):
+        return key
+
+
+def main():
+    store = Store()
+    store.load("a")
+'''
+
+
+def test_symbol_index_finds_definitions_and_callers():
+    index = SymbolIndex()
+    index.update("store.py", (1, 1), parse_python_symbols(SOURCE))
+    index.update("other.py", (1, 1), parse_python_symbols("def load():\n    pass\n"))
+
+    assert sorted(rel for rel, _ in index.definitions("load")) == ["other.py", "store.py"]
+    assert [(rel, d[0], d[1]) for rel, d in index.definitions("Store.load")] == [("store.py", "Store.load", "method")]
+    assert [d[0] for d in index.members("store.py", "Store")] == ["Store.load", "Store.read"]
+    assert sorted(call[0] for _, call in index.callers("load")) == ["main"]
+    assert [call[0] for _, call in index.callers("Store.read")] == ["Store.load"]
+
+
+def test_symbol_index_update_replaces_a_file():
+    index = SymbolIndex()
+    index.update("store.py", (1, 1), parse_python_symbols(SOURCE))
+    index.update("store.py", (2, 2), parse_python_symbols("def fetch():\n    pass\n"))
+    assert index.definitions("load") == []
+    assert index.callers("load") == []
+    assert index.version_of("store.py") == (2, 2)
+    index.remove("store.py")
+    assert index.definitions("fetch") == []
+    assert len(index) == 0
+
+
+def test_symbol_index_of_a_project(extractor, write_tree):
+    root = write_tree({"pkg/store.py": SOURCE, "pkg/broken.py": "def (:\n"})
+    index = extractor.symbol_index(root)
+    assert [rel.replace(os.sep, "/") for rel, _ in index.definitions("Store")] == ["pkg/store.py"]
+    assert extractor.symbol_targets(root, "what calls `Store.read`?")
+
+
+# --- Import Graph ---
+def python_graph(files: dict) -> ImportGraph:
+    graph = ImportGraph()
+    graph.set_files(list(files))
+    for rel_path, text in files.items():
+        graph.update(rel_path, (1, 1), parse_python_symbols(text)["imports"])
+    return graph
+
+
+def test_python_imports_resolve_to_project_files():
+    graph = python_graph({
+        "app/main.py": "from . import views\nfrom .models import User\nimport requests\n",
+        "app/views.py": "from app.models import User\nimport helpers\n",
+        "app/models/__init__.py": "",
+        "app/helpers.py": "",
+        "helpers.py": "",
+        "src/lib/core.py": "",
+        "script.py": "import lib.core\nimport app\n",
+        "app/__init__.py": "",
+    })
+    assert graph.dependencies("app/main.py") == ["app/views.py", "app/models/__init__.py"]
+    # Absolute imports resolve from the file's directory first, then its ancestors
+    assert graph.dependencies("app/views.py") == ["app/models/__init__.py", "app/helpers.py"]
+    assert graph.dependencies("script.py") == ["src/lib/core.py", "app/__init__.py"]
+
+
+def test_js_imports_resolve_with_extensions_and_index_files():
+    graph = ImportGraph()
+    files = ["src/app.ts", "src/util.ts", "src/components/index.tsx", "src/api/client.js"]
+    graph.set_files(files)
+    graph.update("src/app.ts", (1, 1), ["./util", "./components", "@/api/client", "react"])
+    assert graph.dependencies("src/app.ts") == ["src/util.ts", "src/components/index.tsx", "src/api/client.js"]
+
+
+def test_new_files_re_resolve_imports():
+    graph = python_graph({"main.py": "import settings\n"})
+    assert graph.dependencies("main.py") == []
+    graph.set_files(["main.py", "settings.py"])
+    assert graph.dependencies("main.py") == ["settings.py"]
+
+
+def test_dependencies_are_added_to_a_selection(extractor, write_tree):
+    root = write_tree({
+        "main.py": "import config\nfrom lib import db\n",
+        "config.py": "",
+        "lib/__init__.py": "",
+        "lib/db.py": "import config\n",
+        "unrelated.py": "",
+    })
+    expanded = extractor.expand_with_dependencies(root, ["main.py"])
+    assert [rel.replace(os.sep, "/") for rel in expanded] == ["main.py", "config.py", "lib/db.py"]
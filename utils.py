@@ -3,17 +3,32 @@
 # -----------------------------------------------------------------------------
 import sys
 import os
+import posixpath
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import traceback
 import re
-import subprocess
+import fnmatch
+import socket
 import tempfile
+import sqlite3
+import hashlib
+import unicodedata
+import time
+import random
+import ast
+import zlib
+import math
+import threading
+import functools
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Optional, Set, Tuple, Union, Any
-
-# GUI Framework
-from PyQt6 import QtCore
+from typing import List, Dict, Optional, Set, Tuple, Union, Any, Callable
 
 # Optional Dependencies: Syntax Highlighting & Rendering
 try:
@@ -43,28 +58,723 @@ try:
 except ImportError:
     openpyxl = xlrd = None
 
+# Optional Dependencies: Token Counting
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Optional Dependencies: Vector Search
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+
+# -----------------------------------------------------------------------------
+# Token Accounting
+# -----------------------------------------------------------------------------
+# Approximates BPE pre-tokenization: words (with a leading underscore merged in),
+# digit groups of up to 3, punctuation runs and whitespace runs
+_TOKEN_PIECE_RE = re.compile(r"_?[^\W\d_]+|\d{1,3}|[^\w\s]+|_+|\s+")
+
+
+def heuristic_token_count(text: str) -> int:
+    """
+    Estimates the BPE token count of a text without a tokenizer.
+
+    Calibrated against the o200k/cl100k encodings: short ASCII words are one token
+    and longer identifiers split roughly every 8 characters, non-ASCII words cost about
+    one token per character, punctuation runs merge in pairs, and whitespace other
+    than a single separating space (e.g. newlines, indentation) costs one token per run.
+    """
+    tokens: int = 0
+    for piece in _TOKEN_PIECE_RE.findall(text):
+        first: str = piece[0]
+        if first.isspace():
+            if piece != " ":
+                tokens += 1
+        elif first.isdigit():
+            tokens += 1
+        elif first.isalpha() or (first == "_" and len(piece) > 1 and piece[1].isalpha()):
+            tokens += 1 + (len(piece) - 1) // 8 if piece.isascii() else len(piece)
+        else:
+            tokens += (len(piece) + 1) // 2
+    return tokens
+
+
+class _BpeTokenCounter:
+    """Counts tokens with tiktoken, loading the encoding on first use."""
+
+    def __init__(self, encoding_name: str = "o200k_base") -> None:
+        self.encoding_name: str = encoding_name
+        self._encoding: Any = None
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str) -> int:
+        if self._encoding is None:
+            with self._lock:
+                if self._encoding is None:
+                    self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return len(self._encoding.encode_ordinary(text))
+
+
+_token_counter: Optional[Any] = None
+_token_counter_name: str = ""
+_token_counter_lock = threading.Lock()
+
+
+def set_token_counter(counter: Optional[Any], name: str = "custom") -> None:
+    """
+    Installs the callable (text -> int) used for all token statistics.
+    Pass None to go back to the default (tiktoken if installed, else the heuristic).
+    Note that heavy formats parsed in the process pool always use the default counter.
+    """
+    global _token_counter, _token_counter_name
+    _token_counter = counter
+    _token_counter_name = name if counter is not None else ""
+
+
+def get_token_counter_name() -> str:
+    """Identifies the active counter, so cached token statistics can be invalidated when it changes."""
+    if _token_counter is None:
+        _resolve_default_token_counter()
+    return _token_counter_name
+
+
+def _tiktoken_cache_path(encoding_name: str) -> Optional[str]:
+    """Where tiktoken caches a downloaded encoding (mirrors tiktoken.load.read_file_cached)."""
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        cache_dir: str = os.environ["TIKTOKEN_CACHE_DIR"]
+    elif "DATA_GYM_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["DATA_GYM_CACHE_DIR"]
+    else:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return None
+    blobpath: str = f"https://openaipublic.blob.core.windows.net/encodings/{encoding_name}.tiktoken"
+    return os.path.join(cache_dir, hashlib.sha1(blobpath.encode()).hexdigest())
+
+
+def _download_encoding(counter: "_BpeTokenCounter") -> None:
+    try:
+        counter("probe")
+    except Exception:
+        pass
+
+
+def _resolve_default_token_counter() -> None:
+    """
+    Picks tiktoken when its encoding is already on disk, else the heuristic. A missing
+    encoding is downloaded on a daemon thread for the next session rather than on the
+    caller's (often the GUI) thread; the counter never changes within a session, so
+    cached token statistics stay consistent.
+    """
+    global _token_counter, _token_counter_name
+    with _token_counter_lock:
+        if _token_counter is not None:
+            return
+        if TIKTOKEN_AVAILABLE:
+            counter = _BpeTokenCounter()
+            cache_path = _tiktoken_cache_path(counter.encoding_name)
+            if cache_path is not None and os.path.isfile(cache_path):
+                try:
+                    counter("probe")
+                    _token_counter, _token_counter_name = counter, f"tiktoken:{counter.encoding_name}"
+                    return
+                except Exception:
+                    pass
+            else:
+                threading.Thread(target=_download_encoding, args=(counter,), daemon=True).start()
+        _token_counter, _token_counter_name = heuristic_token_count, "heuristic"
+
+
+def warm_token_counter() -> None:
+    """Resolves the default token counter on a background thread (loading an encoding takes a moment)."""
+    if _token_counter is None:
+        threading.Thread(target=_resolve_default_token_counter, daemon=True).start()
+
+
+def count_tokens(text: str) -> int:
+    """Counts the tokens of a text with the active token counter."""
+    if _token_counter is None:
+        _resolve_default_token_counter()
+    return _token_counter(text)
+
+
+# Prompt token budgets per model. These mirror low-tier per-minute limits so that a
+# single request never trips a 429 on its own; raise them for higher usage tiers.
+MODEL_TOKEN_BUDGETS: Dict[str, int] = {
+    "gpt-5.1": 30000,
+    "gpt-5-mini": 60000,
+}
+DEFAULT_TOKEN_BUDGET: int = 30000
+
+# Tokens kept free for the model's answer when sizing a prompt
+RESPONSE_TOKEN_RESERVE: int = 4000
+
+
+def model_token_budget(model_name: str) -> int:
+    """
+    Returns the prompt token budget for a model, after the response reserve.
+    A per-minute token limit learned from the API's rate-limit headers caps it further.
+    """
+    budget: int = MODEL_TOKEN_BUDGETS.get(model_name, DEFAULT_TOKEN_BUDGET)
+    learned: Optional[int] = rate_limiter.token_limit(model_name)
+    if learned is not None:
+        budget = min(budget, learned)
+    return max(0, budget - RESPONSE_TOKEN_RESERVE)
+
 
 # -----------------------------------------------------------------------------
 # OpenAI API Integration
 # -----------------------------------------------------------------------------
-def gpt4_1_request(messages: List[Dict[str, str]], model_name: Optional[str] = None) -> str:
+# Shared HTTP client: one keep-alive connection pool for every Brain/Worker call
+HTTP_POOL_SIZE: int = 8
+
+_http_session: Optional[requests.Session] = None
+_http_adapter: Optional[HTTPAdapter] = None
+_http_lock = threading.Lock()
+_http_stats: Dict[str, float] = {'requests': 0, 'seconds': 0.0, 'opened': 0, 'reused': 0}
+
+# Per-thread hook told which pooled connection a request checks out, so that a
+# cancellation from another thread can shut that socket down mid-read
+_connection_local = threading.local()
+
+
+class _TrackingPoolMixin:
+    def _get_conn(self, timeout: Optional[float] = None) -> Any:
+        conn = super()._get_conn(timeout)
+        # The pool closes dropped connections before handing them out, so an open
+        # socket here means the request rides on a kept-alive connection
+        with _http_lock:
+            _http_stats['reused' if getattr(conn, 'sock', None) is not None else 'opened'] += 1
+        sink = getattr(_connection_local, 'sink', None)
+        if sink is not None:
+            sink(conn)
+        return conn
+
+
+class _TrackingHTTPConnectionPool(_TrackingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _TrackingHTTPSConnectionPool(_TrackingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _TrackingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools report checked-out connections to _connection_local.sink."""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TrackingHTTPConnectionPool,
+            'https': _TrackingHTTPSConnectionPool,
+        }
+
+
+def _abort_connection(conn: Any) -> None:
+    """Shuts a connection's socket down, waking any thread blocked reading from it."""
+    sock = getattr(conn, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def get_http_session() -> requests.Session:
+    """
+    Returns the process-wide requests.Session used for API calls.
+
+    Its adapter keeps up to HTTP_POOL_SIZE connections per host alive, so consecutive
+    calls skip the TCP and TLS handshakes. Sessions are safe to share between worker
+    threads for plain request/response use.
+    """
+    global _http_session, _http_adapter
+    with _http_lock:
+        if _http_session is None:
+            _http_adapter = _TrackingHTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session = requests.Session()
+            session.mount("https://", _http_adapter)
+            session.mount("http://", _http_adapter)
+            _http_session = session
+    return _http_session
+
+
+def _record_http_call(seconds: float) -> None:
+    with _http_lock:
+        _http_stats['requests'] += 1
+        _http_stats['seconds'] += seconds
+
+
+def get_connection_stats() -> Dict[str, float]:
+    """
+    Connection reuse metrics of the shared session: requests sent, connections
+    opened, requests served on a reused connection (as observed when each request
+    checked its connection out of the pool), and mean time to response headers.
+    """
+    with _http_lock:
+        sent = int(_http_stats['requests'])
+        seconds = _http_stats['seconds']
+        opened = int(_http_stats['opened'])
+        reused = int(_http_stats['reused'])
+    return {
+        'requests': sent,
+        'connections_opened': opened,
+        'connections_reused': reused,
+        'mean_latency_s': seconds / sent if sent else 0.0,
+    }
+
+
+def reset_connection_stats() -> None:
+    with _http_lock:
+        for key in _http_stats:
+            _http_stats[key] = 0
+
+
+def close_http_connections() -> None:
+    """Closes the shared session's pooled connections; the next call opens a new one."""
+    with _http_lock:
+        adapter = _http_adapter
+    if adapter is not None:
+        adapter.poolmanager.clear()
+
+
+# --- Client-side Rate Limiting ---
+_RESET_PART_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_RESET_UNITS: Dict[str, float] = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def _parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """Parses rate-limit durations such as "20ms", "1s", "6m0s" or a bare number of seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _RESET_PART_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _RESET_UNITS[unit] for amount, unit in parts)
+
+
+def _parse_int_header(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _TokenBucket:
+    """
+    One per-minute allowance (requests or tokens) that refills continuously.
+
+    Reservations are taken up front and may drive the level negative, so concurrent
+    callers queue behind each other instead of all waking up at the same moment.
+    """
+
+    def __init__(self, capacity: Optional[int] = None) -> None:
+        self.capacity: Optional[int] = capacity
+        self.level: float = float(capacity or 0)
+        self.updated: float = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity:
+            self.level = min(float(self.capacity), self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def reserve(self, amount: int, now: float) -> float:
+        """Takes amount from the bucket; returns how long to wait before it is covered."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        # A request larger than the whole allowance can at best go out on a full bucket
+        needed: float = min(amount, self.capacity)
+        delay: float = max(0.0, (needed - self.level) * 60.0 / self.capacity)
+        self.level -= needed
+        return delay
+
+    def observe(self, limit: Optional[int], remaining: Optional[int], in_flight: int, now: float) -> None:
+        """
+        Re-synchronizes with the server's view of the allowance. Requests still in
+        flight may not be counted by the server yet, so they stay deducted.
+        """
+        if limit:
+            self.capacity = limit
+        if remaining is not None and self.capacity:
+            self.level = float(min(remaining, self.capacity) - in_flight)
+            self.updated = now
+
+
+class RateLimiter:
+    """
+    Paces API calls per model so they stay under the account's rate limits.
+
+    Limits are learned from the x-ratelimit-* headers of every response (a model is
+    not paced until its first response arrives), and a 429's retry-after blocks the
+    model until it expires. acquire() reserves the request and its estimated
+    tokens and returns how long the caller must wait, so concurrent tabs share the
+    allowance instead of discovering it through failed round trips.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._requests: Dict[str, _TokenBucket] = {}
+        self._tokens: Dict[str, _TokenBucket] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._in_flight: Dict[str, List[int]] = {}  # model -> [requests, tokens]
+        self.waits: int = 0
+        self.waited_seconds: float = 0.0
+
+    def _buckets(self, model: str) -> Tuple[_TokenBucket, _TokenBucket]:
+        if model not in self._requests:
+            self._requests[model] = _TokenBucket()
+            self._tokens[model] = _TokenBucket()
+            self._in_flight[model] = [0, 0]
+        return self._requests[model], self._tokens[model]
+
+    def acquire(self, model: str, tokens: int) -> float:
+        """Reserves one request and `tokens` tokens for a model; returns the delay to honor first."""
+        now = time.monotonic()
+        with self._lock:
+            requests_bucket, tokens_bucket = self._buckets(model)
+            delay = max(
+                requests_bucket.reserve(1, now),
+                tokens_bucket.reserve(tokens, now),
+                self._blocked_until.get(model, 0.0) - now,
+            )
+            in_flight = self._in_flight[model]
+            in_flight[0] += 1
+            in_flight[1] += tokens
+            if delay > 0:
+                self.waits += 1
+                self.waited_seconds += delay
+        return max(0.0, delay)
+
+    def wait(self, model: str, tokens: int, cancel_event: Optional[threading.Event] = None) -> float:
+        """
+        acquire() followed by the corresponding sleep, cut short if cancel_event is set.
+        Returns the delay that was required.
+        """
+        delay = self.acquire(model, tokens)
+        if delay > 0:
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+        return delay
+
+    def release(self, model: str, tokens: int) -> None:
+        """Ends the in-flight reservation made by acquire() for a request that has completed."""
+        with self._lock:
+            in_flight = self._in_flight.get(model)
+            if in_flight is not None:
+                in_flight[0] = max(0, in_flight[0] - 1)
+                in_flight[1] = max(0, in_flight[1] - tokens)
+
+    def observe(self, model: str, status_code: int, headers: Any, tokens: int = 0) -> None:
+        """
+        Updates the model's allowance from a response's rate-limit headers and releases
+        the request's reservation (`tokens` being the amount passed to acquire()).
+        """
+        self.release(model, tokens)
+        now = time.monotonic()
+        with self._lock:
+            requests_bucket, tokens_bucket = self._buckets(model)
+            in_flight = self._in_flight[model]
+            requests_bucket.observe(
+                _parse_int_header(headers.get('x-ratelimit-limit-requests')),
+                _parse_int_header(headers.get('x-ratelimit-remaining-requests')),
+                in_flight[0],
+                now,
+            )
+            tokens_bucket.observe(
+                _parse_int_header(headers.get('x-ratelimit-limit-tokens')),
+                _parse_int_header(headers.get('x-ratelimit-remaining-tokens')),
+                in_flight[1],
+                now,
+            )
+            if status_code == 429:
+                retry_after = _parse_reset_seconds(headers.get('retry-after-ms'))
+                retry_after = retry_after / 1000.0 if retry_after is not None else _parse_reset_seconds(headers.get('retry-after'))
+                if retry_after is None:
+                    # No explicit hint: wait for the exhausted windows to reset. A 429 with
+                    # allowance left (e.g. a single oversized request) blocks nothing.
+                    resets = [
+                        _parse_reset_seconds(headers.get(f'x-ratelimit-reset-{kind}'))
+                        for kind in ('requests', 'tokens')
+                        if _parse_int_header(headers.get(f'x-ratelimit-remaining-{kind}')) == 0
+                    ]
+                    retry_after = max([r for r in resets if r is not None], default=None)
+                if retry_after is not None:
+                    self._blocked_until[model] = max(self._blocked_until.get(model, 0.0), now + retry_after)
+
+    def token_limit(self, model: str) -> Optional[int]:
+        """The per-minute token limit reported by the API for a model, if known."""
+        with self._lock:
+            bucket = self._tokens.get(model)
+            return bucket.capacity if bucket is not None else None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._requests.clear()
+            self._tokens.clear()
+            self._blocked_until.clear()
+            self._in_flight.clear()
+
+
+rate_limiter = RateLimiter()
+
+
+def estimate_request_tokens(messages: List[Dict[str, str]]) -> int:
+    """Estimates the prompt tokens a chat request is charged, including per-message framing."""
+    return sum(count_tokens(str(message.get('content', ''))) + 4 for message in messages) + 3
+
+
+# --- Cancellation ---
+class CancelToken(threading.Event):
+    """
+    A threading.Event that also runs abort callbacks when set, so cancellation can
+    interrupt blocking I/O (e.g. close a socket) instead of waiting for the next check.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._callbacks: List[Callable[[], None]] = []
+        self._callbacks_lock = threading.Lock()
+
+    def set(self) -> None:
+        super().set()
+        with self._callbacks_lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """Registers callback to run on set(); runs it at once if already set."""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+# --- Typed API Errors ---
+class ApiError(Exception):
+    """
+    Base class for failed API calls. str() keeps the historical
+    "API Error (status): message" form used in the chat views.
+    """
+    retryable: bool = False
+
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.message: str = message
+        self.status_code: Optional[int] = status_code
+
+    def __str__(self) -> str:
+        if self.status_code is None:
+            return f"API Error: {self.message}"
+        return f"API Error ({self.status_code}): {self.message}"
+
+
+class AuthenticationError(ApiError):
+    """Missing, invalid or unauthorized API key."""
+
+
+class QuotaExceededError(ApiError):
+    """The account is out of credit; waiting does not help."""
+
+
+class ContextLengthError(ApiError):
+    """The prompt is too large for the model's context window or per-minute token limit."""
+
+
+class RateLimitError(ApiError):
+    """Transient 429: too many requests or tokens in the current window."""
+    retryable = True
+
+    def __init__(self, message: str, status_code: Optional[int] = 429, retry_after: Optional[float] = None) -> None:
+        super().__init__(message, status_code)
+        self.retry_after: Optional[float] = retry_after
+
+
+class ApiTimeoutError(ApiError):
+    """The request timed out before the API answered."""
+    retryable = True
+
+
+class ServerError(ApiError):
+    """5xx responses and dropped connections."""
+    retryable = True
+
+
+class RequestCancelled(ApiError):
+    """The request was cancelled by the caller before it completed."""
+
+    def __init__(self, message: str = "Request cancelled.") -> None:
+        super().__init__(message)
+
+
+_CONTEXT_LENGTH_CODES: Set[str] = {'context_length_exceeded', 'string_above_max_length'}
+_CONTEXT_LENGTH_RE = re.compile(r"maximum context length|context window|too many tokens|request too large", re.IGNORECASE)
+
+
+def _error_from_response(response: requests.Response) -> ApiError:
+    """Maps a non-200 response to the matching ApiError subclass."""
+    status: int = response.status_code
+    message: str = response.text
+    code: str = ""
+    try:
+        error = response.json().get('error') or {}
+        message = error.get('message') or message
+        code = str(error.get('code') or error.get('type') or "")
+    except (ValueError, AttributeError):
+        pass
+
+    if status == 413 or code in _CONTEXT_LENGTH_CODES or (status in (400, 429) and _CONTEXT_LENGTH_RE.search(message)):
+        # A 429 "Request too large" means the prompt alone exceeds the per-minute
+        # token limit: it can never succeed as is, so it is a size problem
+        return ContextLengthError(message, status)
+    if status == 429:
+        if code == 'insufficient_quota':
+            return QuotaExceededError(message, status)
+        retry_after = _parse_reset_seconds(response.headers.get('retry-after'))
+        return RateLimitError(message, status, retry_after)
+    if status in (401, 403):
+        return AuthenticationError(message, status)
+    if status == 408:
+        return ApiTimeoutError(message, status)
+    if status >= 500:
+        return ServerError(message, status)
+    return ApiError(message, status)
+
+
+# --- Exchange Recording ---
+def request_fingerprint(model_name: str, messages: List[Dict[str, str]]) -> str:
+    """Stable key of a chat request, used to match recorded exchanges on replay."""
+    payload: str = json.dumps([model_name, messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class ExchangeRecorder:
+    """
+    Appends every API exchange (request fingerprint, status, content or streamed
+    chunks, rate-limit headers, latencies) to a JSONL file. mock_server.py can
+    replay such a file to benchmark the pipeline offline.
+    """
+
+    RECORDED_HEADERS: Tuple[str, ...] = (
+        'retry-after',
+        'x-ratelimit-limit-requests', 'x-ratelimit-limit-tokens',
+        'x-ratelimit-remaining-requests', 'x-ratelimit-remaining-tokens',
+        'x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens',
+    )
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self._lock = threading.Lock()
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        line: str = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+_recorder: Optional[ExchangeRecorder] = None
+_recorder_resolved: bool = False
+
+
+def set_recorder(path: Optional[str]) -> None:
+    """Starts recording exchanges to a JSONL file (None stops). Defaults to $DMC_RECORD_PATH."""
+    global _recorder, _recorder_resolved
+    _recorder = ExchangeRecorder(path) if path else None
+    _recorder_resolved = True
+
+
+def get_recorder() -> Optional[ExchangeRecorder]:
+    if not _recorder_resolved:
+        set_recorder(os.getenv("DMC_RECORD_PATH"))
+    return _recorder
+
+
+# --- Requests ---
+DEFAULT_API_BASE: str = "https://api.openai.com/v1"
+
+
+def get_api_base() -> str:
+    """The API root: $OPENAI_API_BASE (or $OPENAI_BASE_URL) if set, e.g. to target mock_server.py."""
+    return (os.getenv("OPENAI_API_BASE") or os.getenv("OPENAI_BASE_URL") or DEFAULT_API_BASE).rstrip("/")
+
+
+API_MAX_RETRIES: int = 4
+BACKOFF_BASE_SECONDS: float = 1.0
+BACKOFF_MAX_SECONDS: float = 30.0
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given retry number (0-based)."""
+    return random.uniform(0.0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def chat_completion(
+    messages: List[Dict[str, str]],
+    model_name: Optional[str] = None,
+    stream: bool = False,
+    on_chunk: Optional[Callable[[str], None]] = None,
+    max_retries: int = API_MAX_RETRIES,
+    cancel_event: Optional[threading.Event] = None,
+    api_base: Optional[str] = None,
+) -> str:
     """
-    Executes a standard chat completion request using the OpenAI API.
+    Executes a chat completion request using the OpenAI API.
+
+    Transient failures (rate limits, timeouts, 5xx, dropped connections) are retried
+    up to max_retries times with jittered exponential backoff; a 429's retry-after is
+    enforced by the rate limiter on the next attempt. A streamed request is not
+    retried once content has been forwarded to on_chunk.
 
     Args:
         messages (List[Dict[str, str]]): A list of message dictionaries (roles and content).
         model_name (Optional[str]): The specific model ID to use. Defaults to "gpt-4o".
+        stream (bool): If True, requests server-sent events and passes each content delta
+            to on_chunk as it arrives.
+        on_chunk (Optional[Callable[[str], None]]): Receives streamed content deltas.
+        max_retries (int): Retries allowed for transient errors.
+        cancel_event (Optional[threading.Event]): When set, pending waits end and the
+            request raises RequestCancelled. A CancelToken also aborts the open
+            connection, so a blocked read ends immediately.
+        api_base (Optional[str]): API root URL. Defaults to get_api_base().
 
     Returns:
-        str: The content of the model's response or an error message.
+        str: The content of the model's response (the concatenated deltas when streaming).
+
+    Raises:
+        ApiError: The matching subclass once the error is permanent or retries run out.
     """
-    api_base: str = "https://api.openai.com/v1"
+    api_base = (api_base or get_api_base()).rstrip("/")
     
     # Securely retrieve API key from environment variables
     api_key: Optional[str] = os.getenv("OPENAI_API_KEY")
     
     if not api_key:
-        return "API Error: The environment variable 'OPENAI_API_KEY' is not defined."
+        raise AuthenticationError("The environment variable 'OPENAI_API_KEY' is not defined.")
 
     default_model: str = "gpt-4o"
     target_model: str = model_name if model_name else default_model
@@ -79,83 +789,281 @@ def gpt4_1_request(messages: List[Dict[str, str]], model_name: Optional[str] = N
         "messages": messages,
         "response_format": {"type": "text"}
     }
-    
+    if stream:
+        data["stream"] = True
+
+    estimated_tokens: int = estimate_request_tokens(messages)
+    streamed: List[bool] = [False]
+
+    def forward(delta: str) -> None:
+        streamed[0] = True
+        if on_chunk is not None:
+            on_chunk(delta)
+
+    attempt: int = 0
+    while True:
+        try:
+            return _send_chat_request(url, headers, data, target_model, estimated_tokens, stream, forward, cancel_event)
+        except ApiError as error:
+            if not error.retryable or attempt >= max_retries or streamed[0]:
+                raise
+        delay: float = backoff_delay(attempt)
+        if cancel_event is not None:
+            if cancel_event.wait(delay):
+                raise RequestCancelled()
+        else:
+            time.sleep(delay)
+        attempt += 1
+
+
+def _send_chat_request(
+    url: str,
+    headers: Dict[str, str],
+    data: Dict[str, Any],
+    model: str,
+    estimated_tokens: int,
+    stream: bool,
+    on_chunk: Callable[[str], None],
+    cancel_event: Optional[threading.Event] = None,
+) -> str:
+    """One attempt of chat_completion: paces, sends, and converts failures to ApiError."""
+    rate_limiter.wait(model, estimated_tokens, cancel_event)
+    if cancel_event is not None and cancel_event.is_set():
+        rate_limiter.release(model, estimated_tokens)
+        raise RequestCancelled()
+
+    recorder: Optional[ExchangeRecorder] = get_recorder()
+    if recorder is not None:
+        recorded_chunks: List[str] = []
+        forward_chunk = on_chunk
+
+        def on_chunk(delta: str) -> None:
+            recorded_chunks.append(delta)
+            forward_chunk(delta)
+
+        def record(status: int, response_headers: Any, body: Dict[str, Any]) -> None:
+            entry: Dict[str, Any] = {
+                'key': request_fingerprint(model, data['messages']),
+                'model': model,
+                'stream': stream,
+                'status': status,
+                'headers': {h: response_headers[h] for h in ExchangeRecorder.RECORDED_HEADERS if h in response_headers},
+                'ttfb_s': round(headers_at - started, 4),
+                'latency_s': round(time.perf_counter() - started, 4),
+            }
+            entry.update(body)
+            recorder.record(entry)
+
+    connections: List[Any] = []
+
+    def abort() -> None:
+        for conn in connections:
+            _abort_connection(conn)
+
+    _connection_local.sink = connections.append
+    if isinstance(cancel_event, CancelToken):
+        cancel_event.add_callback(abort)
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=120)
-        
+        started = time.perf_counter()
+        try:
+            response = get_http_session().post(url, headers=headers, json=data, timeout=120, stream=stream)
+        except requests.RequestException as e:
+            rate_limiter.release(model, estimated_tokens)
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled() from e
+            if isinstance(e, requests.Timeout):
+                raise ApiTimeoutError(str(e)) from e
+            raise ServerError(f"Connection failed: {e}") from e
+        headers_at: float = time.perf_counter()
+        _record_http_call(headers_at - started)
+        rate_limiter.observe(model, response.status_code, response.headers, estimated_tokens)
+
         if response.status_code != 200:
-            return f"API Error ({response.status_code}): {response.text}"
-            
-        response_json = response.json()
-        return response_json['choices'][0]['message']['content']
-        
+            if recorder is not None:
+                record(response.status_code, response.headers, {'error': response.text})
+            raise _error_from_response(response)
+
+        try:
+            if stream:
+                content: str = _read_event_stream(response, on_chunk, cancel_event)
+            else:
+                content = response.json()['choices'][0]['message']['content']
+            if recorder is not None:
+                record(200, response.headers, {'content': content, 'chunks': recorded_chunks} if stream else {'content': content})
+            return content
+        except ApiError:
+            raise
+        except Exception as e:
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled() from e
+            if isinstance(e, requests.Timeout):
+                raise ApiTimeoutError(str(e)) from e
+            if isinstance(e, requests.RequestException):
+                raise ServerError(f"Connection lost while reading the response: {e}") from e
+            raise ApiError(f"Malformed response: {e}", response.status_code) from e
+    finally:
+        # The connection goes back to the pool: a late cancel must not touch it
+        _connection_local.sink = None
+        if isinstance(cancel_event, CancelToken):
+            cancel_event.remove_callback(abort)
+
+
+def gpt4_1_request(messages: List[Dict[str, str]], model_name: Optional[str] = None, stream: bool = False, on_chunk: Optional[Callable[[str], None]] = None, api_base: Optional[str] = None) -> str:
+    """
+    String-returning wrapper around chat_completion: returns the response content,
+    or the error rendered as "API Error (...): ..." / "Request error: ...".
+    """
+    try:
+        return chat_completion(messages, model_name, stream=stream, on_chunk=on_chunk, api_base=api_base)
+    except ApiError as e:
+        return str(e)
     except Exception as e:
         return f"Request error: {e}\n{traceback.format_exc()}"
 
 
-class GptWorker(QtCore.QThread):
+def _read_event_stream(response: requests.Response, on_chunk: Optional[Callable[[str], None]], cancel_event: Optional[threading.Event] = None) -> str:
     """
-    Asynchronous worker thread for handling LLM API requests.
-    Prevents the main GUI thread from freezing during network I/O.
+    Parses a chat completion server-sent event stream, forwarding content deltas as
+    they arrive. Setting cancel_event closes the stream at the next event.
+
+    The body is read to its end, so that urllib3 hands the connection back to the
+    pool; the response is only closed when reading stops early (cancel or error).
     """
-    finished = QtCore.pyqtSignal(str)
-    
-    def __init__(self, messages: List[Dict[str, str]], model_name: Optional[str] = None) -> None:
-        super().__init__()
-        self.messages: List[Dict[str, str]] = messages
-        self.model_name: Optional[str] = model_name
+    # SSE is UTF-8 by definition; without this requests would yield raw bytes
+    response.encoding = "utf-8"
+    parts: List[str] = []
+    try:
+        lines = response.iter_lines(chunk_size=None, decode_unicode=True)
+        for line in lines:
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+            if not line or not line.startswith("data:"):
+                continue
+            payload: str = line[5:].strip()
+            if payload == "[DONE]":
+                # Only the end of the chunked body may follow
+                for _ in lines:
+                    pass
+                break
+            event = json.loads(payload)
+            if event.get("error"):
+                error = event["error"]
+                raise ServerError(error.get("message", "Stream error") if isinstance(error, dict) else str(error))
+            choices = event.get("choices") or []
+            delta: Optional[str] = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                parts.append(delta)
+                if on_chunk is not None:
+                    on_chunk(delta)
+    except BaseException:
+        response.close()
+        raise
+    return "".join(parts)
 
-    def run(self) -> None:
-        result: str = gpt4_1_request(self.messages, self.model_name)
-        self.finished.emit(result)
 
+# --- Request Engine ---
+class RequestHandle:
+    """A request submitted to the RequestEngine: its result future plus cancellation."""
 
-# -----------------------------------------------------------------------------
-# Code Execution Logic
-# -----------------------------------------------------------------------------
-class CodeExecutionWorker(QtCore.QThread):
+    def __init__(self) -> None:
+        self.cancel_event: CancelToken = CancelToken()
+        self.future: Optional["Future[str]"] = None
+
+    def cancel(self) -> None:
+        """Abandons the request: a queued one never starts, a running one has its connection closed."""
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+
+class RequestEngine:
     """
-    Worker thread that executes Python code in a separate subprocess.
-    Captures standard output and standard error safely.
+    Runs every API call (Brain, Worker, sandbox) on one shared pool of
+    max_concurrency threads using the pooled synchronous client, so retries, rate
+    limiting and streaming behave exactly as in chat_completion.
+
+    The pool size bounds how many requests are on the wire at once; the rest wait in
+    its queue without holding a thread. Cancelling a queued request drops it;
+    cancelling a running one sets its CancelToken, which shuts the connection's
+    socket down so the blocked read returns at once.
     """
-    finished = QtCore.pyqtSignal(str, str)
-    
-    def __init__(self, code_to_execute: str) -> None:
-        super().__init__()
-        self.code_to_execute: str = code_to_execute
 
-    def run(self) -> None:
-        stdout: str = ""
-        stderr: str = ""
-        filepath: str = ""
-        
-        try:
-            # Create a temporary file to hold the code execution context
-            with tempfile.NamedTemporaryFile(suffix=".py", delete=False, mode='w', encoding='utf-8') as f:
-                f.write(self.code_to_execute)
-                filepath = f.name
-            
-            # Execute the script via the current system python interpreter
-            process = subprocess.run(
-                [sys.executable, filepath],
-                capture_output=True, 
-                text=True, 
-                timeout=15,
-                encoding='utf-8'
-            )
-            stdout = process.stdout
-            stderr = process.stderr
-            
-        except subprocess.TimeoutExpired:
-            stderr = "Execution Error: Code execution exceeded the 15-second timeout limit."
-        except Exception as e:
-            stderr = f"Subprocess error: {e}\n{traceback.format_exc()}"
-        finally:
-            # Cleanup temporary file
-            if filepath and os.path.exists(filepath):
-                os.unlink(filepath)
-                
-        self.finished.emit(stdout, stderr)
+    MAX_CONCURRENCY: int = 4
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY) -> None:
+        self.max_concurrency: int = max_concurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._handles: Set[RequestHandle] = set()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        messages: List[Dict[str, str]],
+        model_name: Optional[str] = None,
+        stream: bool = False,
+        on_chunk: Optional[Callable[[str], None]] = None,
+    ) -> RequestHandle:
+        """Queues a chat completion; the handle's future resolves to the text or raises ApiError."""
+        handle = RequestHandle()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="dmc-api")
+            self._handles.add(handle)
+            handle.future = self._executor.submit(self._run, handle, messages, model_name, stream, on_chunk)
+        handle.future.add_done_callback(lambda _: self._forget(handle))
+        return handle
+
+    def _run(
+        self,
+        handle: RequestHandle,
+        messages: List[Dict[str, str]],
+        model_name: Optional[str],
+        stream: bool,
+        on_chunk: Optional[Callable[[str], None]],
+    ) -> str:
+        if handle.cancelled:
+            raise RequestCancelled()
+        return chat_completion(
+            messages, model_name, stream=stream, on_chunk=on_chunk, cancel_event=handle.cancel_event
+        )
+
+    def _forget(self, handle: RequestHandle) -> None:
+        with self._lock:
+            self._handles.discard(handle)
+
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._handles)
+
+    def cancel_all(self) -> None:
+        with self._lock:
+            handles = list(self._handles)
+        for handle in handles:
+            handle.cancel()
+
+    def shutdown(self) -> None:
+        """Cancels outstanding requests and releases the threads."""
+        self.cancel_all()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_request_engine: Optional[RequestEngine] = None
+
+
+def get_request_engine() -> RequestEngine:
+    """Returns the process-wide RequestEngine."""
+    global _request_engine
+    with _http_lock:
+        if _request_engine is None:
+            _request_engine = RequestEngine()
+    return _request_engine
 
 
 # -----------------------------------------------------------------------------
@@ -170,12 +1078,1398 @@ def human_readable_size(num: float) -> str:
     return f"{num:.1f} PB"
 
 
-class ProjectContextExtractor(QtCore.QObject):
+def _file_extension(name: str) -> str:
+    """Extension of a file name with its dot, as os.path.splitext (faster on large trees)."""
+    dot: int = name.rfind(".")
+    return name[dot:] if dot > 0 and name[:dot].strip(".") else ""
+
+
+def default_cache_dir() -> str:
+    """Returns the per-user directory where DMC keeps its persistent caches."""
+    override: Optional[str] = os.getenv("DMC_CACHE_DIR")
+    if override:
+        return override
+    if sys.platform == "win32":
+        base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "dmc")
+
+
+class ProjectIndex:
+    """
+    Persistent SQLite index of extracted file contents for a single project root.
+
+    Rows are keyed by relative path, hold un-indented content and remember the
+    (size, mtime) pair observed at extraction time, so that unchanged files are
+    served from disk instead of being re-read and re-parsed on every scan.
+    Parsed Python symbols (see SymbolIndex) are kept the same way.
+    """
+
+    SCHEMA_VERSION: int = 4
+
+    def __init__(self, root_path: str, cache_dir: Optional[str] = None) -> None:
+        self.root_path: str = os.path.abspath(root_path)
+        cache_dir = cache_dir or default_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        root_key: str = hashlib.sha1(os.path.normcase(self.root_path).encode("utf-8")).hexdigest()[:16]
+        self.db_path: str = os.path.join(cache_dir, f"index_{root_key}.sqlite3")
+
+        # A single connection shared behind a lock keeps writes serialized
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        """
+        Creates the tables, discarding rows written by an older schema version or
+        whose token statistics came from a different token counter.
+        """
+        version: int = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS files")
+            self._conn.execute("DROP TABLE IF EXISTS symbols")
+            self._conn.execute("DROP TABLE IF EXISTS meta")
+            self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        counter_name: str = get_token_counter_name()
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'token_counter'").fetchone()
+        if row is None or row[0] != counter_name:
+            self._conn.execute("DROP TABLE IF EXISTS files")
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('token_counter', ?)", (counter_name,))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "rel_path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "content TEXT NOT NULL, stats TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS symbols ("
+            "rel_path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def lookup(self, rel_path: str, size: int, mtime_ns: int) -> Optional[Tuple[str, Dict[str, int]]]:
+        """Returns the cached (content, stats) if the file has not changed since it was stored."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, content, stats FROM files WHERE rel_path = ?", (rel_path,)
+            ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+        return row[2], json.loads(row[3])
+
+    def store(self, rel_path: str, size: int, mtime_ns: int, content: str, stats: Dict[str, int]) -> None:
+        """Records freshly extracted (un-indented) content. Call flush() to persist the batch."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (rel_path, size, mtime_ns, content, stats) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (rel_path, size, mtime_ns, content, json.dumps(stats))
+            )
+
+    def lookup_symbols(self, rel_path: str, size: int, mtime_ns: int) -> Optional[Any]:
+        """Returns the stored symbols of a file if it has not changed since they were parsed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, data FROM symbols WHERE rel_path = ?", (rel_path,)
+            ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+        return json.loads(row[2])
+
+    def store_symbols(self, rel_path: str, size: int, mtime_ns: int, symbols: Any) -> None:
+        """Records the parsed symbols of a file. Call flush() to persist the batch."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO symbols (rel_path, size, mtime_ns, data) VALUES (?, ?, ?, ?)",
+                (rel_path, size, mtime_ns, json.dumps(symbols))
+            )
+
+    def flush(self) -> None:
+        """Commits pending writes to disk."""
+        with self._lock:
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+class ExtractionCache:
+    """
+    Thread-safe in-memory LRU cache of extracted file contents.
+
+    Entries are keyed by (path, size, mtime) and hold un-indented content, so every
+    build shares them whatever depth it renders a file at, and a modified file simply
+    misses. The cache is bounded by an approximate byte budget; the least recently
+    used entries are evicted first.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_bytes: int = max_bytes
+        self.current_bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: "OrderedDict[Tuple[str, int, int], Tuple[str, Dict[str, int], int]]" = OrderedDict()
+        self._keys_by_path: Dict[str, Set[Tuple[str, int, int]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, int, int]) -> Optional[Tuple[str, Dict[str, int]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key: Tuple[str, int, int], content: str, stats: Dict[str, int]) -> None:
+        # Rough footprint: characters plus a fixed per-entry overhead
+        nbytes: int = len(content) + 256
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (content, stats, nbytes)
+            self._keys_by_path.setdefault(key[0], set()).add(key)
+            self.current_bytes += nbytes
+            self._evict()
+
+    def discard_directory(self, dir_path: str) -> None:
+        """Evicts every entry for files directly inside dir_path."""
+        with self._lock:
+            for path in [p for p in self._keys_by_path if os.path.dirname(p) == dir_path]:
+                for key in list(self._keys_by_path.get(path, ())):
+                    self._remove(key)
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key: Tuple[str, int, int]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.current_bytes -= entry[2]
+        keys = self._keys_by_path.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_path[key[0]]
+
+    def _evict(self) -> None:
+        while self.current_bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def describe(self) -> str:
+        """One-line summary for status displays."""
+        return (
+            f"Cache: {self.hits} hits / {self.misses} misses, {len(self._entries)} files, "
+            f"{human_readable_size(self.current_bytes)} of {human_readable_size(self.max_bytes)}"
+        )
+
+
+_PROMPT_NOISE_RE = re.compile(r"[^\w\s./-]+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonical form of a question for cache lookups: case, punctuation and spacing are ignored."""
+    text: str = unicodedata.normalize("NFKC", prompt).casefold()
+    return " ".join(_PROMPT_NOISE_RE.sub(" ", text).split())
+
+
+class BrainSelectionCache:
+    """
+    Persistent SQLite cache of the Brain's file selections.
+
+    Entries are keyed by (structure hash, normalized prompt, aggressive flag, model),
+    so the same question against an unchanged tree is answered without an API call.
+    Entries expire after ttl_seconds; beyond max_entries the least recently used
+    ones are evicted.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 2000) -> None:
+        cache_dir = cache_dir or default_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path: str = os.path.join(cache_dir, "brain_selections.sqlite3")
+        self.ttl_seconds: float = ttl_seconds
+        self.max_entries: int = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS selections ("
+            "key TEXT PRIMARY KEY, files TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS selections_last_used ON selections (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(structure: str, prompt: str, aggressive: bool, model_name: str = "") -> str:
+        structure_hash: str = hashlib.sha1(structure.encode("utf-8", "surrogatepass")).hexdigest()
+        raw: str = "\x00".join((structure_hash, normalize_prompt(prompt), "1" if aggressive else "0", model_name))
+        return hashlib.sha1(raw.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Returns the cached selection, or None if absent or expired."""
+        now: float = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT files, created FROM selections WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM selections WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE selections SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, files: List[str]) -> None:
+        """Stores a selection, then drops expired and least recently used entries."""
+        now: float = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO selections (key, files, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(files), now, now)
+            )
+            self._conn.execute("DELETE FROM selections WHERE created < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM selections WHERE key IN ("
+                "SELECT key FROM selections ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM selections")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translates a gitignore glob into a regex over '/'-separated paths."""
+    out: List[str] = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+class _IgnoreRuleSet:
+    """
+    The compiled rules of one ignore source (a .gitignore file or the user's exclusions).
+
+    Without negations, literal names and paths go into hash sets and all glob rules are
+    merged into one alternation regex per kind, so a check is a few set lookups plus at
+    most four regex matches. With negations, rules are evaluated last-match-wins.
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        # (regex, negate, dir_only, anchored, literal)
+        rules: List[Tuple[str, bool, bool, bool, bool]] = []
+        for raw in patterns:
+            line: str = raw.rstrip('\n').rstrip('\r')
+            if not line.endswith('\\ '):
+                line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate: bool = line.startswith('!')
+            if negate:
+                line = line[1:]
+            elif line.startswith('\\!') or line.startswith('\\#'):
+                line = line[1:]
+            dir_only: bool = line.endswith('/')
+            line = line.rstrip('/')
+            anchored: bool = '/' in line
+            line = line.lstrip('/')
+            if not line:
+                continue
+            literal: bool = not any(ch in line for ch in '*?[\\')
+            rules.append((line if literal else _glob_to_regex(line), negate, dir_only, anchored, literal))
+
+        self.is_empty: bool = not rules
+        self.has_negation: bool = any(rule[1] for rule in rules)
+        if self.has_negation:
+            self._ordered = [
+                (re.compile(re.escape(rx) if literal else rx), negate, dir_only, anchored)
+                for rx, negate, dir_only, anchored, literal in rules
+            ]
+            return
+
+        # Fast path, keyed by (anchored, dir_only)
+        self._literals: Dict[Tuple[bool, bool], Set[str]] = {}
+        globs: Dict[Tuple[bool, bool], List[str]] = {}
+        for rx, _, dir_only, anchored, literal in rules:
+            if literal:
+                self._literals.setdefault((anchored, dir_only), set()).add(rx)
+            else:
+                globs.setdefault((anchored, dir_only), []).append(rx)
+        self._globs: Dict[Tuple[bool, bool], "re.Pattern[str]"] = {
+            key: re.compile('|'.join(f'(?:{rx})' for rx in regexes)) for key, regexes in globs.items()
+        }
+
+    def match(self, rel_path: str, name: str, is_dir: bool) -> Optional[bool]:
+        """
+        Returns True (ignored), False (re-included by a negation) or None (no rule applies).
+        rel_path is relative to the directory holding the rules, with '/' separators.
+        """
+        if self.has_negation:
+            for regex, negate, dir_only, anchored in reversed(self._ordered):
+                if dir_only and not is_dir:
+                    continue
+                if regex.fullmatch(rel_path if anchored else name):
+                    return not negate
+            return None
+
+        for dir_only in ((False, True) if is_dir else (False,)):
+            for anchored, target in ((False, name), (True, rel_path)):
+                literals = self._literals.get((anchored, dir_only))
+                if literals and target in literals:
+                    return True
+                regex = self._globs.get((anchored, dir_only))
+                if regex is not None and regex.fullmatch(target):
+                    return True
+        return None
+
+
+class IgnoreMatcher:
+    """
+    Decides which paths of a project root are excluded.
+
+    Combines the user's exclusions (names or gitignore-style globs, always authoritative)
+    with the .gitignore/.ignore files found at every level, where deeper files take
+    precedence over shallower ones. Rules are compiled once per directory and checked
+    during the scan, so excluded directories are pruned before descent.
+    """
+
+    IGNORE_FILES: Tuple[str, ...] = ('.gitignore', '.ignore')
+
+    def __init__(self, user_patterns: List[str], use_ignore_files: bool = True) -> None:
+        self.use_ignore_files: bool = use_ignore_files
+        self.user_rules: _IgnoreRuleSet = _IgnoreRuleSet(list(user_patterns))
+        # rel_dir ('/'-separated, '' for the root) -> (raw ignore text, compiled rules or None)
+        self._levels: Dict[str, Tuple[str, Optional[_IgnoreRuleSet]]] = {}
+
+    def load_directory(self, dir_path: str, rel_dir: str, names: Set[str]) -> bool:
+        """
+        Reads the ignore files present in a directory. Returns True if its rules changed
+        since the last load (the caller must then rescan the whole subtree).
+        """
+        if not self.use_ignore_files:
+            return False
+        texts: List[str] = []
+        for ignore_name in self.IGNORE_FILES:
+            if ignore_name in names:
+                try:
+                    with open(os.path.join(dir_path, ignore_name), 'r', encoding='utf-8', errors='ignore') as f:
+                        texts.append(f.read())
+                except OSError:
+                    pass
+        raw: str = "\n".join(texts)
+        previous = self._levels.get(rel_dir)
+        if previous is not None and previous[0] == raw:
+            return False
+        rules = _IgnoreRuleSet(raw.splitlines()) if raw else None
+        self._levels[rel_dir] = (raw, rules if rules is not None and not rules.is_empty else None)
+        return previous is not None
+
+    def forget(self, rel_dir: str) -> None:
+        """Drops the cached rules of a directory and everything below it."""
+        prefix: str = rel_dir + '/'
+        for key in [k for k in self._levels if k == rel_dir or k.startswith(prefix)]:
+            del self._levels[key]
+
+    def rules_for(self, rel_dir: str) -> List[Tuple[str, _IgnoreRuleSet]]:
+        """The (base directory, rules) pairs in scope for entries of rel_dir, deepest first."""
+        chain: List[Tuple[str, _IgnoreRuleSet]] = []
+        current: Optional[str] = rel_dir
+        while current is not None:
+            level = self._levels.get(current)
+            if level is not None and level[1] is not None:
+                chain.append((current, level[1]))
+            current = None if current == '' else current.rpartition('/')[0]
+        return chain
+
+    def is_excluded(self, chain: List[Tuple[str, _IgnoreRuleSet]], rel_path: str, name: str, is_dir: bool) -> bool:
+        """Checks one entry of a directory against the user rules and that directory's rule chain."""
+        if self.user_rules.match(rel_path, name, is_dir):
+            return True
+        for base, rules in chain:
+            verdict = rules.match(rel_path[len(base) + 1:] if base else rel_path, name, is_dir)
+            if verdict is not None:
+                return verdict
+        return False
+
+
+# Identifier pieces: "HTTPServerError2" -> HTTP, Server, Error, 2
+_IDENTIFIER_PART_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z]|\d|\b|_)|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+
+# Words too common in questions to say anything about which file is meant
+QUERY_STOPWORDS: Set[str] = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "code", "do", "does", "file", "files",
+    "for", "from", "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "please", "project",
+    "should", "that", "the", "this", "to", "use", "used", "what", "when", "where", "which", "why",
+    "with", "work", "works", "you",
+}
+
+
+def split_identifier_terms(text: str) -> List[str]:
+    """
+    Splits text into lowercase search terms, breaking snake_case, camelCase and
+    PascalCase identifiers into their parts (e.g. "getHTTPResponse" -> get, http, response).
+    """
+    terms: List[str] = []
+    for word in _WORD_RE.findall(text):
+        terms.extend(_identifier_parts(word))
+    return terms
+
+
+@functools.lru_cache(maxsize=65536)
+def _identifier_parts(word: str) -> Tuple[str, ...]:
+    return tuple(piece.lower() for part in word.split("_") for piece in _IDENTIFIER_PART_RE.findall(part))
+
+
+@functools.lru_cache(maxsize=65536)
+def _index_terms(word: str) -> Tuple[str, ...]:
+    """Search terms of a word: its identifier parts, plus the whole word when it has several."""
+    parts = tuple(part for part in _identifier_parts(word) if len(part) > 1)
+    whole: str = word.lower()
+    if len(whole) > 1 and parts != (whole,):
+        parts += (whole,)
+    return parts
+
+
+def selection_coverage(context_files: List[str], selected_files: List[str]) -> float:
+    """Share of selected_files present in context_files (1.0 when nothing was selected)."""
+    if not selected_files:
+        return 1.0
+    available: Set[str] = {os.path.normcase(os.path.normpath(f)) for f in context_files}
+    covered: int = sum(1 for f in selected_files if os.path.normcase(os.path.normpath(f)) in available)
+    return covered / len(selected_files)
+
+
+class SearchIndex:
+    """
+    Thread-safe BM25 inverted index over the extracted contents of a project's files.
+
+    Documents are keyed by relative path and carry a version (size, mtime_ns), so a
+    sync only re-tokenizes files that changed. Words are split into identifier parts
+    (compound words are also kept whole, so exact identifiers rank first), and words of
+    the file path are counted PATH_WEIGHT times so that names still matter.
+    """
+
+    K1: float = 1.2
+    B: float = 0.75
+    PATH_WEIGHT: int = 3
+
+    def __init__(self) -> None:
+        self._docs: Dict[str, Tuple[Tuple[int, int], Dict[str, int], int]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length: int = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._docs)
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return list(self._docs)
+
+    def version_of(self, rel_path: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            doc = self._docs.get(rel_path)
+        return doc[0] if doc is not None else None
+
+    @classmethod
+    def document_terms(cls, rel_path: str, text: str) -> Dict[str, int]:
+        """Term frequencies of a file: its content, plus its path terms weighted by PATH_WEIGHT."""
+        counts: Dict[str, int] = {}
+        # Split each distinct word once: source files repeat the same identifiers a lot
+        words: Dict[str, int] = {}
+        for word in _WORD_RE.findall(text):
+            words[word] = words.get(word, 0) + 1
+        for word in _WORD_RE.findall(rel_path):
+            words[word] = words.get(word, 0) + cls.PATH_WEIGHT
+        for word, n in words.items():
+            for term in _index_terms(word):
+                counts[term] = counts.get(term, 0) + n
+        return counts
+
+    def update(self, rel_path: str, text: str, version: Tuple[int, int]) -> None:
+        """(Re)indexes a file."""
+        counts = self.document_terms(rel_path, text)
+        with self._lock:
+            self._remove_locked(rel_path)
+            length: int = sum(counts.values())
+            self._docs[rel_path] = (version, counts, length)
+            self._total_length += length
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[rel_path] = tf
+
+    def remove(self, rel_path: str) -> None:
+        with self._lock:
+            self._remove_locked(rel_path)
+
+    def _remove_locked(self, rel_path: str) -> None:
+        doc = self._docs.pop(rel_path, None)
+        if doc is None:
+            return
+        self._total_length -= doc[2]
+        for term in doc[1]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(rel_path, None)
+                if not posting:
+                    del self._postings[term]
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """Ranks files against a question with BM25. Returns (rel_path, score), best first."""
+        terms: Set[str] = {t for word in _WORD_RE.findall(query) for t in _index_terms(word) if t not in QUERY_STOPWORDS}
+        with self._lock:
+            n_docs: int = len(self._docs)
+            if not terms or not n_docs:
+                return []
+            avg_length: float = self._total_length / n_docs or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf: float = math.log(1.0 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for rel_path, tf in posting.items():
+                    norm: float = self.K1 * (1.0 - self.B + self.B * self._docs[rel_path][2] / avg_length)
+                    scores[rel_path] = scores.get(rel_path, 0.0) + idf * tf * (self.K1 + 1.0) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+
+# --- Semantic Chunk Search ---
+# Longest chunk embedded as one vector; longer spans are cut into windows of this size
+CHUNK_MAX_LINES: int = 80
+# Top-level definitions in non-Python sources, used as chunk boundaries
+_TOP_LEVEL_DEF_RE = re.compile(
+    r"^(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:def|class|function|func|fn|struct|interface|impl|module|"
+    r"public|private|protected|static|const|let|var|type|enum|trait|sub)\b"
+)
+
+
+def _fill_chunk_gaps(spans: List[Tuple[int, int, str]], start: int, end: int, name: str, lines: List[str]) -> List[Tuple[int, int, str]]:
+    """Adds the non-blank stretches of lines start..end not covered by spans, labeled name."""
+    filled: List[Tuple[int, int, str]] = []
+    cursor: int = start
+    for span in sorted(spans) + [(end + 1, end, "")]:
+        if span[0] > cursor and any(line.strip() for line in lines[cursor - 1:span[0] - 1]):
+            filled.append((cursor, span[0] - 1, name))
+        if span[2]:
+            filled.append(span)
+        cursor = max(cursor, span[1] + 1)
+    return filled
+
+
+def chunk_source(rel_path: str, text: str) -> List[Tuple[int, int, str]]:
+    """
+    Splits a file into (start_line, end_line, name) chunks, lines being 1-based and
+    inclusive. Python files are cut per top-level function and class (the methods of
+    large classes on their own), other files at top-level definitions; code in between
+    becomes "<module>" chunks, and anything longer than CHUNK_MAX_LINES is windowed.
+    """
+    lines: List[str] = text.split("\n")
+    if not text.strip():
+        return []
+    spans: List[Tuple[int, int, str]] = []
+
+    tree: Optional[ast.AST] = None
+    if rel_path.lower().endswith((".py", ".pyw")):
+        try:
+            tree = ast.parse(text)
+        except (SyntaxError, ValueError):
+            tree = None
+    if tree is not None:
+        for node in tree.body:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                continue
+            start: int = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            end: int = node.end_lineno or node.lineno
+            if isinstance(node, ast.ClassDef) and end - start + 1 > CHUNK_MAX_LINES:
+                methods: List[Tuple[int, int, str]] = [
+                    (min([m.lineno] + [d.lineno for d in m.decorator_list]), m.end_lineno or m.lineno, f"{node.name}.{m.name}")
+                    for m in node.body if isinstance(m, (ast.FunctionDef, ast.AsyncFunctionDef))
+                ]
+                spans.extend(_fill_chunk_gaps(methods, start, end, node.name, lines))
+            else:
+                spans.append((start, end, node.name))
+    else:
+        starts: List[Tuple[int, str]] = [
+            (i + 1, line.strip()[:60]) for i, line in enumerate(lines) if _TOP_LEVEL_DEF_RE.match(line)
+        ]
+        for (start, name), following in zip(starts, starts[1:] + [(len(lines) + 1, "")]):
+            spans.append((start, following[0] - 1, name))
+
+    chunks: List[Tuple[int, int, str]] = []
+    for start, end, name in _fill_chunk_gaps(spans, 1, len(lines), "<module>", lines):
+        for window_start in range(start, end + 1, CHUNK_MAX_LINES):
+            chunks.append((window_start, min(end, window_start + CHUNK_MAX_LINES - 1), name))
+    return chunks
+
+
+@functools.lru_cache(maxsize=131072)
+def _hashed_features(word: str, dim: int) -> Tuple[Tuple[int, float], ...]:
+    """(bucket, sign) pairs of a word's search terms and of their 5-letter prefixes."""
+    terms: Tuple[str, ...] = _index_terms(word)
+    features: List[str] = list(terms) + ["~" + term[:5] for term in terms if len(term) > 5]
+    pairs: List[Tuple[int, float]] = []
+    for feature in features:
+        h: int = zlib.crc32(feature.encode("utf-8"))
+        pairs.append((h % dim, 1.0 if h & 0x80000000 else -1.0))
+    return tuple(pairs)
+
+
+class HashingEmbedder:
+    """
+    Dependency-free embedding (numpy only): search terms and their 5-letter prefixes
+    are hashed with a sign into `dim` buckets, log-weighted and L2-normalized. It
+    matches shared vocabulary and word variants (authenticate / authentication),
+    not synonyms; set DMC_EMBEDDING_MODEL for a real model.
+    """
+
+    def __init__(self, dim: int = 512) -> None:
+        self.dim: int = dim
+        self.name: str = f"hash-{dim}-v1"
+
+    def _vector(self, text: str, skip: Set[str]) -> "np.ndarray":
+        words: Dict[str, int] = {}
+        for word in _WORD_RE.findall(text):
+            words[word] = words.get(word, 0) + 1
+        buckets: Dict[int, float] = {}
+        for word, n in words.items():
+            if word.lower() in skip:
+                continue
+            weight: float = 1.0 + math.log(n)
+            for bucket, sign in _hashed_features(word, self.dim):
+                buckets[bucket] = buckets.get(bucket, 0.0) + sign * weight
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if buckets:
+            vector[list(buckets)] = list(buckets.values())
+            norm = float(np.linalg.norm(vector))
+            if norm:
+                vector /= norm
+        return vector
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            matrix[row] = self._vector(text, set())
+        return matrix
+
+    def embed_query(self, text: str) -> "np.ndarray":
+        return self._vector(text, QUERY_STOPWORDS)
+
+
+class SentenceTransformerEmbedder:
+    """A sentence-transformers model run on the CPU (requires the package and its weights)."""
+
+    def __init__(self, model_name: str) -> None:
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim: int = int(self.model.get_sentence_embedding_dimension())
+        self.name: str = f"st-{model_name}"
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        vectors = self.model.encode(list(texts), batch_size=32, normalize_embeddings=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+
+    def embed_query(self, text: str) -> "np.ndarray":
+        return self.embed([text])[0]
+
+
+_embedder: Optional[Union[HashingEmbedder, SentenceTransformerEmbedder]] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Optional[Union[HashingEmbedder, SentenceTransformerEmbedder]]:
+    """
+    Returns the shared embedder, or None without numpy. DMC_EMBEDDING_MODEL names a
+    sentence-transformers model to use (e.g. all-MiniLM-L6-v2); otherwise, or if it
+    cannot be loaded, features are hashed.
+    """
+    global _embedder
+    if not NUMPY_AVAILABLE:
+        return None
+    with _embedder_lock:
+        if _embedder is None:
+            model_name: Optional[str] = os.getenv("DMC_EMBEDDING_MODEL")
+            if model_name:
+                try:
+                    _embedder = SentenceTransformerEmbedder(model_name)
+                except Exception:
+                    _embedder = None
+            if _embedder is None:
+                _embedder = HashingEmbedder()
+        return _embedder
+
+
+class EmbeddingIndex:
+    """
+    Chunk vectors of one project root, kept in a memory-mapped float32 matrix in the
+    cache directory, with a SQLite sidecar describing each row.
+
+    Files are re-chunked and re-embedded only when their (size, mtime) changes; their
+    old rows are marked dead and reclaimed by compaction. The sidecar is written
+    row by row as files change and committed by save() once the matrix is flushed,
+    so it never describes vectors that are not on disk. Search is brute force (one
+    matrix-vector product) up to IVF_MIN_ROWS live rows, then an IVF index: k-means
+    lists of which the IVF_PROBES closest to the query are scanned.
+    """
+
+    SCHEMA_VERSION: int = 2
+    IVF_MIN_ROWS: int = 200000
+    IVF_PROBES: int = 16
+    EMBED_BATCH: int = 256
+
+    def __init__(self, root_path: str, embedder: Union[HashingEmbedder, SentenceTransformerEmbedder], cache_dir: Optional[str] = None) -> None:
+        self.root_path: str = os.path.abspath(root_path)
+        self.embedder = embedder
+        cache_dir = cache_dir or default_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        root_key: str = hashlib.sha1(os.path.normcase(self.root_path).encode("utf-8")).hexdigest()[:16]
+        self.matrix_path: str = os.path.join(cache_dir, f"vectors_{root_key}.f32")
+        self.db_path: str = os.path.join(cache_dir, f"vectors_{root_key}.sqlite3")
+        try:
+            # Sidecar of schema 1, rewritten whole on every save
+            os.remove(os.path.join(cache_dir, f"vectors_{root_key}.json"))
+        except OSError:
+            pass
+
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error as e:
+            raise OSError(f"Cannot open {self.db_path}: {e}") from e
+        self._files: Dict[str, Tuple[Tuple[int, int], List[int]]] = {}
+        self._chunks: List[Optional[Tuple[str, int, int, str]]] = []  # None marks a dead row
+        self._dead: Set[int] = set()
+        self._matrix: Optional["np.memmap"] = None
+        self._capacity: int = 0
+        self._dirty: bool = False
+        # (centroids, row lists, rows added since training)
+        self._ivf: Optional[Tuple["np.ndarray", List["np.ndarray"], List[int]]] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._chunks) - len(self._dead)
+
+    def _load(self) -> None:
+        """Opens the stored matrix if the sidecar matches this schema and embedder; otherwise starts empty."""
+        version: int = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        meta: Dict[str, str] = {}
+        if version == self.SCHEMA_VERSION:
+            meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        if (meta.get("embedder"), meta.get("dim")) != (self.embedder.name, str(self.embedder.dim)):
+            for table in ("meta", "chunks", "files"):
+                self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self._create_tables()
+            return
+        try:
+            capacity: int = int(meta["capacity"])
+            matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r+", shape=(capacity, self.embedder.dim))
+        except (OSError, ValueError, KeyError):
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM files")
+            self._conn.commit()
+            return
+        self._matrix, self._capacity = matrix, capacity
+        self._chunks = [None] * int(meta["rows"])
+        rows_by_file: Dict[str, List[int]] = {}
+        for row, rel_path, start, end, name in self._conn.execute("SELECT row, rel_path, start_line, end_line, name FROM chunks ORDER BY row"):
+            self._chunks[row] = (rel_path, start, end, name)
+            rows_by_file.setdefault(rel_path, []).append(row)
+        self._dead = {row for row, chunk in enumerate(self._chunks) if chunk is None}
+        self._files = {
+            rel: ((size, mtime_ns), rows_by_file.get(rel, []))
+            for rel, size, mtime_ns in self._conn.execute("SELECT rel_path, size, mtime_ns FROM files")
+        }
+
+    def _create_tables(self) -> None:
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, rel_path TEXT NOT NULL, "
+            "start_line INTEGER NOT NULL, end_line INTEGER NOT NULL, name TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (rel_path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)"
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+            [("embedder", self.embedder.name), ("dim", str(self.embedder.dim))]
+        )
+        self._conn.commit()
+
+    def _commit_locked(self) -> None:
+        """Flushes the matrix, then commits the sidecar rows written since the last commit."""
+        self._matrix.flush()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+            [("capacity", str(self._capacity)), ("rows", str(len(self._chunks)))]
+        )
+        self._conn.commit()
+        self._dirty = False
+
+    def save(self) -> None:
+        """Flushes the matrix and commits the sidecar if anything changed."""
+        with self._lock:
+            if not self._dirty or self._matrix is None:
+                return
+            self._commit_locked()
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return list(self._files)
+
+    def version_of(self, rel_path: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            entry = self._files.get(rel_path)
+        return entry[0] if entry is not None else None
+
+    def remove(self, rel_path: str) -> None:
+        with self._lock:
+            self._drop_file(rel_path)
+            self._compact_if_needed()
+
+    def update_files(self, items: List[Tuple[str, Tuple[int, int], str]]) -> None:
+        """(Re)indexes files given as (rel_path, version, text)."""
+        for batch_start in range(0, len(items), self.EMBED_BATCH):
+            batch = items[batch_start:batch_start + self.EMBED_BATCH]
+            chunks: List[Tuple[str, int, int, str]] = []
+            texts: List[str] = []
+            for rel_path, _, text in batch:
+                lines: List[str] = text.split("\n")
+                for start, end, name in chunk_source(rel_path, text):
+                    chunks.append((rel_path, start, end, name))
+                    texts.append(f"{rel_path} {name}\n" + "\n".join(lines[start - 1:end]))
+            vectors = self.embedder.embed(texts) if texts else None
+
+            with self._lock:
+                row: int = len(self._chunks)
+                self._ensure_capacity(row + len(chunks))
+                if vectors is not None:
+                    self._matrix[row:row + len(chunks)] = vectors
+                rows_by_file: Dict[str, List[int]] = {}
+                for offset, chunk in enumerate(chunks):
+                    rows_by_file.setdefault(chunk[0], []).append(row + offset)
+                self._chunks.extend(chunks)
+                if self._ivf is not None:
+                    self._ivf[2].extend(range(row, row + len(chunks)))
+                for rel_path, version, _ in batch:
+                    self._drop_file(rel_path)
+                    self._files[rel_path] = (version, rows_by_file.get(rel_path, []))
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, rel_path, start_line, end_line, name) VALUES (?, ?, ?, ?, ?)",
+                    [(row + offset,) + chunk for offset, chunk in enumerate(chunks)]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files (rel_path, size, mtime_ns) VALUES (?, ?, ?)",
+                    [(rel_path,) + tuple(version) for rel_path, version, _ in batch]
+                )
+                self._dirty = True
+
+    def _drop_file(self, rel_path: str) -> None:
+        entry = self._files.pop(rel_path, None)
+        if entry is None:
+            return
+        for row in entry[1]:
+            self._chunks[row] = None
+            self._dead.add(row)
+        self._conn.executemany("DELETE FROM chunks WHERE row = ?", [(row,) for row in entry[1]])
+        self._conn.execute("DELETE FROM files WHERE rel_path = ?", (rel_path,))
+        self._dirty = True
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if self._matrix is not None and rows <= self._capacity:
+            return
+        self._resize(max(1024, self._capacity * 2, rows), list(range(len(self._chunks))))
+        # The new matrix file holds every row written so far
+        self._commit_locked()
+
+    def _resize(self, capacity: int, keep_rows: List[int]) -> None:
+        """Rewrites the matrix file with `capacity` rows, holding keep_rows in order."""
+        tmp_path: str = self.matrix_path + ".tmp"
+        matrix = np.memmap(tmp_path, dtype=np.float32, mode="w+", shape=(capacity, self.embedder.dim))
+        if self._matrix is not None and keep_rows:
+            matrix[:len(keep_rows)] = self._matrix[np.asarray(keep_rows)]
+        matrix.flush()
+        del matrix
+        self._matrix = None  # Release the old mapping before replacing its file
+        os.replace(tmp_path, self.matrix_path)
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r+", shape=(capacity, self.embedder.dim))
+        self._capacity = capacity
+        self._dirty = True
+
+    def _compact_if_needed(self) -> None:
+        """Reclaims dead rows once they outnumber the live ones."""
+        if len(self._dead) < 1024 or len(self._dead) < len(self) or self._matrix is None:
+            return
+        live_rows: List[int] = [row for row, chunk in enumerate(self._chunks) if chunk is not None]
+        new_row: Dict[int, int] = {row: i for i, row in enumerate(live_rows)}
+        self._resize(max(1024, 2 * len(live_rows)), live_rows)
+        self._chunks = [self._chunks[row] for row in live_rows]
+        self._files = {rel: (version, [new_row[row] for row in rows]) for rel, (version, rows) in self._files.items()}
+        self._dead = set()
+        self._ivf = None
+        # Rows were renumbered: the one full rewrite of the sidecar
+        self._conn.execute("DELETE FROM chunks")
+        self._conn.executemany(
+            "INSERT INTO chunks (row, rel_path, start_line, end_line, name) VALUES (?, ?, ?, ?, ?)",
+            [(row,) + chunk for row, chunk in enumerate(self._chunks)]
+        )
+        self._commit_locked()
+
+    def _train_ivf(self) -> None:
+        """Clusters the live rows into ~sqrt(n) lists with a few rounds of spherical k-means."""
+        live = np.asarray([row for row, chunk in enumerate(self._chunks) if chunk is not None])
+        n_lists: int = max(1, int(math.sqrt(len(live))))
+        rng = np.random.default_rng(0)
+        sample = self._matrix[np.sort(rng.choice(live, min(len(live), n_lists * 40), replace=False))]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(8):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = sample[assignment == i]
+                if len(members):
+                    mean = members.sum(axis=0)
+                    centroids[i] = mean / (np.linalg.norm(mean) or 1.0)
+        assignment = np.concatenate([
+            np.argmax(self._matrix[live[i:i + 16384]] @ centroids.T, axis=1) for i in range(0, len(live), 16384)
+        ])
+        lists: List["np.ndarray"] = [live[assignment == i] for i in range(n_lists)]
+        self._ivf = (centroids, lists, [])
+
+    def search(self, query: str, limit: int = 40) -> List[Tuple[str, int, int, str, float]]:
+        """Returns the chunks closest to a question as (rel_path, start, end, name, score), best first."""
+        vector = self.embedder.embed_query(query)
+        if not vector.any():
+            return []
+        with self._lock:
+            count: int = len(self._chunks)
+            if self._matrix is None or len(self) == 0:
+                return []
+            if len(self) < self.IVF_MIN_ROWS:
+                candidates = np.arange(count)
+                scores = np.asarray(self._matrix[:count] @ vector)
+                if self._dead:
+                    scores[np.fromiter(self._dead, dtype=np.int64)] = -np.inf
+                k: int = limit
+            else:
+                if self._ivf is None or len(self._ivf[2]) > len(self) // 5:
+                    self._train_ivf()
+                centroids, lists, pending = self._ivf
+                probes = np.argsort(-(centroids @ vector))[:self.IVF_PROBES]
+                candidates = np.sort(np.concatenate([lists[i] for i in probes] + [np.asarray(pending, dtype=np.int64)]))
+                scores = np.asarray(self._matrix[candidates] @ vector)
+                # Lists may still hold rows that died since training
+                k = limit + len(self._dead)
+            if k < len(candidates):
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(candidates))
+            results: List[Tuple[str, int, int, str, float]] = []
+            for i in top[np.argsort(-scores[top])]:
+                chunk = self._chunks[int(candidates[i])]
+                if chunk is not None and np.isfinite(scores[i]):
+                    results.append(chunk + (float(scores[i]),))
+                    if len(results) == limit:
+                        break
+        return results
+
+    def close(self) -> None:
+        self.save()
+        with self._lock:
+            self._matrix = None
+            self._conn.close()
+
+
+# --- Python Symbol Index ---
+class _SymbolCollector(ast.NodeVisitor):
+    """Collects the definitions and imports of a module and, per enclosing function, the names it calls."""
+
+    def __init__(self) -> None:
+        self.definitions: List[List[Any]] = []
+        self.imports: List[List[Any]] = []
+        self.calls: Dict[Tuple[str, int, int], Dict[str, int]] = {}
+        self._scopes: List[Tuple[str, str, int, int]] = []  # (name, kind, start, end)
+        self._statement: Tuple[int, int] = (0, 0)
+
+    def visit_Module(self, node: ast.Module) -> None:
+        for statement in node.body:
+            self._statement = (statement.lineno, statement.end_lineno or statement.lineno)
+            self.visit(statement)
+
+    def _visit_definition(self, node: Union[ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef], kind: str) -> None:
+        qualname: str = ".".join([scope[0] for scope in self._scopes] + [node.name])
+        start: int = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        end: int = node.end_lineno or node.lineno
+        doc: str = (ast.get_docstring(node) or "").strip().split("\n")[0][:160]
+        self.definitions.append([qualname, kind, start, end, doc])
+        self._scopes.append((node.name, kind, start, end))
+        self.generic_visit(node)
+        self._scopes.pop()
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        self._visit_definition(node, "class")
+
+    def visit_FunctionDef(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> None:
+        self._visit_definition(node, "method" if self._scopes and self._scopes[-1][1] == "class" else "function")
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            self.imports.append([alias.name, 0, []])
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        self.imports.append([node.module or "", node.level, [alias.name for alias in node.names if alias.name != "*"]])
+
+    def visit_Call(self, node: ast.Call) -> None:
+        func = node.func
+        name: Optional[str] = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+        if name:
+            # The innermost function is the caller; calls outside functions belong to their top-level statement
+            for index in range(len(self._scopes) - 1, -1, -1):
+                if self._scopes[index][1] != "class":
+                    key = (".".join(scope[0] for scope in self._scopes[:index + 1]),) + self._scopes[index][2:]
+                    break
+            else:
+                key = ("<module>",) + self._statement
+            self.calls.setdefault(key, {}).setdefault(name, node.lineno)
+        self.generic_visit(node)
+
+
+def parse_python_symbols(text: str) -> Dict[str, List[List[Any]]]:
+    """
+    Definitions, call sites and imports of a Python source, in a JSON-friendly form:
+    "definitions" as [qualname, kind, start, end, first docstring line] with kind
+    "class", "function" or "method", "calls" as [caller, start, end, [[name, line], ...]]
+    where the caller is the enclosing function (or "<module>" for top-level code) and
+    line is the first call of name in it, and "imports" as [module, level, imported names].
+    Unparsable sources have no symbols.
+    """
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return {"definitions": [], "calls": [], "imports": []}
+    collector = _SymbolCollector()
+    collector.visit(tree)
+    calls = [[caller, start, end, sorted(names.items())] for (caller, start, end), names in collector.calls.items()]
+    return {"definitions": collector.definitions, "calls": calls, "imports": collector.imports}
+
+
+class SymbolIndex:
+    """
+    Thread-safe index of the definitions and call sites of a project's Python files,
+    kept per file by (size, mtime). Definitions are found by name or dotted
+    qualname suffix; callers by the last part of the called name.
+    """
+
+    def __init__(self) -> None:
+        self._files: Dict[str, Tuple[Tuple[int, int], Dict[str, List[List[Any]]]]] = {}
+        self._definitions: Dict[str, List[Tuple[str, List[Any]]]] = {}  # short name -> [(rel_path, definition)]
+        self._callers: Dict[str, List[Tuple[str, List[Any]]]] = {}  # called name -> [(rel_path, call site)]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(symbols["definitions"]) for _, symbols in self._files.values())
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return list(self._files)
+
+    def version_of(self, rel_path: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            entry = self._files.get(rel_path)
+        return entry[0] if entry is not None else None
+
+    def update(self, rel_path: str, version: Tuple[int, int], symbols: Dict[str, List[List[Any]]]) -> None:
+        with self._lock:
+            self._remove_locked(rel_path)
+            self._files[rel_path] = (version, symbols)
+            for definition in symbols["definitions"]:
+                self._definitions.setdefault(definition[0].rsplit(".", 1)[-1], []).append((rel_path, definition))
+            for call in symbols["calls"]:
+                for name, _ in call[3]:
+                    self._callers.setdefault(name, []).append((rel_path, call))
+
+    def remove(self, rel_path: str) -> None:
+        with self._lock:
+            self._remove_locked(rel_path)
+
+    def _remove_locked(self, rel_path: str) -> None:
+        entry = self._files.pop(rel_path, None)
+        if entry is None:
+            return
+        for table, names in (
+            (self._definitions, {d[0].rsplit(".", 1)[-1] for d in entry[1]["definitions"]}),
+            (self._callers, {name for call in entry[1]["calls"] for name, _ in call[3]}),
+        ):
+            for name in names:
+                kept = [item for item in table.get(name, []) if item[0] != rel_path]
+                if kept:
+                    table[name] = kept
+                else:
+                    table.pop(name, None)
+
+    def definitions(self, name: str) -> List[Tuple[str, List[Any]]]:
+        """Definitions whose name is `name`, or whose qualname ends with it when dotted."""
+        with self._lock:
+            found = list(self._definitions.get(name.rsplit(".", 1)[-1], []))
+        if "." in name:
+            found = [(rel, d) for rel, d in found if d[0] == name or d[0].endswith("." + name)]
+        return found
+
+    def imports(self, rel_path: str) -> List[List[Any]]:
+        """The [module, level, names] imports of a file."""
+        with self._lock:
+            entry = self._files.get(rel_path)
+        return entry[1]["imports"] if entry is not None else []
+
+    def members(self, rel_path: str, qualname: str) -> List[List[Any]]:
+        """Direct members (methods, nested classes) of a class, in file order."""
+        with self._lock:
+            entry = self._files.get(rel_path)
+        if entry is None:
+            return []
+        depth: int = qualname.count(".") + 1
+        return [d for d in entry[1]["definitions"] if d[0].startswith(qualname + ".") and d[0].count(".") == depth]
+
+    def callers(self, name: str) -> List[Tuple[str, List[Any]]]:
+        """Call sites calling `name` (the last part of a dotted name), as (rel_path, [caller, start, end, calls])."""
+        with self._lock:
+            return list(self._callers.get(name.rsplit(".", 1)[-1], []))
+
+
+# Words of a question that look like code identifiers: dotted, snake_case, camelCase, or written as a call
+_SYMBOL_MENTION_RE = re.compile(r"`?([A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)(`|\()?")
+
+
+def mentioned_identifiers(prompt: str) -> List[str]:
+    """
+    Identifiers a question names explicitly: dotted names, names with an underscore
+    or an inner capital letter, names in backticks or followed by "(", and capitalized
+    words (class names). Plain lowercase words are left out, so "load" or "close" used
+    as English do not match methods.
+    """
+    found: List[str] = []
+    for match in _SYMBOL_MENTION_RE.finditer(prompt):
+        word: str = match.group(1).rstrip(".")
+        explicit: bool = match.group(0).startswith("`") or bool(match.group(2))
+        if not word or word.lower() in QUERY_STOPWORDS:
+            continue
+        if explicit or "." in word or "_" in word or any(c.isupper() for c in word[1:]) or (word[0].isupper() and len(word) > 2):
+            if word not in found:
+                found.append(word)
+    return found
+
+
+# --- Import Graph ---
+# Module specifiers of JS/TS sources: import ... from "x", import "x", export ... from "x", require("x"), import("x")
+_JS_IMPORT_RE = re.compile(
+    r"""(?:\bimport\s+(?:[\w*{}\s,$]+?\s+from\s+)?|\bexport\s+[\w*{}\s,$]+?\s+from\s+|\b(?:require|import)\s*\(\s*)['"]([^'"\n]+)['"]"""
+)
+JS_EXTENSIONS: Tuple[str, ...] = ('.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx', '.mts', '.cts', '.vue', '.svelte')
+_JS_RESOLVE_SUFFIXES: Tuple[str, ...] = ('',) + JS_EXTENSIONS + tuple('/index' + ext for ext in JS_EXTENSIONS)
+
+
+def parse_js_imports(text: str) -> List[str]:
+    """Module specifiers imported or required by a JS/TS source, in order of first use."""
+    return list(dict.fromkeys(match.group(1) for match in _JS_IMPORT_RE.finditer(text)))
+
+
+class ImportGraph:
+    """
+    Thread-safe file-level dependency graph of a project. Each file's imports
+    (Python [module, level, names] entries, or JS/TS specifiers) are kept by
+    (size, mtime) and resolved to project files lazily: only changed files are
+    re-resolved, unless files were added or removed.
+
+    Python imports resolve relative to the file's package, or, when absolute, from
+    the file's directory, its ancestors, the root or src/ (nearest first), which
+    covers scripts, packages and src layouts without knowing sys.path. JS/TS
+    specifiers resolve when relative (or "@/" for src/), trying the usual
+    extensions and index files. Imports of anything outside the project are dropped.
+    """
+
+    def __init__(self) -> None:
+        self._imports: Dict[str, Tuple[Tuple[int, int], List[Any]]] = {}
+        self._files: Dict[str, str] = {}  # posix path -> rel_path
+        self._dependencies: Dict[str, List[str]] = {}
+        self._unresolved: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._resolve_locked()
+            return sum(len(deps) for deps in self._dependencies.values())
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return list(self._imports)
+
+    def version_of(self, rel_path: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            entry = self._imports.get(rel_path)
+        return entry[0] if entry is not None else None
+
+    def set_files(self, rel_paths: List[str]) -> None:
+        """Sets the project files imports may resolve to; a different set re-resolves every file."""
+        files: Dict[str, str] = {rel.replace("\\", "/"): rel for rel in rel_paths}
+        with self._lock:
+            if files.keys() != self._files.keys():
+                self._files = files
+                self._unresolved.update(self._imports)
+
+    def update(self, rel_path: str, version: Tuple[int, int], imports: List[Any]) -> None:
+        with self._lock:
+            self._imports[rel_path] = (version, imports)
+            self._unresolved.add(rel_path)
+
+    def remove(self, rel_path: str) -> None:
+        with self._lock:
+            self._imports.pop(rel_path, None)
+            self._dependencies.pop(rel_path, None)
+            self._unresolved.discard(rel_path)
+
+    def dependencies(self, rel_path: str) -> List[str]:
+        """Project files imported by a file, in import order."""
+        with self._lock:
+            self._resolve_locked()
+            return list(self._dependencies.get(rel_path, []))
+
+    def _resolve_locked(self) -> None:
+        for rel_path in self._unresolved:
+            entry = self._imports.get(rel_path)
+            if entry is None:
+                continue
+            posix: str = rel_path.replace("\\", "/")
+            if posix.lower().endswith(JS_EXTENSIONS):
+                found = [self._resolve_js(posix, spec) for spec in entry[1]]
+            else:
+                found = [dep for item in entry[1] for dep in self._resolve_python(posix, *item)]
+            self._dependencies[rel_path] = [
+                self._files[dep] for dep in dict.fromkeys(found) if dep is not None and dep != posix
+            ]
+        self._unresolved.clear()
+
+    def _python_module(self, parts: List[str]) -> Optional[str]:
+        """The file of a module given as path parts: a module file or a package's __init__.py."""
+        base: str = "/".join(parts)
+        for candidate in (base + ".py", base + "/__init__.py"):
+            if candidate in self._files:
+                return candidate
+        return None
+
+    def _resolve_python(self, posix: str, module: str, level: int, names: List[str]) -> List[str]:
+        package: List[str] = posix.split("/")[:-1]
+        if level:
+            if level - 1 > len(package):
+                return []
+            bases: List[List[str]] = [package[:len(package) - (level - 1)]]
+        else:
+            bases = [package[:depth] for depth in range(len(package), -1, -1)] + [["src"]]
+        module_parts: List[str] = module.split(".") if module else []
+        for base in bases:
+            target: List[str] = base + module_parts
+            # "from package import module" imports submodules; anything else comes from the package itself
+            found: List[str] = [dep for dep in (self._python_module(target + [name]) for name in names) if dep]
+            if len(found) < len(names) or not names:
+                if module_parts or level:
+                    dep = self._python_module(target)
+                    if dep:
+                        found.append(dep)
+            if found:
+                return found
+        return []
+
+    def _resolve_js(self, posix: str, spec: str) -> Optional[str]:
+        if spec.startswith("@/"):
+            base: str = posixpath.normpath("src/" + spec[2:])
+        elif spec.startswith("."):
+            base = posixpath.normpath(posixpath.join(posixpath.dirname(posix), spec))
+        else:
+            return None
+        for suffix in _JS_RESOLVE_SUFFIXES:
+            if base + suffix in self._files:
+                return base + suffix
+        return None
+
+
+class ProjectContextExtractor:
     """
     Utilities for traversing directory structures and extracting file contents 
     based on configurable extension allowlists and directory blocklists.
     """
     
+    # Formats whose parsing is CPU-bound enough to be worth a worker process
+    HEAVY_EXTENSIONS: Set[str] = {'.xlsx', '.xls', '.docx', '.ipynb'}
+    PROCESS_POOL_MIN_JOBS: int = 8
+
+    # Larger files are listed but neither extracted nor indexed
+    MAX_CONTENT_BYTES: int = 100 * 1024
+
     DEFAULT_EXCLUSIONS: Set[str] = {
         "venv", "MyVenv", ".venv", "env", "log", "logs", ".env", "node_modules", ".git", "__pycache__",
         ".mypy_cache", ".pytest_cache", ".idea", ".vscode", ".DS_Store", ".cache",
@@ -187,6 +2481,7 @@ class ProjectContextExtractor(QtCore.QObject):
     def __init__(self) -> None:
         super().__init__()
         self.exclusions: Set[str] = set()
+        self._exclusions_lock = threading.Lock()
         self.extensions: Set[str] = {
             '.py', '.pyw', '.ipynb', '.txt', '.pdf', '.docx', '.xlsx', '.xls',
             '.js', '.jsx', '.ts', '.tsx', '.vue', '.html', '.css',
@@ -198,6 +2493,40 @@ class ProjectContextExtractor(QtCore.QObject):
             '.ps1', '.psm1', '.psd1', '.cmake', 'CMakeLists.txt', 'Dockerfile', 'dockerfile', 'Vagrantfile', 'Procfile'
         }
 
+        # Honor .gitignore/.ignore files in addition to the exclusion list
+        self.respect_ignore_files: bool = True
+        self._matchers: Dict[str, IgnoreMatcher] = {}
+
+        # In-memory cache shared by full and targeted builds
+        self.cache: ExtractionCache = ExtractionCache()
+
+        # Persistent content index (one per project root)
+        self.index_enabled: bool = True
+        self.cache_dir: Optional[str] = None
+        self._indexes: Dict[str, ProjectIndex] = {}
+
+        # Directory listing concurrency (1 = serial walk)
+        self.max_workers: int = 1
+
+        # Parsing of heavy formats (xlsx/docx/ipynb) in worker processes (0 or 1 = in-process)
+        self.process_workers: int = min(4, os.cpu_count() or 1)
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._process_pool_lock = threading.Lock()
+
+        # Last structure walk per root: directory listings keyed by relative path,
+        # and the rendered (structure lines, relative file paths)
+        self._trees: Dict[str, Dict[str, Tuple[List[Tuple[str, bool, os.DirEntry]], Optional[str]]]] = {}
+        self._structure_cache: Dict[str, Tuple[List[str], List[str]]] = {}
+        self._structure_tokens: Dict[str, Tuple[List[str], int]] = {}
+        self._compact_structures: Dict[str, Tuple[List[str], Optional[int], str]] = {}
+
+        # BM25 and embedding indexes of file contents per root, synced with the structure by sync_indexes
+        self._search_indexes: Dict[str, SearchIndex] = {}
+        self._embedding_indexes: Dict[str, EmbeddingIndex] = {}
+        self._symbol_indexes: Dict[str, SymbolIndex] = {}
+        self._import_graphs: Dict[str, ImportGraph] = {}
+        self._search_lock = threading.Lock()
+
     def set_extensions(self, extension_list: List[str]) -> None:
         """Updates the list of file extensions to process."""
         self.extensions = set()
@@ -208,11 +2537,164 @@ class ProjectContextExtractor(QtCore.QObject):
             if not e.startswith("."):
                 e = "." + e
             self.extensions.add(e)
+        self._trees.clear()
+        self._structure_cache.clear()
+        self._matchers.clear()
+
+    def set_max_workers(self, max_workers: int) -> None:
+        """Sets how many directories are listed concurrently (1 disables the thread pool)."""
+        self.max_workers = max(1, int(max_workers))
 
     def set_exclusions(self, exclusions: List[str]) -> None:
         """Updates the list of directories or files to ignore."""
         new_exclusions = set(x.strip() for x in exclusions if x.strip())
-        self.exclusions = self.DEFAULT_EXCLUSIONS.union(new_exclusions)
+        with self._exclusions_lock:
+            self.exclusions = self.DEFAULT_EXCLUSIONS.union(new_exclusions)
+        self._trees.clear()
+        self._structure_cache.clear()
+        self._matchers.clear()
+
+    def _ensure_default_exclusions(self) -> None:
+        """
+        Adds the default exclusions if missing. The set is replaced, never mutated,
+        under a lock, so concurrent builds (dmc ask_many) and walks see a consistent set.
+        """
+        with self._exclusions_lock:
+            if not self.DEFAULT_EXCLUSIONS <= self.exclusions:
+                self.exclusions = self.DEFAULT_EXCLUSIONS.union(self.exclusions)
+
+    def get_index(self, folder_path: str) -> Optional[ProjectIndex]:
+        """Returns the persistent index for a project root, or None if indexing is unavailable."""
+        if not self.index_enabled:
+            return None
+        root: str = os.path.abspath(folder_path)
+        index = self._indexes.get(root)
+        if index is None:
+            try:
+                index = ProjectIndex(root, self.cache_dir)
+            except (sqlite3.Error, OSError):
+                # The index is only an optimization; fall back to plain extraction
+                return None
+            self._indexes[root] = index
+        return index
+
+    def extract_file_content_indexed(self, root_path: str, filepath: str, indent_level: int, size: int, mtime_ns: int) -> Tuple[str, Dict[str, int]]:
+        """Like extract_file_content, but served from the persistent index when the file is unchanged."""
+        return self.extract_files(root_path, [(filepath, indent_level, size, mtime_ns)])[0]
+
+    def extract_files(self, root_path: str, jobs: List[Tuple[str, int, int, int]]) -> List[Tuple[str, Dict[str, int]]]:
+        """
+        Extracts a batch of files, returning (content, stats) pairs in job order.
+
+        Each job is (filepath, indent_level, size, mtime_ns). Unchanged files come from
+        the in-memory cache, then the persistent index; uncached heavy formats are parsed
+        in the process pool when there are enough of them to amortize the dispatch,
+        everything else in-process. Both caches hold un-indented content; the indent is
+        applied here. Failed extractions (stats with an "error" key) are returned but not
+        cached, so a transient read error is retried next time.
+        """
+        index = self.get_index(root_path)
+        results: List[Optional[Tuple[str, Dict[str, int]]]] = [None] * len(jobs)
+        heavy_jobs: List[int] = []
+        extracted: List[int] = []
+
+        for i, (filepath, _, size, mtime_ns) in enumerate(jobs):
+            cache_key = (os.path.abspath(filepath), size, mtime_ns)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                results[i] = cached
+                continue
+            if index is not None:
+                cached = index.lookup(os.path.relpath(filepath, root_path), size, mtime_ns)
+                if cached is not None:
+                    results[i] = cached
+                    self.cache.put(cache_key, *cached)
+                    continue
+            extracted.append(i)
+            if os.path.splitext(filepath)[1].lower() in self.HEAVY_EXTENSIONS:
+                heavy_jobs.append(i)
+            else:
+                results[i] = self._extract_or_error(filepath)
+
+        if len(heavy_jobs) >= self.PROCESS_POOL_MIN_JOBS and self.process_workers > 1:
+            parsed = self._extract_in_process_pool([jobs[i][0] for i in heavy_jobs])
+            for i, result in zip(heavy_jobs, parsed):
+                results[i] = result
+        else:
+            for i in heavy_jobs:
+                results[i] = self._extract_or_error(jobs[i][0])
+
+        for i in extracted:
+            filepath, _, size, mtime_ns = jobs[i]
+            if results[i][1].get('error'):
+                continue
+            self.cache.put((os.path.abspath(filepath), size, mtime_ns), *results[i])
+            if index is not None:
+                index.store(os.path.relpath(filepath, root_path), size, mtime_ns, *results[i])
+
+        return [(self.indent_content(content, job[1]), stats) for job, (content, stats) in zip(jobs, results)]
+
+    _CONTENT_HEADER: str = "Content:\n"
+
+    @classmethod
+    def indent_content(cls, content: str, indent_level: int) -> str:
+        """
+        Indents un-indented extracted content for a given depth: the "Content:" header
+        of text files (whose text stays verbatim), or every line of the other formats.
+        """
+        if not indent_level:
+            return content
+        indent: str = '    ' * indent_level
+        if content.startswith(cls._CONTENT_HEADER):
+            return indent + content
+        return "\n".join(indent + line for line in content.split("\n"))
+
+    def _extract_or_error(self, filepath: str) -> Tuple[str, Dict[str, int]]:
+        try:
+            return self.extract_file_content(filepath)
+        except Exception as e:
+            return f"[Error reading file: {str(e)}]", {'error': 1}
+
+    def _extract_in_process_pool(self, filepaths: List[str]) -> List[Tuple[str, Dict[str, int]]]:
+        """Parses files (un-indented) in worker processes, falling back to in-process on failure."""
+        # Concurrent batches (dmc ask_many) share one pool
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                # Not fork: this process runs Qt, request and background threads whose
+                # locks a forked child could inherit held
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            pool = self._process_pool
+
+        futures = [pool.submit(_extract_file_in_process, filepath) for filepath in filepaths]
+        results: List[Tuple[str, Dict[str, int]]] = []
+        for filepath, future in zip(filepaths, futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                # A crashed worker poisons the pool; rebuild it lazily next time
+                with self._process_pool_lock:
+                    if self._process_pool is pool:
+                        self._process_pool = None
+                        pool.shutdown(wait=False, cancel_futures=True)
+                results.append(self._extract_or_error(filepath))
+            except Exception as e:
+                results.append((f"[Error reading file: {str(e)}]", {'error': 1}))
+        return results
+
+    def shutdown(self) -> None:
+        """Releases the worker processes and closes the persistent indexes."""
+        with self._process_pool_lock:
+            pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        for index in self._indexes.values():
+            index.close()
+        self._indexes.clear()
+        for vectors in self._embedding_indexes.values():
+            vectors.close()
+        self._embedding_indexes.clear()
 
     def build_context(self, folder_path: str, extract_content: bool = True) -> str:
         """
@@ -225,7 +2707,7 @@ class ProjectContextExtractor(QtCore.QObject):
         Returns:
             str: Formatted string containing structure and content.
         """
-        self.exclusions = self.DEFAULT_EXCLUSIONS.union(self.exclusions)
+        self._ensure_default_exclusions()
         struct, cont, stats = self.get_folder_structure_and_content(
             folder_path, 
             extract_content=extract_content
@@ -247,117 +2729,1144 @@ class ProjectContextExtractor(QtCore.QObject):
             )
         return "\n".join(result).strip()
 
-    def build_targeted_context(self, folder_path: str, target_files: List[str]) -> str:
+    def build_targeted_context(self, folder_path: str, target_files: List[str], token_budget: Optional[int] = None) -> str:
         """
         Generates a context report containing the full directory structure,
         but includes content ONLY for the specified target files.
+
+        The structure is reused from the last walk of this root (e.g. the one done by
+        reload), and targets are resolved by path lookup, so only the selected files are touched.
+
+        With a token_budget, target_files is treated as a ranking: files are packed in
+        order until the budget is reached, the first file that does not fit is truncated,
+        and the rest are reduced to an outline (or just listed) as long as room remains.
+
+        A target may also be a chunk, "path:start-end" (as returned by semantic_search):
+        only those lines of the file are included, unless the whole file is targeted too.
+
+        When the full structure would take more than STRUCTURE_BUDGET_SHARE of the
+        budget, the compact_structure encoding is sent instead, so files still fit.
         """
-        self.exclusions = self.DEFAULT_EXCLUSIONS.union(self.exclusions)
+        self._ensure_default_exclusions()
         
-        # 1. Retrieve full folder structure (without content)
-        struct, _, _ = self.get_folder_structure_and_content(folder_path, extract_content=False)
+        # 1. Retrieve full folder structure (without content), walking only if never scanned
+        cached = self._structure_cache.get(os.path.abspath(folder_path))
+        if cached is None:
+            self.get_folder_structure_and_content(folder_path, extract_content=False)
+            cached = self._structure_cache[os.path.abspath(folder_path)]
+        struct: List[str] = cached[0]
         
         content_output: List[str] = []
         stats: Dict[str, int] = {'words': 0, 'lines': 0, 'characters': 0, 'tokens': 0, 'size': 0}
         
         # 2. Extract content specific to the target files
-        # Normalize paths for robust matching
-        clean_targets: List[str] = [os.path.normpath(f).lower() for f in target_files]
-        
-        for root, dirs, files in os.walk(folder_path):
-            # Apply directory exclusions
-            dirs[:] = [d for d in dirs if d not in self.exclusions]
+        selected: List[str] = []
+        jobs: List[Tuple[str, int, int, int]] = []
+        line_ranges: Dict[str, List[Tuple[int, int]]] = {}
+        for rel_path in self._resolve_chunk_targets(folder_path, target_files, line_ranges):
+            full_path: str = os.path.join(folder_path, rel_path)
+            try:
+                file_stat = os.stat(full_path)
+            except OSError:
+                continue
+            selected.append(rel_path)
+            jobs.append((full_path, 1, file_stat.st_size, file_stat.st_mtime_ns))
+
+        extracted = self.extract_files(folder_path, jobs)
+        if line_ranges:
+            extracted = [
+                self._excerpt(content, line_ranges[rel_path]) if rel_path in line_ranges else (content, file_stats)
+                for rel_path, (content, file_stats) in zip(selected, extracted)
+            ]
+        index = self.get_index(folder_path)
+        if index is not None:
+            index.flush()
+
+        struct = ["FOLDER STRUCTURE (Full):"] + struct
+        if token_budget is None:
+            packed: List[Tuple[str, str, Dict[str, int]]] = [
+                (rel_path, content, file_stats) for rel_path, (content, file_stats) in zip(selected, extracted)
+            ]
+            omitted: List[str] = []
+        else:
+            structure_tokens: int = self._structure_token_count(folder_path)
+            structure_share: int = int(token_budget * self.STRUCTURE_BUDGET_SHARE)
+            if structure_tokens > structure_share:
+                # Carries its own title and legend
+                compact: str = self.compact_structure(folder_path, structure_share)
+                struct = compact.split("\n")
+                structure_tokens = count_tokens(compact)
+            remaining: int = max(0, token_budget - structure_tokens - 100)
+            packed, omitted = self._pack_to_budget(selected, extracted, remaining)
+
+        for rel_path, file_content, file_stats in packed:
+            content_output.append(f"\nFile: {rel_path}")
+            content_output.append(file_content)
             
-            for file in files:
-                if file in self.exclusions: 
-                    continue
-                
-                full_path: str = os.path.join(root, file)
-                rel_path: str = os.path.relpath(full_path, folder_path)
-                
-                # Check if the file matches a target (by filename or relative path)
-                if os.path.normpath(rel_path).lower() in clean_targets or \
-                   file.lower() in clean_targets:
-                    
-                    file_content, file_stats = self.extract_file_content(full_path, indent_level=1)
-                    content_output.append(f"\nFile: {rel_path}")
-                    content_output.append(file_content)
-                    
-                    # Accumulate statistics
-                    for k in stats:
-                        if k in file_stats: 
-                            stats[k] += file_stats[k]
+            # Accumulate statistics
+            for k in stats:
+                if k in file_stats: 
+                    stats[k] += file_stats[k]
 
         result: List[str] = []
-        result.append("FOLDER STRUCTURE (Full):")
         result.extend(struct)
         result.append("\n######################################\n")
-        result.append(f"SELECTED RELEVANT FILE CONTENTS ({len(content_output)//2} files):")
+        result.append(f"SELECTED RELEVANT FILE CONTENTS ({len(packed)} files):")
         result.extend(content_output)
+        if omitted:
+            result.append(f"\nOMITTED TO FIT THE TOKEN BUDGET ({len(omitted)} files): {', '.join(omitted)}")
         result.append("\n######################################\n")
         result.append(f"Targeted Stats: ~{stats['tokens']} tokens.")
         
         return "\n".join(result).strip()
 
-    def get_folder_structure_and_content(self, folder_path: str, indent_level: int = 0, extract_content: bool = True) -> Tuple[List[str], List[str], Dict[str, int]]:
-        """Recursively traverses the folder to build structure and content lists."""
-        structure_output: List[str] = []
-        content_output: List[str] = []
-        stats: Dict[str, int] = {'words': 0, 'lines': 0, 'characters': 0, 'tokens': 0, 'size': 0}
+    _CHUNK_TARGET_RE = re.compile(r"^(.+):(\d+)-(\d+)$")
 
-        try:
-            items: List[str] = sorted(os.listdir(folder_path))
-        except Exception as ex:
-            return [f"{'    ' * indent_level}[Cannot open: {ex}]"], [], stats
+    def _resolve_chunk_targets(self, folder_path: str, target_files: List[str], line_ranges: Dict[str, List[Tuple[int, int]]]) -> List[str]:
+        """
+        Resolves targets like resolve_target_files, recording the line ranges of
+        "path:start-end" chunk targets in line_ranges (files also targeted whole are left out).
+        """
+        resolve = self._target_resolver(folder_path)
+        resolved: List[str] = []
+        seen: Set[str] = set()
+        whole: Set[str] = set()
+        for target in target_files:
+            match = self._CHUNK_TARGET_RE.match(target.strip()) if isinstance(target, str) else None
+            for rel in resolve(match.group(1) if match else target):
+                if match:
+                    line_ranges.setdefault(rel, []).append((int(match.group(2)), int(match.group(3))))
+                else:
+                    whole.add(rel)
+                if rel not in seen:
+                    seen.add(rel)
+                    resolved.append(rel)
+        for rel in whole:
+            line_ranges.pop(rel, None)
+        return resolved
+
+    def _excerpt(self, content: str, ranges: List[Tuple[int, int]]) -> Tuple[str, Dict[str, int]]:
+        """Keeps only the given 1-based line ranges of an extracted file (merged and in file order)."""
+        lines: List[str] = self._content_text(content).split("\n")
+        merged: List[List[int]] = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        parts: List[str] = []
+        for start, end in merged:
+            start, end = max(1, start), min(len(lines), end)
+            if start <= end:
+                parts.append(f"    Lines {start}-{end}:\n" + "\n".join(lines[start - 1:end]))
+        excerpt: str = "\n".join(parts)
+        return excerpt, {'lines': excerpt.count("\n"), 'characters': len(excerpt), 'tokens': count_tokens(excerpt)}
+
+    # Smallest useful slice of a truncated file, and of an outline entry
+    MIN_TRUNCATED_TOKENS: int = 200
+
+    # Most of a token budget the folder structure may take in a targeted build
+    STRUCTURE_BUDGET_SHARE: float = 0.5
+    OUTLINE_MAX_LINES: int = 12
+    _OUTLINE_RE = re.compile(
+        r"^\s*(?:async\s+def|def|class|function|export|public|private|protected|func|fn|struct|interface|impl|module)\b"
+    )
+
+    def _pack_to_budget(self, selected: List[str], extracted: List[Tuple[str, Dict[str, int]]], remaining: int) -> Tuple[List[Tuple[str, str, Dict[str, int]]], List[str]]:
+        """
+        Greedily fills `remaining` tokens with the ranked files.
+
+        Returns the (path, content, stats) entries to include and the paths left out.
+        """
+        packed: List[Tuple[str, str, Dict[str, int]]] = []
+        omitted: List[str] = []
+        truncating: bool = False
 
-        for item in items:
-            if item in self.exclusions:
+        for rel_path, (content, file_stats) in zip(selected, extracted):
+            cost: int = file_stats.get('tokens', 0) + 10
+            if not truncating and cost <= remaining:
+                packed.append((rel_path, content, file_stats))
+                remaining -= cost
                 continue
-                
-            item_path: str = os.path.join(folder_path, item)
-            
-            if os.path.isdir(item_path):
-                # Process Directory
-                structure_output.append(f"{'    ' * indent_level}{item}/")
-                sub_structure, sub_content, sub_stats = self.get_folder_structure_and_content(
-                    item_path, 
-                    indent_level + 1,
-                    extract_content=extract_content
-                )
-                structure_output.extend(sub_structure)
-                content_output.extend(sub_content)
-                for key in stats:
-                    stats[key] += sub_stats[key]
+
+            # Tail of the ranking: first truncate, then outline what still fits
+            if not truncating and remaining >= self.MIN_TRUNCATED_TOKENS:
+                truncating = True
+                head: str = self._truncate_to_tokens(content, remaining - 20)
+                head_tokens: int = count_tokens(head)
+                packed.append((rel_path, head, {'tokens': head_tokens}))
+                remaining -= head_tokens + 20
+                continue
+            truncating = True
+
+            outline: str = self._outline(content)
+            outline_tokens: int = count_tokens(outline) + 10
+            if outline and outline_tokens <= remaining:
+                packed.append((rel_path, outline, {'tokens': outline_tokens}))
+                remaining -= outline_tokens
+            else:
+                omitted.append(rel_path)
+
+        return packed, omitted
+
+    @staticmethod
+    def _truncate_to_tokens(content: str, max_tokens: int) -> str:
+        """Cuts content at a line boundary so that it stays within max_tokens."""
+        lines: List[str] = content.splitlines()
+        kept: List[str] = []
+        used: int = 0
+        for line in lines:
+            line_tokens: int = count_tokens(line) + 1
+            if used + line_tokens > max_tokens:
+                break
+            kept.append(line)
+            used += line_tokens
+        return "\n".join(kept + [f"[... truncated: {len(lines) - len(kept)} more lines]"])
+
+    def _outline(self, content: str) -> str:
+        """Summarizes a file by its top definition lines."""
+        lines: List[str] = [line.rstrip() for line in content.splitlines() if self._OUTLINE_RE.match(line)]
+        if not lines:
+            return ""
+        extra: str = f"\n    [... {len(lines) - self.OUTLINE_MAX_LINES} more definitions]" if len(lines) > self.OUTLINE_MAX_LINES else ""
+        return "    [Outline only]\n" + "\n".join(lines[:self.OUTLINE_MAX_LINES]) + extra
+
+    def _structure_token_count(self, folder_path: str) -> int:
+        """Token count of the stored structure text, memoized per rendered structure."""
+        root: str = os.path.abspath(folder_path)
+        lines: List[str] = self._structure_cache.get(root, ([], []))[0]
+        memo = self._structure_tokens.get(root)
+        if memo is None or memo[0] is not lines:
+            memo = (lines, count_tokens("\n".join(lines)))
+            self._structure_tokens[root] = memo
+        return memo[1]
+
+    def resolve_target_files(self, folder_path: str, target_files: List[str]) -> List[str]:
+        """
+        Maps the paths returned by the Brain onto existing files, preserving their order.
+
+        A target is matched by relative path (joined and stat'ed directly, then
+        case-insensitively against the known files), or, when it is a bare file
+        name, against every known file with that name. Glob patterns and directories
+        (as written by compact_structure) stand for up to TARGET_EXPANSION_LIMIT of
+        the files they match, in tree order: a pattern with a directory part matches the
+        files directly in the directories it names ("./" is the root), a bare pattern
+        file names anywhere, and a directory the files of its subtree.
+        """
+        resolve = self._target_resolver(folder_path)
+        resolved: List[str] = []
+        seen: Set[str] = set()
+        for target in target_files:
+            for rel in resolve(target):
+                if rel not in seen:
+                    seen.add(rel)
+                    resolved.append(rel)
+        return resolved
+
+    # Files a glob or directory target may expand to
+    TARGET_EXPANSION_LIMIT: int = 25
+    # Annotations of compact_structure that may be copied along with a target
+    _TARGET_ANNOTATION_RE = re.compile(r"\s*(?:\(\d+ files\)|\[\d+ files:[^\]]*\])$")
+
+    def _target_resolver(self, folder_path: str) -> Callable[[Any], List[str]]:
+        """Returns a function mapping one target onto the known files (see resolve_target_files)."""
+        known_files: List[str] = self._structure_cache.get(os.path.abspath(folder_path), ([], []))[1]
+        by_rel: Dict[str, str] = {}
+        by_name: Dict[str, List[str]] = {}
+        for rel in known_files:
+            by_rel[os.path.normpath(rel).lower()] = rel
+            by_name.setdefault(os.path.basename(rel).lower(), []).append(rel)
+        directories: Set[str] = set()  # "a", "a/b", ... (lower case), filled on first use
+
+        def is_directory(path: str) -> bool:
+            if not directories:
+                for rel_lower in by_rel:
+                    parts: List[str] = rel_lower.replace(os.sep, "/").split("/")[:-1]
+                    directories.update("/".join(parts[:depth]) for depth in range(1, len(parts) + 1))
+            return path.lower() in directories
+
+        def expand(pattern: str) -> List[str]:
+            pattern = pattern.lower()
+            directory, separator, name_pattern = pattern.rpartition("/")
+            directory = directory.removeprefix("./") if directory != "." else ""
+            matches: List[str] = []
+            for rel_lower, rel in by_rel.items():
+                rel_dir, _, name = rel_lower.replace(os.sep, "/").rpartition("/")
+                if not separator:
+                    matched: bool = fnmatch.fnmatchcase(name, name_pattern)
+                elif not name_pattern:
+                    matched = fnmatch.fnmatchcase(rel_dir, directory) or fnmatch.fnmatchcase(rel_dir, directory + "/*")
+                else:
+                    matched = fnmatch.fnmatchcase(rel_dir, directory) and fnmatch.fnmatchcase(name, name_pattern)
+                if matched:
+                    matches.append(rel)
+                    if len(matches) >= self.TARGET_EXPANSION_LIMIT:
+                        break
+            return matches
+
+        def resolve(target: Any) -> List[str]:
+            if not isinstance(target, str) or not target.strip():
+                return []
+            target = self._TARGET_ANNOTATION_RE.sub("", target.strip())
+            if any(c in target for c in "*?["):
+                return expand(target.replace("\\", "/"))
+            norm: str = os.path.normpath(target.replace("\\", "/"))
+            if os.path.isabs(norm) or norm.startswith(".."):
+                return []
+            parts: List[str] = norm.replace("\\", "/").split("/")
+            if len(parts) == 1 and norm.lower() in by_name:
+                return by_name[norm.lower()]
+            if norm.lower() in by_rel:
+                return [by_rel[norm.lower()]]
+            if len(parts) > 1 and not self._is_path_excluded(folder_path, parts) and os.path.isfile(os.path.join(folder_path, norm)):
+                return [norm]
+            if norm != "." and is_directory(norm.replace("\\", "/")):
+                return expand(norm.replace("\\", "/") + "/")
+            return []
+
+        return resolve
+
+    # --- Index Sync ---
+    def sync_indexes(self, folder_path: str, changed_dirs: Optional[List[str]] = None, embeddings: bool = False, symbols: bool = False, imports: bool = False) -> None:
+        """
+        Brings the content indexes of a root up to date with the last structure walk:
+        new or modified files (by size and mtime) are extracted through the caches and
+        re-indexed, files no longer listed are dropped. Without changed_dirs every file
+        is checked; with the directories a watcher reported (as for refresh_directories),
+        only the files directly in them, plus listed files the indexes do not know yet.
+
+        The chunk embedding index, Python symbol index and import graph are synced
+        with embeddings, symbols and imports respectively, or once they exist.
+        A first build extracts the whole project, so the GUI runs this in a background
+        task on load and on watcher events; queries only look the indexes up.
+        """
+        root: str = os.path.abspath(folder_path)
+        with self._search_lock:
+            listed: List[str] = self._listed_files(folder_path)
+            if changed_dirs is None:
+                checked: List[str] = listed
+            else:
+                dirs: Set[str] = {os.path.relpath(os.path.abspath(d), root) for d in changed_dirs}
+                dirs = {"" if d == os.curdir else d for d in dirs}
+                checked = [rel for rel in listed if os.path.dirname(rel) in dirs]
+            versions = self._file_versions(root, checked)
+            self._sync_search_index(root, listed, versions)
+            if embeddings or root in self._embedding_indexes:
+                self._sync_embedding_index(root, listed, versions)
+            if symbols or root in self._symbol_indexes:
+                self._sync_symbol_index(root, listed, versions)
+            if imports or root in self._import_graphs:
+                self._sync_import_graph(root, listed, versions)
+
+    def _index_changes(self, root: str, listed: List[str], versions: Dict[str, Tuple[int, int]], version_of: Callable[[str], Optional[Tuple[int, int]]]) -> Dict[str, Tuple[int, int]]:
+        """
+        Files of `listed` an index must (re)read: checked files (in versions) of another
+        version, plus unchecked files it has never seen.
+        """
+        changes: Dict[str, Tuple[int, int]] = {}
+        unseen: List[str] = []
+        for rel_path in listed:
+            version = versions.get(rel_path)
+            if version is None:
+                if version_of(rel_path) is None:
+                    unseen.append(rel_path)
+            elif version_of(rel_path) != version:
+                changes[rel_path] = version
+        changes.update(self._file_versions(root, unseen))
+        return changes
+
+    def _sync_search_index(self, root: str, listed: List[str], versions: Dict[str, Tuple[int, int]]) -> None:
+        index = self._search_indexes.setdefault(root, SearchIndex())
+        changes = self._index_changes(root, listed, versions, index.version_of)
+        changed: List[str] = list(changes)
+        for rel_path, text in zip(changed, self._extract_texts(root, changed, changes)):
+            index.update(rel_path, text, changes[rel_path])
+        listed_set: Set[str] = set(listed)
+        for rel_path in index.paths():
+            if rel_path not in listed_set:
+                index.remove(rel_path)
+
+    def _sync_embedding_index(self, root: str, listed: List[str], versions: Dict[str, Tuple[int, int]]) -> None:
+        index = self._embedding_indexes.get(root)
+        if index is None:
+            embedder = get_embedder()
+            if embedder is None:
+                return
+            try:
+                index = EmbeddingIndex(root, embedder, self.cache_dir)
+            except OSError:
+                return
+            self._embedding_indexes[root] = index
+        listed_set: Set[str] = set(listed)
+        for rel_path in index.paths():
+            if rel_path not in listed_set:
+                index.remove(rel_path)
+        changes = self._index_changes(root, listed, versions, index.version_of)
+        changed: List[str] = list(changes)
+        texts: List[str] = self._extract_texts(root, changed, changes, max_bytes=None)
+        index.update_files([(rel, changes[rel], text) for rel, text in zip(changed, texts)])
+        index.save()
+
+    def _python_symbols(self, root: str, versions: Dict[str, Tuple[int, int]]) -> Dict[str, Dict[str, List[List[Any]]]]:
+        """Symbols of Python files: stored ones from the persistent index, the others parsed and stored."""
+        persistent = self.get_index(root)
+        result: Dict[str, Dict[str, List[List[Any]]]] = {}
+        to_parse: List[str] = []
+        for rel_path, version in versions.items():
+            stored = persistent.lookup_symbols(rel_path, *version) if persistent is not None else None
+            if stored is not None:
+                result[rel_path] = stored
+            else:
+                to_parse.append(rel_path)
+        for rel_path, text in zip(to_parse, self._extract_texts(root, to_parse, versions, max_bytes=None)):
+            result[rel_path] = parse_python_symbols(text)
+            if persistent is not None:
+                persistent.store_symbols(rel_path, *versions[rel_path], result[rel_path])
+        if to_parse and persistent is not None:
+            persistent.flush()
+        return result
+
+    def _sync_symbol_index(self, root: str, listed: List[str], versions: Dict[str, Tuple[int, int]]) -> None:
+        listed = [rel for rel in listed if rel.lower().endswith(self.PYTHON_EXTENSIONS)]
+        index = self._symbol_indexes.setdefault(root, SymbolIndex())
+        changes = self._index_changes(root, listed, versions, index.version_of)
+        for rel_path, symbols in self._python_symbols(root, changes).items():
+            index.update(rel_path, changes[rel_path], symbols)
+        listed_set: Set[str] = set(listed)
+        for rel_path in index.paths():
+            if rel_path not in listed_set:
+                index.remove(rel_path)
+
+    def _sync_import_graph(self, root: str, listed: List[str], versions: Dict[str, Tuple[int, int]]) -> None:
+        """Python imports come from the files' symbols (see _python_symbols); JS/TS sources are scanned for their specifiers."""
+        graph = self._import_graphs.setdefault(root, ImportGraph())
+        graph.set_files(listed)
+        sources: List[str] = [rel for rel in listed if rel.lower().endswith(self.PYTHON_EXTENSIONS + JS_EXTENSIONS)]
+        changes = self._index_changes(root, sources, versions, graph.version_of)
+        python: Dict[str, Tuple[int, int]] = {
+            rel: version for rel, version in changes.items() if rel.lower().endswith(self.PYTHON_EXTENSIONS)
+        }
+        for rel_path, symbols in self._python_symbols(root, python).items():
+            graph.update(rel_path, python[rel_path], symbols["imports"])
+        scripts: List[str] = [rel for rel in changes if rel not in python]
+        for rel_path, text in zip(scripts, self._extract_texts(root, scripts, changes, max_bytes=None)):
+            graph.update(rel_path, changes[rel_path], parse_js_imports(text))
+        sources_set: Set[str] = set(sources)
+        for rel_path in graph.paths():
+            if rel_path not in sources_set:
+                graph.remove(rel_path)
+
+    def search_index(self, folder_path: str) -> SearchIndex:
+        """
+        Returns the content search index of a root as of the last sync_indexes, which
+        runs first if the root was never synced (waiting for a sync in progress).
+        """
+        root: str = os.path.abspath(folder_path)
+        with self._search_lock:
+            index = self._search_indexes.get(root)
+        if index is None:
+            self.sync_indexes(folder_path)
+            index = self._search_indexes[root]
+        return index
+
+    def embedding_index(self, folder_path: str) -> Optional[EmbeddingIndex]:
+        """
+        Returns the chunk embedding index of a root like search_index, or None when
+        numpy is not installed or the index cannot be stored.
+        """
+        if get_embedder() is None:
+            return None
+        root: str = os.path.abspath(folder_path)
+        with self._search_lock:
+            index = self._embedding_indexes.get(root)
+        if index is None:
+            self.sync_indexes(folder_path, embeddings=True)
+            index = self._embedding_indexes.get(root)
+        return index
+
+    def semantic_search(self, folder_path: str, prompt: str, limit: int = 40) -> List[Tuple[str, float]]:
+        """
+        Finds the code chunks closest to a question. Returns ("path:start-end", score)
+        targets, best first, to pass to build_targeted_context ([] without numpy).
+        """
+        index = self.embedding_index(folder_path)
+        if index is None:
+            return []
+        return [(f"{rel}:{start}-{end}", score) for rel, start, end, _, score in index.search(prompt, limit)]
+
+    PYTHON_EXTENSIONS: Tuple[str, ...] = ('.py', '.pyw')
+
+    def symbol_index(self, folder_path: str) -> SymbolIndex:
+        """Returns the Python symbol index of a root like search_index."""
+        root: str = os.path.abspath(folder_path)
+        with self._search_lock:
+            index = self._symbol_indexes.get(root)
+        if index is None:
+            self.sync_indexes(folder_path, symbols=True)
+            index = self._symbol_indexes[root]
+        return index
+
+    # A definition longer than this is sent as an outline: its header and member signatures
+    SYMBOL_MAX_LINES: int = 150
+
+    def symbol_targets(self, folder_path: str, prompt: str, max_definitions: int = 3, max_callers: int = 5) -> List[str]:
+        """
+        Chunk targets ("path:start-end") for the project definitions a question names
+        (see mentioned_identifiers), followed by up to max_callers call sites of each.
+        Returns [] when the question names no known symbol.
+
+        Ambiguous names keep the max_definitions definitions whose qualname and
+        docstring share most terms with the question; large classes are reduced to
+        their header and member signatures.
+        """
+        names: List[str] = mentioned_identifiers(prompt)
+        if not names:
+            return []
+        index = self.symbol_index(folder_path)
+        query_terms: Set[str] = {t for t in split_identifier_terms(prompt) if t not in QUERY_STOPWORDS and len(t) > 1}
+
+        definitions: List[Tuple[str, List[Any]]] = []
+        for name in names:
+            found = index.definitions(name)
+            found.sort(key=lambda item: -len(query_terms & set(split_identifier_terms(f"{item[1][0]} {item[1][4]}"))))
+            definitions.extend(item for item in found[:max_definitions] if item not in definitions)
+        if not definitions:
+            return []
+
+        targets: List[str] = []
+        for rel_path, (qualname, kind, start, end, _) in definitions:
+            members = index.members(rel_path, qualname) if kind == "class" else []
+            if end - start + 1 > self.SYMBOL_MAX_LINES and members:
+                targets.append(f"{rel_path}:{start}-{max(start, members[0][2] - 1)}")
+                targets.extend(f"{rel_path}:{member[2]}-{member[2]}" for member in members)
             else:
-                # Process File
-                ext: str = os.path.splitext(item_path)[1].lower()
-                if ext not in self.extensions:
+                targets.append(f"{rel_path}:{start}-{end}")
+
+        for rel_path, (qualname, kind, start, end, _) in definitions:
+            callers = [
+                (caller_rel, call) for caller_rel, call in index.callers(qualname)
+                # Skip calls from inside the definition itself (recursion, methods of the class)
+                if not (caller_rel == rel_path and start <= call[1] <= end)
+            ]
+            # Method calls are matched by name only, so prefer files that also use the class;
+            # then callers from other files, which show how the definition is used
+            owner_files: Set[str] = set()
+            if kind == "method":
+                owner_files = {rel_path} | {caller_rel for caller_rel, _ in index.callers(qualname.rsplit(".", 2)[-2])}
+            callers.sort(key=lambda item: (bool(owner_files) and item[0] not in owner_files, item[0] == rel_path, item[0], item[1][1]))
+            short_name: str = qualname.rsplit(".", 1)[-1]
+            for caller_rel, (_, caller_start, caller_end, calls) in callers[:max_callers]:
+                if caller_end - caller_start + 1 > self.SYMBOL_MAX_LINES:
+                    # Long callers are cut around the call
+                    line: int = dict(calls).get(short_name, caller_start)
+                    caller_start, caller_end = max(caller_start, line - 10), min(caller_end, line + 10)
+                target = f"{caller_rel}:{caller_start}-{caller_end}"
+                if target not in targets:
+                    targets.append(target)
+        return targets
+
+    def import_graph(self, folder_path: str) -> ImportGraph:
+        """Returns the import graph of a root like search_index."""
+        root: str = os.path.abspath(folder_path)
+        with self._search_lock:
+            graph = self._import_graphs.get(root)
+        if graph is None:
+            self.sync_indexes(folder_path, imports=True)
+            graph = self._import_graphs[root]
+        return graph
+
+    # Imported files added to a selection at most
+    MAX_DEPENDENCIES: int = 10
+
+    def expand_with_dependencies(self, folder_path: str, targets: List[str], limit: Optional[int] = None) -> List[str]:
+        """
+        Appends to a selection the project files its selected files import (one hop),
+        without a model call. Chunk targets are kept but not expanded. Files imported
+        by more of them, then files closer to an importer (same package) come first.
+        The dependencies go last, so that with a token budget (see
+        build_targeted_context) they only get what the selection leaves.
+        """
+        limit = self.MAX_DEPENDENCIES if limit is None else limit
+        if not targets or limit <= 0:
+            return list(targets)
+        graph = self.import_graph(folder_path)
+        line_ranges: Dict[str, List[Tuple[int, int]]] = {}
+        targeted: List[str] = self._resolve_chunk_targets(folder_path, targets, line_ranges)
+        selected: List[str] = [rel for rel in targeted if rel not in line_ranges]
+        if not selected:
+            return list(targets)
+        # Files with chunk targets are not added whole either
+        chosen: Set[str] = set(targeted)
+        importers: Dict[str, int] = {}
+        closeness: Dict[str, int] = {}  # directories shared with the nearest importer
+        for rel_path in selected:
+            directory: List[str] = rel_path.replace("\\", "/").split("/")[:-1]
+            for dependency in graph.dependencies(rel_path):
+                if dependency in chosen:
                     continue
-                    
-                structure_output.append(f"{'    ' * indent_level}{item}")
-                
-                if not extract_content:
+                importers[dependency] = importers.get(dependency, 0) + 1
+                shared: int = len(os.path.commonprefix([directory, dependency.replace("\\", "/").split("/")[:-1]]))
+                closeness[dependency] = max(closeness.get(dependency, 0), shared)
+        # Stable sort: ties keep the order of the selection
+        ranked: List[str] = sorted(importers, key=lambda rel: (-importers[rel], -closeness[rel]))
+        return list(targets) + ranked[:limit]
+
+    def _listed_files(self, folder_path: str) -> List[str]:
+        """Relative paths of the files of the last structure walk, walking if there was none."""
+        root: str = os.path.abspath(folder_path)
+        if root not in self._structure_cache:
+            self.get_folder_structure_and_content(folder_path, extract_content=False)
+        return self._structure_cache[root][1]
+
+    def _file_versions(self, root: str, rel_paths: List[str]) -> Dict[str, Tuple[int, int]]:
+        """(size, mtime_ns) of files of a root; files that vanished are left out."""
+        versions: Dict[str, Tuple[int, int]] = {}
+        for rel_path in rel_paths:
+            try:
+                file_stat = os.stat(os.path.join(root, rel_path))
+            except OSError:
+                continue
+            versions[rel_path] = (file_stat.st_size, file_stat.st_mtime_ns)
+        return versions
+
+    def _extract_texts(self, root: str, rel_paths: List[str], versions: Dict[str, Tuple[int, int]], max_bytes: Optional[int] = MAX_CONTENT_BYTES) -> List[str]:
+        """
+        Plain text of files (their extracted content without the header line), through
+        the caches. Files over max_bytes get "": by default MAX_CONTENT_BYTES, as whole
+        files over it are never shown. Indexes whose targets are excerpts pass None.
+        """
+        readable: List[str] = [rel for rel in rel_paths if max_bytes is None or versions[rel][0] <= max_bytes]
+        if not readable:
+            return [""] * len(rel_paths)
+        jobs: List[Tuple[str, int, int, int]] = [
+            (os.path.join(root, rel), 0, versions[rel][0], versions[rel][1]) for rel in readable
+        ]
+        extracted = self.extract_files(root, jobs)
+        persistent = self.get_index(root)
+        if persistent is not None:
+            persistent.flush()
+        texts: Dict[str, str] = {rel: self._content_text(content) for rel, (content, _) in zip(readable, extracted)}
+        return [texts.get(rel, "") for rel in rel_paths]
+
+    @classmethod
+    def _content_text(cls, content: str) -> str:
+        """Strips the (possibly indented) "Content:" header of text files, so that line N is line N of the file."""
+        body: str = content.lstrip(" ")
+        return body[len(cls._CONTENT_HEADER):] if body.startswith(cls._CONTENT_HEADER) else content
+
+    def rank_files(self, folder_path: str, prompt: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """Ranks the project's files against a question by BM25 over their contents."""
+        return self.search_index(folder_path).search(prompt, limit)
+
+    def local_select_files(self, folder_path: str, prompt: str, limit: int = 8) -> List[str]:
+        """
+        Guesses the files a question is about without calling a model: explicitly
+        named files score highest, then files whose name, then whose directories, share
+        terms with the question; the BM25 content ranking adds up to 4 points.
+        """
+        known_files: List[str] = self._structure_cache.get(os.path.abspath(folder_path), ([], []))[1]
+        lowered: str = prompt.lower()
+        mentioned: Set[str] = {word.lower() for word in re.findall(r"[\w.-]+\.\w+", prompt)}
+        query_terms: Set[str] = {t for t in split_identifier_terms(prompt) if t not in QUERY_STOPWORDS and len(t) > 1}
+        if not query_terms and not mentioned:
+            return []
+
+        ranked: List[Tuple[str, float]] = self.rank_files(folder_path, prompt, limit=max(limit * 4, 20))
+        best: float = ranked[0][1] if ranked else 1.0
+        content_scores: Dict[str, float] = {rel: 4.0 * score / best for rel, score in ranked}
+
+        scored: List[Tuple[float, str]] = []
+        for rel in known_files:
+            rel_posix: str = rel.replace("\\", "/")
+            name: str = rel_posix.rsplit("/", 1)[-1]
+            stem: str = name.rsplit(".", 1)[0]
+            score: float = 0.0
+            if name.lower() in mentioned or rel_posix.lower() in lowered:
+                score += 10.0
+            elif len(stem) > 2 and re.search(rf"\b{re.escape(stem.lower())}\b", lowered):
+                score += 4.0
+            name_terms: Set[str] = set(split_identifier_terms(stem))
+            dir_terms: Set[str] = set(split_identifier_terms(rel_posix[:-len(name)]))
+            score += 2.0 * len(query_terms & name_terms) + 1.0 * len(query_terms & (dir_terms - name_terms))
+            score += content_scores.get(rel, 0.0)
+            if score > 0:
+                scored.append((score, rel))
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [rel for _, rel in scored[:limit]]
+
+    def get_matcher(self, folder_path: str, reset: bool = False) -> IgnoreMatcher:
+        """Returns the exclusion matcher of a root, compiling a fresh one on reset."""
+        root: str = os.path.abspath(folder_path)
+        matcher = self._matchers.get(root)
+        if matcher is None or reset:
+            # Plain names are already handled by the exclusion set lookup in scan_directory
+            patterns: List[str] = [x for x in sorted(self.exclusions) if any(ch in x for ch in '*?[/!\\')]
+            matcher = IgnoreMatcher(patterns, use_ignore_files=self.respect_ignore_files)
+            self._matchers[root] = matcher
+        return matcher
+
+    def scan_directory(self, dir_path: str, rel_dir: str = "", matcher: Optional[IgnoreMatcher] = None) -> Tuple[List[Tuple[str, bool, os.DirEntry]], Optional[str]]:
+        """
+        Lists a single directory with os.scandir, applying exclusions and the extension filter.
+
+        Returns the (name, is_dir, entry) tuples sorted by name, plus an error message
+        if the directory could not be opened. Type checks come from the cached DirEntry data.
+        With a matcher, the directory's own ignore files are loaded before its entries are filtered.
+        """
+        try:
+            with os.scandir(dir_path) as it:
+                raw_entries: List[os.DirEntry] = list(it)
+        except OSError as ex:
+            return [], str(ex)
+
+        chain: List[Tuple[str, _IgnoreRuleSet]] = []
+        rel_prefix: str = ""
+        if matcher is not None:
+            rel_posix: str = rel_dir.replace(os.sep, '/')
+            matcher.load_directory(dir_path, rel_posix, {e.name for e in raw_entries})
+            chain = matcher.rules_for(rel_posix)
+            rel_prefix = f"{rel_posix}/" if rel_posix else ""
+
+        check_rules: bool = matcher is not None and (bool(chain) or not matcher.user_rules.is_empty)
+        entries: List[Tuple[str, bool, os.DirEntry]] = []
+        for entry in raw_entries:
+            name: str = entry.name
+            if name in self.exclusions:
+                continue
+            try:
+                is_dir: bool = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir and os.path.splitext(name)[1].lower() not in self.extensions:
+                continue
+            if check_rules and matcher.is_excluded(chain, rel_prefix + name, name, is_dir):
+                continue
+            entries.append((name, is_dir, entry))
+
+        entries.sort(key=lambda e: e[0])
+        return entries, None
+
+    def scan_tree(self, folder_path: str, start_rel: str = "") -> Dict[str, Tuple[List[Tuple[str, bool, os.DirEntry]], Optional[str]]]:
+        """
+        Lists every directory below folder_path/start_rel, serially or with the thread pool.
+
+        Returns listings keyed by directory path relative to folder_path ("" for the root).
+        Ordering is left to render_tree, which emits them in sorted depth-first order.
+        """
+        if self.max_workers > 1:
+            return self.scan_tree_parallel(folder_path, start_rel)
+
+        matcher: IgnoreMatcher = self.get_matcher(folder_path)
+        listings: Dict[str, Tuple[List[Tuple[str, bool, os.DirEntry]], Optional[str]]] = {}
+        stack: List[str] = [start_rel]
+        while stack:
+            rel_dir: str = stack.pop()
+            listing, error = self.scan_directory(os.path.join(folder_path, rel_dir), rel_dir, matcher)
+            listings[rel_dir] = (listing, error)
+            stack.extend(self._subdirectories(folder_path, rel_dir, listing))
+        return listings
+
+    def scan_tree_parallel(self, folder_path: str, start_rel: str = "") -> Dict[str, Tuple[List[Tuple[str, bool, os.DirEntry]], Optional[str]]]:
+        """
+        Lists every directory below folder_path/start_rel using a pool of max_workers threads.
+
+        Subdirectories are submitted as soon as their parent listing completes, so
+        high-latency listings (e.g. NFS) overlap.
+        """
+        matcher: IgnoreMatcher = self.get_matcher(folder_path)
+        listings: Dict[str, Tuple[List[Tuple[str, bool, os.DirEntry]], Optional[str]]] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dmc-scan") as pool:
+            pending: Dict[Future, str] = {
+                pool.submit(self.scan_directory, os.path.join(folder_path, start_rel), start_rel, matcher): start_rel
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel_dir: str = pending.pop(future)
+                    listing, error = future.result()
+                    listings[rel_dir] = (listing, error)
+                    for sub_rel in self._subdirectories(folder_path, rel_dir, listing):
+                        pending[pool.submit(self.scan_directory, os.path.join(folder_path, sub_rel), sub_rel, matcher)] = sub_rel
+        return listings
+
+    def _subdirectories(self, folder_path: str, rel_dir: str, listing: List[Tuple[str, bool, os.DirEntry]]) -> List[str]:
+        """Relative paths of the subdirectories of a listing that the walk should descend into."""
+        subdirs: List[str] = []
+        for name, is_dir, entry in listing:
+            if not is_dir:
+                continue
+            sub_rel: str = os.path.join(rel_dir, name)
+            if self._should_descend(entry, os.path.join(folder_path, sub_rel)):
+                subdirs.append(sub_rel)
+        return subdirs
+
+    def render_tree(self, folder_path: str, listings: Dict[str, Tuple[List[Tuple[str, bool, os.DirEntry]], Optional[str]]], indent_level: int = 0) -> Tuple[List[str], List[str], List[Tuple[str, int, os.DirEntry]]]:
+        """
+        Renders directory listings into the indented structure text, without any I/O.
+
+        Returns the structure lines, the relative paths of the listed files, and
+        (path, indent level, DirEntry) for each file in tree order. The walk is iterative
+        (an explicit stack of directory iterators), so deep trees cannot hit the recursion limit.
+        """
+        structure_output: List[str] = []
+        file_paths: List[str] = []
+        files: List[Tuple[str, int, os.DirEntry]] = []
+
+        listing, error = listings[""]
+        if error is not None:
+            return [f"{'    ' * indent_level}[Cannot open: {error}]"], file_paths, files
+
+        # Each frame: (directory path relative to the root, indentation level,
+        # iterator over its sorted entries)
+        stack: List[Tuple[str, int, Any]] = [("", indent_level, iter(listing))]
+        while stack:
+            rel_dir, level, entries = stack[-1]
+            next_entry = next(entries, None)
+            if next_entry is None:
+                stack.pop()
+                continue
+
+            item, is_dir, dir_entry = next_entry
+            indent: str = '    ' * level
+            rel_path: str = f"{rel_dir}{os.sep}{item}" if rel_dir else item
+
+            if is_dir:
+                structure_output.append(f"{indent}{item}/")
+                sub = listings.get(rel_path)
+                if sub is None:
+                    # Not descended into (symlink loop)
                     continue
-                    
-                content_output.append(f"\n{'    ' * indent_level}File: {item_path}")
-                try:
-                    file_size = os.path.getsize(item_path)
-                    stats['size'] += file_size
-                    
-                    # Skip large files to prevent performance issues
-                    if file_size > 100 * 1024:
-                        content_output.append(f"{'    ' * indent_level}[File too large to display]")
-                    else:
-                        file_content, file_stats = self.extract_file_content(item_path, indent_level)
-                        content_output.append(file_content)
-                        for key in stats:
-                            if key in file_stats:
-                                stats[key] += file_stats[key]
-                except Exception as e:
-                    content_output.append(f"{'    ' * indent_level}[Error reading file: {str(e)}]")
-                    
+                if sub[1] is not None:
+                    structure_output.append(f"{'    ' * (level + 1)}[Cannot open: {sub[1]}]")
+                    continue
+                stack.append((rel_path, level + 1, iter(sub[0])))
+                continue
+
+            structure_output.append(f"{indent}{item}")
+            file_paths.append(rel_path)
+            files.append((dir_entry.path, level, dir_entry))
+
+        return structure_output, file_paths, files
+
+    def _is_path_excluded(self, folder_path: str, parts: List[str]) -> bool:
+        """Checks each component of a relative path against the exclusion rules."""
+        matcher: IgnoreMatcher = self.get_matcher(folder_path)
+        for depth, name in enumerate(parts):
+            if name in self.exclusions:
+                return True
+            rel_dir: str = '/'.join(parts[:depth])
+            rel_path: str = '/'.join(parts[:depth + 1])
+            if matcher.is_excluded(matcher.rules_for(rel_dir), rel_path, name, depth < len(parts) - 1):
+                return True
+        return False
+
+    def get_folder_structure_and_content(self, folder_path: str, indent_level: int = 0, extract_content: bool = True) -> Tuple[List[str], List[str], Dict[str, int]]:
+        """
+        Traverses the folder to build structure and content lists.
+
+        Directories are listed first (see scan_tree), then rendered in sorted depth-first
+        order; the listings are kept so that watched changes can be patched in with
+        refresh_directories instead of a full rescan.
+        """
+        content_output: List[str] = []
+        stats: Dict[str, int] = {'words': 0, 'lines': 0, 'characters': 0, 'tokens': 0, 'size': 0}
+
+        self.get_matcher(folder_path, reset=True)
+        listings = self.scan_tree(folder_path)
+        structure_output, file_paths, files = self.render_tree(folder_path, listings, indent_level)
+
+        root: str = os.path.abspath(folder_path)
+        self._trees[root] = listings
+        self._structure_cache[root] = (structure_output, file_paths)
+
+        if not extract_content:
+            return structure_output, content_output, stats
+
+        # Extraction jobs are collected in tree order and resolved in one batch;
+        # content_slots[i] is where jobs[i]'s content goes in content_output
+        jobs: List[Tuple[str, int, int, int]] = []
+        content_slots: List[int] = []
+        for item_path, level, dir_entry in files:
+            indent: str = '    ' * level
+            content_output.append(f"\n{indent}File: {item_path}")
+            try:
+                file_stat = dir_entry.stat()
+                file_size = file_stat.st_size
+                stats['size'] += file_size
+
+                # Skip large files to prevent performance issues
+                if file_size > self.MAX_CONTENT_BYTES:
+                    content_output.append(f"{indent}[File too large to display]")
+                else:
+                    jobs.append((item_path, level, file_size, file_stat.st_mtime_ns))
+                    content_slots.append(len(content_output))
+                    content_output.append("")
+            except Exception as e:
+                content_output.append(f"{indent}[Error reading file: {str(e)}]")
+
+        if jobs:
+            for slot, (file_content, file_stats) in zip(content_slots, self.extract_files(folder_path, jobs)):
+                content_output[slot] = file_content
+                for key in stats:
+                    if key in file_stats:
+                        stats[key] += file_stats[key]
+
+        index = self.get_index(folder_path)
+        if index is not None:
+            index.flush()
+
         return structure_output, content_output, stats
 
+    def get_watch_directories(self, folder_path: str) -> List[str]:
+        """Absolute paths of every directory in the last walk of folder_path."""
+        listings = self._trees.get(os.path.abspath(folder_path), {})
+        return [os.path.normpath(os.path.join(os.path.abspath(folder_path), rel_dir)) for rel_dir in listings]
+
+    def refresh_directories(self, folder_path: str, changed_dirs: List[str]) -> bool:
+        """
+        Patches the stored tree of folder_path for the given changed directories.
+
+        Only those directories are re-listed (plus any newly created subtrees); subtrees
+        that disappeared are dropped, and cached contents of files in the changed
+        directories are evicted. The structure is then re-rendered from memory.
+        Returns True if the rendered structure changed.
+        """
+        root: str = os.path.abspath(folder_path)
+        listings = self._trees.get(root)
+        if listings is None:
+            return False
+
+        for changed in sorted(set(changed_dirs)):
+            rel_dir: str = os.path.relpath(os.path.abspath(changed), root)
+            if rel_dir == os.curdir:
+                rel_dir = ""
+            if rel_dir.startswith(os.pardir) or rel_dir not in listings:
+                continue
+
+            matcher: IgnoreMatcher = self.get_matcher(root)
+            rel_posix: str = rel_dir.replace(os.sep, '/')
+            try:
+                names: Set[str] = set(os.listdir(changed))
+            except OSError:
+                names = set()
+            if matcher.load_directory(changed, rel_posix, names):
+                # The directory's ignore rules changed: its whole subtree must be re-filtered
+                matcher.forget(rel_posix)
+                for key in [k for k in listings if k == rel_dir or k.startswith(rel_dir + os.sep) or not rel_dir]:
+                    del listings[key]
+                listings.update(self.scan_tree(root, rel_dir))
+                self.cache.discard_directory(os.path.join(root, rel_dir))
+                continue
+
+            old_listing = listings[rel_dir][0]
+            new_listing, error = self.scan_directory(changed, rel_dir, matcher)
+            listings[rel_dir] = (new_listing, error)
+            self.cache.discard_directory(os.path.join(root, rel_dir))
+
+            old_dirs: Set[str] = {name for name, is_dir, _ in old_listing if is_dir}
+            new_dirs: Set[str] = {name for name, is_dir, _ in new_listing if is_dir}
+
+            # Drop vanished subtrees
+            for name in old_dirs - new_dirs:
+                prefix: str = os.path.join(rel_dir, name)
+                for key in [k for k in listings if k == prefix or k.startswith(prefix + os.sep)]:
+                    del listings[key]
+
+            # Scan newly created subtrees
+            for sub_rel in self._subdirectories(root, rel_dir, new_listing):
+                if os.path.basename(sub_rel) not in old_dirs:
+                    listings.update(self.scan_tree(root, sub_rel))
+
+        old_structure = self._structure_cache.get(root, ([], []))[0]
+        structure_output, file_paths, _ = self.render_tree(folder_path, listings)
+        self._structure_cache[root] = (structure_output, file_paths)
+        return structure_output != old_structure
+
+    def render_structure_text(self, folder_path: str) -> str:
+        """Structure-only report (as build_context with extract_content=False) from the stored tree."""
+        root: str = os.path.abspath(folder_path)
+        if root not in self._structure_cache:
+            return self.build_context(folder_path, extract_content=False)
+        return "\n".join(["FOLDER STRUCTURE:"] + self._structure_cache[root][0]).strip()
+
+    # --- Compact Structure ---
+    # Files of a directory sharing an extension (and, first, a name prefix) are grouped from this many on
+    COMPACT_GROUP_MIN: int = 5
+    _NAME_PREFIX_RE = re.compile(r"[^_\-.\d]+[_\-.]")
+
+    def compact_structure(self, folder_path: str, token_budget: Optional[int] = None) -> str:
+        """
+        Structure report for the Brain, encoded from the stored tree: one line per
+        directory listing its files, nesting shown by one space per level, and chains
+        of single-child directories joined ("src/app/"). This loses nothing; when it
+        exceeds token_budget, files are grouped by name prefix ("test_*.py (142 files)"),
+        then by extension, then the deepest directories are only summarized
+        ("docs/ [310 files: 300 .md, 10 .png]") until it fits.
+
+        Generated once per tree version (and budget), like _structure_token_count.
+        """
+        root: str = os.path.abspath(folder_path)
+        if root not in self._structure_cache:
+            self.get_folder_structure_and_content(folder_path, extract_content=False)
+        lines, file_paths = self._structure_cache[root]
+        memo = self._compact_structures.get(root)
+        if memo is not None and memo[0] is lines and memo[1] == token_budget:
+            return memo[2]
+
+        tree = self._file_tree(file_paths)
+        depth: int = self._tree_depth(tree)
+        # Least compressed first: full listing, prefix groups, extension groups, then shallower summaries
+        levels: List[Tuple[int, Optional[int]]] = [(0, None), (1, None), (2, None)]
+        levels += [(2, max_depth) for max_depth in range(depth - 1, -1, -1)]
+        text: Optional[str] = None
+        for grouping, max_depth in levels:
+            # Paths take at least 2 characters per token, so renders are cut short past that
+            text = self._render_compact(tree, grouping, max_depth, None if token_budget is None else 2 * token_budget)
+            if text is not None and (token_budget is None or count_tokens(text) <= token_budget):
+                break
+        else:
+            # Even top-level summaries are too long: keep the lines that fit
+            text = self._truncate_to_tokens(self._render_compact(tree, 2, 0), max(0, token_budget - 20))
+
+        self._compact_structures[root] = (lines, token_budget, text)
+        return text
+
+    @staticmethod
+    def _file_tree(file_paths: List[str]) -> Dict[str, Any]:
+        """
+        Nested {"dirs", "files", "total", "exts", "rendered"} nodes of the listed files, in
+        tree order; total and exts count the files of the whole subtree.
+        """
+        def node() -> Dict[str, Any]:
+            return {"dirs": {}, "files": [], "total": 0, "exts": {}, "rendered": {}}
+
+        tree: Dict[str, Any] = node()
+        nodes: Dict[str, Dict[str, Any]] = {"": tree}
+        for rel_path in file_paths:
+            directory, _, name = rel_path.rpartition(os.sep)
+            current = nodes.get(directory)
+            if current is None:
+                current, prefix = tree, ""
+                for part in directory.split(os.sep):
+                    prefix = f"{prefix}{os.sep}{part}" if prefix else part
+                    current = current["dirs"].setdefault(part, node())
+                    nodes[prefix] = current
+            current["files"].append(name)
+            ext: str = _file_extension(name).lower()
+            current["exts"][ext] = current["exts"].get(ext, 0) + 1
+            current["total"] += 1
+
+        # Subtree counts, deepest directories first
+        for directory in sorted(nodes, key=lambda d: -d.count(os.sep) if d else 1):
+            if not directory:
+                continue
+            current, parent = nodes[directory], nodes[directory.rpartition(os.sep)[0]]
+            parent["total"] += current["total"]
+            for ext, count in current["exts"].items():
+                parent["exts"][ext] = parent["exts"].get(ext, 0) + count
+        return tree
+
+    @staticmethod
+    def _tree_depth(tree: Dict[str, Any]) -> int:
+        depth: int = 0
+        stack: List[Tuple[Dict[str, Any], int]] = [(tree, 0)]
+        while stack:
+            current, level = stack.pop()
+            depth = max(depth, level)
+            stack.extend((child, level + 1) for child in current["dirs"].values())
+        return depth
+
+    def _render_compact(self, tree: Dict[str, Any], grouping: int, max_depth: Optional[int], max_chars: Optional[int] = None) -> Optional[str]:
+        """
+        Renders a _file_tree: grouping 0 lists every file, 1 groups files sharing a name
+        prefix, 2 also groups the rest by extension; directories at max_depth are summarized.
+        Returns None as soon as the text exceeds max_chars.
+        """
+        lines: List[str] = []
+        if tree["files"]:
+            lines.append("./: " + self._compact_files(tree["files"], grouping))
+        size: int = sum(len(line) + 1 for line in lines)
+        summarized: bool = False
+        stack: List[Tuple[str, Dict[str, Any], int]] = [(name + "/", child, 0) for name, child in reversed(tree["dirs"].items())]
+        while stack:
+            label, current, level = stack.pop()
+            # Join chains of directories that only hold one directory
+            while not current["files"] and len(current["dirs"]) == 1:
+                name, current = next(iter(current["dirs"].items()))
+                label += name + "/"
+            indent: str = " " * level
+            if max_depth is not None and level >= max_depth and current["dirs"]:
+                summarized = True
+                kinds = sorted(current["exts"].items(), key=lambda item: -item[1])
+                described: List[str] = [f"{count} {ext or 'without extension'}" for ext, count in kinds[:3]]
+                if len(kinds) > 3:
+                    described.append(f"{sum(count for _, count in kinds[3:])} other")
+                lines.append(f"{indent}{label} [{current['total']} files: {', '.join(described)}]")
+            else:
+                # Directory lines are shared by the renders of one tree
+                files: Optional[str] = current["rendered"].get(grouping)
+                if files is None:
+                    files = current["rendered"][grouping] = self._compact_files(current["files"], grouping)
+                lines.append(f"{indent}{label}: {files}" if files else f"{indent}{label}")
+                stack.extend((name + "/", child, level + 1) for name, child in reversed(current["dirs"].items()))
+            size += len(lines[-1]) + 1
+            if max_chars is not None and size > max_chars:
+                return None
+
+        legend: List[str] = [
+            "FOLDER STRUCTURE (compact: one line per directory, its files after the colon; "
+            "subdirectories indented by one space; single-child directories joined as a/b/):"
+        ]
+        if grouping:
+            legend.append(
+                "`name*.ext (N files)` stands for N files of its directory matching the pattern; to select them, "
+                "return the pattern after its directory's full path (e.g. `src/tests/test_*.py`, `./*.md` at the root)."
+            )
+        if summarized:
+            legend.append("`dir/ [N files: ...]` summarizes a directory whose files are not listed; return its full path to select from it.")
+        return "\n".join(legend + lines)
+
+    def _compact_files(self, names: List[str], grouping: int) -> str:
+        """A directory's files, comma separated, with similar files grouped per the grouping level."""
+        if not grouping or len(names) < self.COMPACT_GROUP_MIN:
+            return ", ".join(names)
+        by_ext: Dict[str, List[str]] = {}
+        for name in names:
+            by_ext.setdefault(_file_extension(name), []).append(name)
+        parts: List[str] = []
+        for ext, group in by_ext.items():
+            if len(group) < self.COMPACT_GROUP_MIN:
+                parts.extend(group)
+                continue
+            by_prefix: Dict[str, List[str]] = {}
+            for name in group:
+                match = self._NAME_PREFIX_RE.match(name[:len(name) - len(ext)])
+                by_prefix.setdefault(match.group(0) if match else "", []).append(name)
+            rest: List[str] = []
+            for prefix, members in by_prefix.items():
+                if prefix and len(members) >= self.COMPACT_GROUP_MIN:
+                    parts.append(f"{prefix}*{ext} ({len(members)} files)")
+                else:
+                    rest.extend(members)
+            if grouping >= 2 and len(rest) >= self.COMPACT_GROUP_MIN:
+                parts.append(f"*{ext} ({len(rest)} files)")
+            else:
+                parts.extend(rest)
+        return ", ".join(parts)
+
+    @staticmethod
+    def _should_descend(entry: os.DirEntry, dir_path: str) -> bool:
+        """False for a symlinked directory that points at itself or one of its ancestors."""
+        if not entry.is_symlink():
+            return True
+        try:
+            target: str = os.path.realpath(dir_path)
+            parent: str = os.path.realpath(os.path.dirname(dir_path))
+            return os.path.commonpath([target, parent]) != target
+        except (OSError, ValueError):
+            return False
+
     def extract_file_content(self, filepath: str, indent_level: int = 0) -> Tuple[str, Dict[str, int]]:
         """Determines file type and delegates extraction to the appropriate method."""
         ext: str = os.path.splitext(filepath)[1].lower()
@@ -380,9 +3889,10 @@ class ProjectContextExtractor(QtCore.QObject):
                 stats['words'] = len(file_content.split())
                 stats['lines'] = file_content.count('\n')
                 stats['characters'] = len(file_content)
-                stats['tokens'] = len(file_content.split())
+                stats['tokens'] = count_tokens(file_content)
             except Exception as e:
                 content = f"{indent}[Error reading text file: {e}]"
+                stats['error'] = 1
         
         elif ext in {'.xlsx', '.xls'}:
             content, stats = self.extract_excel_content(filepath, indent_level)
@@ -413,13 +3923,13 @@ class ProjectContextExtractor(QtCore.QObject):
                 for sheet in wb.sheetnames:
                     ws = wb[sheet]
                     content_lines.append(f"{indent}Sheet: {sheet}")
-                    for row in ws.iter_rows(max_rows=50, max_cols=20, values_only=True):
+                    for row in ws.iter_rows(max_row=50, max_col=20, values_only=True):
                         row_str = "\t".join([str(cell)[:50] if cell is not None else "" for cell in row])
                         content_lines.append(f"{indent}{row_str}")
                         stats['lines'] += 1
                         stats['words'] += len(row_str.split())
                         stats['characters'] += len(row_str)
-                        stats['tokens'] += len(row_str.split())
+                        stats['tokens'] += count_tokens(row_str)
                         
             elif ext == '.xls' and xlrd:
                 wb = xlrd.open_workbook(filepath)
@@ -432,11 +3942,12 @@ class ProjectContextExtractor(QtCore.QObject):
                         stats['lines'] += 1
                         stats['words'] += len(row_str.split())
                         stats['characters'] += len(row_str)
-                        stats['tokens'] += len(row_str.split())
+                        stats['tokens'] += count_tokens(row_str)
             else:
                 content_lines.append(f"{indent}[Excel library not installed or unknown format]")
         except Exception as e:
             content_lines.append(f"{indent}[Error reading Excel file: {str(e)}]")
+            stats['error'] = 1
             
         return "\n".join(content_lines), stats
 
@@ -465,9 +3976,10 @@ class ProjectContextExtractor(QtCore.QObject):
                 stats['lines'] += cell_text.count('\n') + 1
                 stats['words'] += len(cell_text.split())
                 stats['characters'] += len(cell_text)
-                stats['tokens'] += len(cell_text.split())
+                stats['tokens'] += count_tokens(cell_text)
         except Exception as e:
             content_lines.append(f"{indent}[Error reading ipynb: {str(e)}]")
+            stats['error'] = 1
             
         return "\n".join(content_lines), stats
 
@@ -485,13 +3997,25 @@ class ProjectContextExtractor(QtCore.QObject):
                 stats['lines'] += 1
                 stats['words'] += len(text.split())
                 stats['characters'] += len(text)
-                stats['tokens'] += len(text.split())
+                stats['tokens'] += count_tokens(text)
         except Exception as e:
             content_lines.append(f"{indent}[Error reading docx: {str(e)}]")
+            stats['error'] = 1
             
         return "\n".join(content_lines), stats
 
 
+_process_extractor: Optional[ProjectContextExtractor] = None
+
+
+def _extract_file_in_process(filepath: str) -> Tuple[str, Dict[str, int]]:
+    """Process-pool entry point: extracts one file, un-indented."""
+    global _process_extractor
+    if _process_extractor is None:
+        _process_extractor = ProjectContextExtractor()
+    return _process_extractor.extract_file_content(filepath)
+
+
 # -----------------------------------------------------------------------------
 # Markdown Rendering Logic
 # -----------------------------------------------------------------------------